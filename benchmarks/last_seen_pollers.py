@@ -0,0 +1,90 @@
+#! /usr/bin/env python3.5
+"""A benchmark for the last seen pull server (main_code/last_seen_server.py), with many concurrent pollers.
+
+Every poller polls the pages of a server's last seen records in a loop, sending back the etag it got last time in If-None-Match the way a real poller
+would, and the benchmark reports the requests per second, the p50/p99 latencies and how many responses were full (200) vs not modified (304).
+Run the bot with the pull_server of the webserver_config enabled, and then for example:
+    python3.5 benchmarks/last_seen_pollers.py --url http://127.0.0.1:8080 --auth-token test --server-ids 1234 5678 --pollers 200 --duration 20"""
+
+import argparse
+import asyncio
+import collections
+import time
+
+import aiohttp
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Returns the value at the fraction (0 to 1) of the sorted values, 0 if there are none."""
+    if not sorted_values:
+        return 0.
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+async def poll(session: aiohttp.ClientSession, args, server_id: str, deadline: float, latencies: list,
+               statuses: collections.Counter):
+    """Polls the pages of the server until the deadline, remembering the etag of every page."""
+    etags = {}
+    page = 0
+
+    while time.monotonic() < deadline:
+        headers = {"Authorization": "Bearer " + args.auth_token}
+        if page in etags:
+            headers["If-None-Match"] = etags[page]
+
+        start = time.perf_counter()
+        async with session.get("{0}/lastseen/{1}".format(args.url, server_id), headers=headers,
+                               params={"page": page, "per_page": args.per_page}) as response:
+            body = await response.json() if response.status == 200 else None
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status] += 1
+
+            if response.status in (200, 304):
+                etags[page] = response.headers.get("ETag")
+
+        # We go to the next page if there is one, and start over from the first one otherwise
+        if body is not None and (page + 1) * args.per_page < body["total"]:
+            page += 1
+        else:
+            page = 0
+
+        await asyncio.sleep(args.interval)
+
+
+async def run(args):
+    latencies = []
+    statuses = collections.Counter()
+    deadline = time.monotonic() + args.duration
+
+    # Every poller gets its own connection, like separate pollers would
+    connector = aiohttp.TCPConnector(limit=args.pollers)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.monotonic()
+        await asyncio.gather(*(poll(session, args, args.server_ids[i % len(args.server_ids)], deadline, latencies, statuses)
+                               for i in range(args.pollers)))
+        elapsed = time.monotonic() - start
+
+    latencies.sort()
+    print("{0} requests in {1:.1f} s ({2:.0f} per second) from {3} pollers".format(len(latencies), elapsed,
+                                                                                  len(latencies) / elapsed, args.pollers))
+    print("latency p50 {0:.2f} ms, p99 {1:.2f} ms".format(percentile(latencies, 0.5) * 1000,
+                                                          percentile(latencies, 0.99) * 1000))
+    print("statuses: " + ", ".join("{0}: {1}".format(status, count) for status, count in sorted(statuses.items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Polls the last seen pull server with many concurrent pollers, and reports latencies.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="the address of the pull server")
+    parser.add_argument("--auth-token", default="", help="the auth_token of the bot's webserver_config")
+    parser.add_argument("--server-ids", nargs="+", required=True, help="the ids of the servers to poll, the pollers are spread over them")
+    parser.add_argument("--pollers", type=int, default=100, help="number of concurrent pollers")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to poll for")
+    parser.add_argument("--interval", type=float, default=0.1, help="seconds every poller waits between its requests")
+    parser.add_argument("--per-page", type=int, default=100, help="page size to request")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
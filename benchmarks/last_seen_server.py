@@ -0,0 +1,101 @@
+#! /usr/bin/env python3.5
+"""A local stand-in for the last seen endpoints of anna-falcon-server, to test and measure the delta-sync protocol of main_code/last_seen_sync.py.
+
+It accepts gzipped full snapshots on /lastseen and deltas on /lastseen/delta, keeps the records in memory, and prints the size of every payload
+and how long it took to apply, so the payload sizes can be compared between snapshots and deltas under presence churn.
+Point the webserver_config of the bot at it (server_address 127.0.0.1 and the same port and auth_token), for example:
+    python3.5 benchmarks/last_seen_server.py --port 8765 --auth-token test
+Use --resync-every to make it answer every n-th delta with 409, which makes the bot send a full snapshot again.
+Use --legacy to make it behave like an older webserver, which only has /lastseen, only reads plain json and answers with an empty 200,
+to test that the bot falls back to uncompressed full snapshots."""
+
+import argparse
+import gzip
+import json
+import time
+
+from aiohttp import web
+
+
+class LastSeenStandIn:
+    """The records the stand-in has received, in the format of {server id: {user id: user json}}, and the version they're of."""
+
+    def __init__(self, auth_token: str, resync_every: int, legacy: bool):
+        self.auth_token = auth_token
+        self.resync_every = resync_every
+        self.legacy = legacy
+        self.servers = {}
+        self.version = None
+        self.deltas_received = 0
+
+    async def read_payload(self, request: web.Request):
+        """Reads the (possibly gzipped) json body of a request, returns it and the size it had on the wire."""
+        body = await request.read()
+        raw = gzip.decompress(body) if body[:2] == b"\x1f\x8b" else body
+        return json.loads(raw.decode("utf-8")), len(body)
+
+    def report(self, kind: str, wire_size: int, start: float, changes: int):
+        users = sum(len(server_records) for server_records in self.servers.values())
+        print("{0}: {1} bytes on the wire, {2} changes, applied in {3:.2f} ms, now at version {4} with {5} users".format(
+            kind, wire_size, changes, (time.perf_counter() - start) * 1000, self.version, users))
+
+    async def handle_snapshot(self, request: web.Request):
+        if self.legacy and request.headers.get("Content-Encoding") == "gzip":
+            print("gzipped snapshot refused, like an older webserver would")
+            return web.Response(status=400)
+
+        payload, wire_size = await self.read_payload(request)
+        if payload.get("auth_token") != self.auth_token:
+            return web.Response(status=403)
+
+        start = time.perf_counter()
+        self.servers = {server["server_id"]: {user["user_id"]: user for user in server["users"]}
+                        for server in payload["servers"]}
+        self.version = payload.get("version")
+
+        self.report("snapshot", wire_size, start, sum(len(server["users"]) for server in payload["servers"]))
+        return web.Response() if self.legacy else web.json_response({"version": self.version})
+
+    async def handle_delta(self, request: web.Request):
+        payload, wire_size = await self.read_payload(request)
+        if payload.get("auth_token") != self.auth_token:
+            return web.Response(status=403)
+
+        # We can only apply a delta on top of the version we have
+        self.deltas_received += 1
+        if self.version is None or payload["base_version"] != self.version or (
+                self.resync_every and self.deltas_received % self.resync_every == 0):
+            print("delta from version {0} refused, asking for a resync".format(payload["base_version"]))
+            return web.Response(status=409)
+
+        start = time.perf_counter()
+        for user in payload["upserts"]:
+            self.servers.setdefault(user["server_id"], {})[user["user_id"]] = user
+        for user in payload["deletes"]:
+            self.servers.get(user["server_id"], {}).pop(user["user_id"], None)
+        self.version = payload["version"]
+
+        self.report("delta", wire_size, start, len(payload["upserts"]) + len(payload["deletes"]))
+        return web.json_response({"version": self.version})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="A local stand-in for the last seen endpoints of anna-falcon-server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--auth-token", default="", help="the auth_token of the bot's webserver_config")
+    parser.add_argument("--resync-every", type=int, default=0, help="refuse every n-th delta with 409, 0 to never refuse")
+    parser.add_argument("--legacy", action="store_true", help="behave like an older webserver without versions, deltas or gzip support")
+    args = parser.parse_args()
+
+    stand_in = LastSeenStandIn(args.auth_token, args.resync_every, args.legacy)
+
+    app = web.Application()
+    app.router.add_post("/lastseen", stand_in.handle_snapshot)
+    if not args.legacy:
+        app.router.add_post("/lastseen/delta", stand_in.handle_delta)
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
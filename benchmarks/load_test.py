@@ -0,0 +1,701 @@
+#! /usr/bin/env python3.5
+"""An offline load test for anna-bot's event handlers.
+
+This imports bot_main with a fake discord client (and local stand-ins for the external http apis), so it never touches the network.
+It then replays a synthetic stream of server messages, server commands, PM commands, member joins and presence updates into
+on_message, on_member_join and on_member_update at a configurable rate, and reports the throughput, the p50/p99 latency of every kind of event
+(and, separately, of the commands and referral answers that were run), and the event loop lag.
+
+Run it from anywhere with the bot's dependencies installed, for example:
+    python3.5 benchmarks/load_test.py --rate 500 --duration 20 --servers 50 --members 200
+Everything the bot writes (config, logs, persistent state) goes into a temporary directory that is removed afterwards."""
+
+import argparse
+import asyncio
+import collections
+import copy
+import datetime
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# The directory that bot_main.py is in
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The commands that are replayed, with the weight of how often they're used, the commands are chosen so they don't need a voice connection
+# or write to the persistent state of the repository itself. {mention} is replaced by the mention of a random member of the server.
+server_command_mix = {"help": 1, "anna-stats": 4, "whoru": 4, "whois {mention}": 6, "cat": 4, "dog": 4, "kitten": 1, "role list": 3,
+                      "list ids": 1, "stop chess": 3, "this is not a command": 5}
+pm_command_mix = {"help": 1, "anna-stats": 4, "whoru": 4, "cat": 2, "dog": 2, "stop chess": 2}
+
+# The default mix of events, the weights of how often each kind of event is replayed
+default_event_mix = {"message": 50, "command": 10, "pm_command": 5, "join": 2, "presence": 33}
+
+# The latencies that measure how long the work that an event handler started took to run, instead of how long the handler took to return
+execution_kinds = ("command_run", "referral_run")
+
+
+class NoopResult:
+    """What the fake client's unknown methods return, it's falsy and awaiting it returns None, so it works for both sync and async methods."""
+
+    def __await__(self):
+        return iter(())
+
+    def __bool__(self):
+        return False
+
+
+class FakePermissions:
+    """Permissions that don't allow anything."""
+
+    def __getattr__(self, name):
+        return False
+
+
+class FakeRole:
+    def __init__(self, role_id: str, name: str, position: int, server):
+        self.id = role_id
+        self.name = name
+        self.position = position
+        self.server = server
+        self.is_everyone = position == 0
+        self.mention = "<@&{0}>".format(role_id)
+
+
+class FakeUser:
+    """A fake discord.Member (or discord.User, if server is None)."""
+
+    def __init__(self, user_id: str, name: str, server=None, bot: bool = False):
+        import discord
+
+        self.id = user_id
+        self.name = name
+        self.display_name = name
+        self.discriminator = str(int(user_id) % 10000).zfill(4)
+        self.mention = "<@{0}>".format(user_id)
+        self.bot = bot
+        self.avatar_url = ""
+        self.default_avatar_url = "https://discordapp.com/assets/default.png"
+        self.server = server
+        self.roles = [server.default_role] if server is not None else []
+        self.top_role = server.default_role if server is not None else None
+        self.status = discord.Status.online
+        self.game = None
+        self.nick = None
+        self.joined_at = datetime.datetime.utcnow()
+        self.server_permissions = FakePermissions()
+
+    def __str__(self):
+        return "{0}#{1}".format(self.name, self.discriminator)
+
+
+class FakeChannel:
+    def __init__(self, channel_id: str, name, server=None, user=None):
+        import discord
+
+        self.id = channel_id
+        self.name = name
+        self.server = server
+        self.user = user
+        self.is_private = server is None
+        self.type = discord.ChannelType.private if self.is_private else discord.ChannelType.text
+        self.mention = "<#{0}>".format(channel_id)
+
+
+class FakeServer:
+    def __init__(self, server_id: str, name: str, bot_user_id: str, next_id):
+        self.id = server_id
+        self.name = name
+        self.default_role = FakeRole(server_id, "@everyone", 0, self)
+        self.roles = [self.default_role]
+        self.channels = [FakeChannel(next_id(), "general", self)]
+        self.members = []
+        self.me = FakeUser(bot_user_id, "anna-bot", self, bot=True)
+        self.owner = self.me
+
+    def get_member(self, user_id: str):
+        return next((member for member in self.members if member.id == user_id), None)
+
+    def get_member_named(self, name: str):
+        for member in self.members:
+            if name in (str(member), member.name, member.nick):
+                return member
+
+
+def make_message_class():
+    """Creates the fake message class, this has to subclass discord.Message, as the helpers check if they got a message with isinstance."""
+    import discord
+
+    class FakeMessage(discord.Message):
+        def __init__(self, message_id: str, content: str, author: FakeUser, channel: FakeChannel):
+            self.id = message_id
+            self.content = content
+            self.author = author
+            self.channel = channel
+            self.server = channel.server
+            self.attachments = []
+            self.mentions = []
+            self.embeds = []
+            self.timestamp = datetime.datetime.utcnow()
+            self.type = discord.MessageType.default
+
+    return FakeMessage
+
+
+class FakeClient:
+    """Stands in for discord.Client. It records the api calls the bot makes, waits api_latency seconds in send_message,
+    resolves wait_for_message like discord.py does (before on_message is dispatched), and sends the bot's own messages back through on_message."""
+
+    def __init__(self, *args, **kwargs):
+        self.loop = asyncio.get_event_loop()
+        self.user = FakeUser("100000000000000001", "anna-bot", bot=True)
+        self.servers = []
+        self.channels = {}
+        self.private_channels = {}
+        self.api_latency = 0.
+        self.max_wait_seconds = 2.
+        self.calls = collections.Counter()
+        self.message_class = None
+        self.message_ids = None
+        self.background_tasks = set()
+
+        # The pending wait_for_message calls, as [future, author, channel, check] lists
+        self.waiters = []
+
+    def event(self, coroutine):
+        setattr(self, coroutine.__name__, coroutine)
+        return coroutine
+
+    def __getattr__(self, name):
+        # Every api method that we haven't faked is just counted
+        def noop(*args, **kwargs):
+            self.calls[name] += 1
+            return NoopResult()
+
+        return noop
+
+    def get_channel(self, channel_id: str):
+        return self.channels.get(channel_id)
+
+    def get_server(self, server_id: str):
+        return next((server for server in self.servers if server.id == server_id), None)
+
+    def is_voice_connected(self, server):
+        return False
+
+    def voice_client_in(self, server):
+        return None
+
+    def get_private_channel(self, user: FakeUser) -> FakeChannel:
+        if user.id not in self.private_channels:
+            self.private_channels[user.id] = FakeChannel(user.id, None, user=user)
+            self.channels[user.id] = self.private_channels[user.id]
+
+        return self.private_channels[user.id]
+
+    async def send_message(self, destination, content=None, *, tts=False, embed=None):
+        self.calls["send_message"] += 1
+        await asyncio.sleep(self.api_latency)
+
+        channel = destination if isinstance(destination, FakeChannel) else self.get_private_channel(destination)
+        sent_message = self.message_class(next(self.message_ids), content or "", self.user, channel)
+
+        # The gateway sends our own messages back to us
+        self.spawn(self.dispatch_message(sent_message))
+        return sent_message
+
+    async def send_file(self, destination, fp, *, filename=None, content=None, tts=False):
+        return await self.send_message(destination, content)
+
+    async def wait_for_message(self, timeout=None, *, author=None, channel=None, content=None, check=None):
+        future = self.loop.create_future()
+        waiter = [future, author, channel, check]
+        self.waiters.append(waiter)
+
+        # We don't wait longer than max_wait_seconds, so timeouts of minutes don't hold the test up
+        try:
+            return await asyncio.wait_for(future, min(timeout or self.max_wait_seconds, self.max_wait_seconds))
+        except asyncio.TimeoutError:
+            return None
+        finally:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+
+    async def dispatch_message(self, message):
+        """Does what discord.py does with a message from the gateway: resolve the waiting wait_for_message calls, then call on_message."""
+        for waiter in list(self.waiters):
+            future, author, channel, check = waiter
+            if future.done():
+                continue
+            if author is not None and author.id != message.author.id:
+                continue
+            if channel is not None and channel.id != message.channel.id:
+                continue
+            if check is not None and not check(message):
+                continue
+
+            future.set_result(message)
+            self.waiters.remove(waiter)
+
+        await self.on_message(message)
+
+    def spawn(self, coroutine):
+        """Runs the coroutine as a task that is waited for before the results are reported."""
+        task = self.loop.create_task(coroutine)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+
+class FakeResponse:
+    """A canned http response from one of the local api stand-ins."""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.status = 200
+
+        if "random.cat" in url:
+            self.body = json.dumps({"file": "http://stand-in.local/cat.jpg"})
+        elif "random.dog/woof.json" in url:
+            self.body = json.dumps({"url": "http://stand-in.local/dog.jpg"})
+        elif "mashape.com" in url:
+            self.body = json.dumps({"source": "http://stand-in.local/kitten.jpg"})
+        else:
+            self.body = "{}"
+
+    async def text(self):
+        return self.body
+
+    async def json(self):
+        return json.loads(self.body)
+
+    async def read(self):
+        return self.body.encode("utf-8")
+
+    def close(self):
+        pass
+
+    def release(self):
+        pass
+
+
+class FakeRequest:
+    """The result of a fake session request, this works both with await and async with, just like in aiohttp."""
+
+    def __init__(self, session, url: str):
+        self.session = session
+        self.url = url
+
+    async def _respond(self):
+        self.session.calls[self.url.split("/")[2] if "//" in self.url else self.url] += 1
+        await asyncio.sleep(self.session.api_latency)
+        return FakeResponse(self.url)
+
+    def __await__(self):
+        return self._respond().__await__()
+
+    async def __aenter__(self):
+        return await self._respond()
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+
+def make_session_class(calls: collections.Counter, api_latency: float):
+    """Creates the aiohttp.ClientSession stand-in, all the sessions count their requests in the same counter."""
+
+    class FakeClientSession:
+        def __init__(self, *args, **kwargs):
+            self.calls = calls
+            self.api_latency = api_latency
+
+        async def __aenter__(self):
+            return self
+
+        async def __aexit__(self, *exc_info):
+            return False
+
+        def close(self):
+            pass
+
+        def request(self, method: str, url: str, *args, **kwargs):
+            return FakeRequest(self, url)
+
+        def get(self, url: str, *args, **kwargs):
+            return FakeRequest(self, url)
+
+        def post(self, url: str, *args, **kwargs):
+            return FakeRequest(self, url)
+
+    return FakeClientSession
+
+
+def build_config(args, servers: list, log_file_name: str) -> dict:
+    """Builds the config the bot is loaded with, every synthetic server has welcome messages and referrals enabled."""
+    unthrottled = {"user_capacity": 10 ** 9, "user_refill_per_second": 10 ** 9, "server_capacity": 10 ** 9,
+                   "server_refill_per_second": 10 ** 9, "global_capacity": 10 ** 9, "global_refill_per_second": 10 ** 9,
+                   "shed_low_priority_lag_seconds": 10 ** 9, "shed_normal_priority_lag_seconds": 10 ** 9}
+
+    return {
+        "credentials": {"app_client_id": 1, "token": "", "mashape_api_key": ""},
+        "webserver_config": {"use_webserver": True, "server_address": "127.0.0.1", "server_port": 0, "auth_token": "",
+                             "update_interval_seconds": 60},
+        "add_bot_cmd": {"enabled": True},
+        "invite_cmd": {"invite_max_uses": 1, "invite_valid_time_min": 10},
+        "start_server_cmd": {"start_server_allowed_channel_names_and_server_id_pairs": [],
+                             "start_server_command": "start the server", "start_bat_filepath": ""},
+        "stats": {"servers_joined": 0, "messages_sent": 0, "commands_received": 0},
+        "voice_command_roles": {},
+        "warning_roles": {},
+        "referral_config": {server.id: {"announce_channel_id": 0, "referral_timeout_min": 1, "referral_rewards": {}}
+                            for server in servers},
+        "log_config": {"ignored_log_user_names": [], "ignored_log_channels": [], "use_email_notifications": False,
+                       "email_settings": {}},
+        "join_msg": {"welcome_msg": "{0}, welcome to the {1} server!",
+                     "server_and_channel_id_pairs": [[int(server.id), int(server.channels[0].id)] for server in servers]},
+        "leave_msg": {"leave_msg": "{0} has left the {1} server!", "server_and_channel_id_pairs": []},
+        "default_role": {"server_and_default_role_id_pairs": []},
+        "pokemon_commands": {"notification_timer_seconds": 30, "use_pgo_commands": False},
+        "vanity_role_commands": {"server_ids_and_roles": {}},
+        # The chess commands are disabled, so "stop chess" measures the check without needing stockfish
+        "chess_cmd": {"use_chess_commands": False, "stockfish_path": "", "search_time_milliseconds": 1000, "search_threads": 1,
+                      "max_concurrent_searches": 1},
+        "throttle_config": unthrottled if args.no_throttle else {},
+        "logging": {"log_file_name": log_file_name},
+        "somewhat_weird_shit": {"admin_user_ids": []}
+    }
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Returns the value at the passed fraction (0.5 for p50) of the sorted list, or 0 if it's empty."""
+    if not sorted_values:
+        return 0.
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def format_latencies(name: str, values: list) -> str:
+    values = sorted(values)
+    return "  {0:<14} n={1:<8} p50={2:8.2f} ms  p99={3:8.2f} ms  max={4:8.2f} ms".format(
+        name, len(values), percentile(values, 0.5) * 1000, percentile(values, 0.99) * 1000,
+        (values[-1] if values else 0.) * 1000)
+
+
+def weighted_choice(rng: random.Random, weights: dict):
+    """Returns a random key of the dict, where the values are the weights (random.choices only exists in python 3.6+)."""
+    target = rng.random() * sum(weights.values())
+    for key, cumulative_weight in zip(weights, itertools.accumulate(weights.values())):
+        if target < cumulative_weight:
+            return key
+    return key
+
+
+class LoadTest:
+    """Builds the synthetic world, replays the events into the bot and collects the measurements."""
+
+    def __init__(self, args, bot_main, client: FakeClient):
+        self.args = args
+        self.bot_main = bot_main
+        self.client = client
+        self.rng = random.Random(args.seed)
+        self.ids = client.message_ids
+        self.servers = client.servers
+
+        # The latencies (in seconds) of each kind of event, and of the commands and referral answers that were run (see execution_kinds)
+        self.latencies = collections.defaultdict(list)
+        self.lag_samples = []
+        self.errors = collections.Counter()
+
+    def next_member(self, server: FakeServer) -> FakeUser:
+        member_id = next(self.ids)
+        member = FakeUser(member_id, "user{0}".format(member_id[-6:]), server)
+        server.members.append(member)
+        return member
+
+    async def timed(self, kind: str, coroutine, count_errors: bool = True):
+        """Awaits the coroutine and records how long it took under kind. Its errors are counted, unless count_errors is False, in which case they're raised."""
+        start = time.perf_counter()
+        try:
+            await coroutine
+        except asyncio.CancelledError:
+            # The work that is still running when we shut down is cancelled, that isn't an error of the bot
+            raise
+        except Exception as e:
+            if not count_errors:
+                self.latencies[kind].append(time.perf_counter() - start)
+                raise
+            self.errors["{0}: {1}".format(kind, type(e).__name__)] += 1
+        self.latencies[kind].append(time.perf_counter() - start)
+
+    def count_hook_failures(self):
+        """Adds the failures of the join hooks (and the referral answers) to the errors, join_pipeline logs and swallows them, so timed never sees them."""
+        for name, metrics in self.bot_main.main_code.join_pipeline.hook_metrics.items():
+            if metrics["failures"]:
+                self.errors["join hook {0}".format(name)] += metrics["failures"]
+
+    def make_event(self):
+        """Returns a (kind, coroutine) tuple for a random event."""
+        kind = weighted_choice(self.rng, self.args.event_mix)
+        server = self.rng.choice(self.servers)
+        member = self.rng.choice(server.members)
+        message_class = self.client.message_class
+
+        if kind == "message":
+            content = "just chatting about things #{0}".format(self.rng.randrange(10 ** 6))
+            return kind, self.client.dispatch_message(message_class(next(self.ids), content, member, server.channels[0]))
+        elif kind == "command":
+            command = weighted_choice(self.rng, server_command_mix).format(mention=self.rng.choice(server.members).mention)
+            content = "{0} {1}".format(self.client.user.mention[:2] + "!" + self.client.user.mention[2:], command)
+            return kind, self.client.dispatch_message(message_class(next(self.ids), content, member, server.channels[0]))
+        elif kind == "pm_command":
+            content = weighted_choice(self.rng, pm_command_mix)
+            return kind, self.client.dispatch_message(
+                message_class(next(self.ids), content, member, self.client.get_private_channel(member)))
+        elif kind == "join":
+            return kind, self.join(server)
+        else:
+            # A presence update flips a member between online and offline
+            import discord
+
+            before = copy.copy(member)
+            member.status = discord.Status.offline if member.status == discord.Status.online else discord.Status.online
+            return kind, self.client.on_member_update(before, member)
+
+    async def join(self, server: FakeServer):
+        """A member joins, and answers the referral question some of the time."""
+        member = self.next_member(server)
+
+        if self.rng.random() < self.args.referral_answer_rate:
+            referrer = self.rng.choice(server.members)
+            self.client.spawn(self.answer_referral(member, referrer))
+
+        await self.client.on_member_join(member)
+
+    async def answer_referral(self, member: FakeUser, referrer: FakeUser):
+        # The referral asker runs as its own task, so we wait until it has asked (the question is registered after the PM is sent) before we answer
+        deadline = time.perf_counter() + self.args.max_wait
+        while not self.bot_main.main_code.referral_router.is_pending(member.id):
+            if time.perf_counter() >= deadline:
+                self.errors["referral: never asked"] += 1
+                return
+            await asyncio.sleep(0.01)
+
+        await self.timed("referral", self.client.dispatch_message(
+            self.client.message_class(next(self.ids), "referrer: {0}".format(referrer), member,
+                                      self.client.get_private_channel(member))))
+
+    async def sample_loop_lag(self, interval: float = 0.01):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.lag_samples.append(max(0., time.perf_counter() - start - interval))
+
+    async def run(self):
+        lag_sampler = self.client.loop.create_task(self.sample_loop_lag())
+
+        # We schedule the events at a fixed rate, and if we fall behind we send the late events right away (the load doesn't adapt to the bot)
+        start = time.perf_counter()
+        sent = 0
+        while True:
+            now = time.perf_counter()
+            if now - start >= self.args.duration:
+                break
+
+            if self.args.rate > 0:
+                due = int((now - start) * self.args.rate) + 1
+                if sent >= due:
+                    await asyncio.sleep((sent / self.args.rate) - (now - start))
+                    continue
+            else:
+                due = sent + 100
+
+            for _ in range(due - sent):
+                kind, coroutine = self.make_event()
+                self.client.spawn(self.timed(kind, coroutine))
+            sent = due
+
+            # We let the loop run the events we just sent before sending more
+            await asyncio.sleep(0)
+
+        replay_seconds = time.perf_counter() - start
+
+        # We wait for the events and commands that are still running
+        drain_start = time.perf_counter()
+        while (self.client.background_tasks or self.commands_pending()) and \
+                time.perf_counter() - drain_start < self.args.drain_timeout:
+            await asyncio.sleep(0.05)
+
+        lag_sampler.cancel()
+        return sent, replay_seconds, time.perf_counter() - start
+
+    def commands_pending(self) -> bool:
+        """Returns True if the command scheduler has commands that are running or waiting to run."""
+        return any(class_metrics["running"] or class_metrics["queue_depth"]
+                   for class_metrics in self.bot_main.main_code.command_scheduler.get_metrics().values())
+
+    def report(self, sent: int, replay_seconds: float, total_seconds: float):
+        bot_main = self.bot_main
+        handled = sum(len(self.latencies[kind]) for kind in self.args.event_mix)
+
+        lines = ["", "anna-bot load test results",
+                 "  replayed {0} events in {1:.2f} s ({2:.1f} events/s offered), all work done after {3:.2f} s".format(
+                     sent, replay_seconds, sent / replay_seconds if replay_seconds else 0., total_seconds),
+                 "  handled {0} events, {1:.1f} events/s".format(handled, handled / total_seconds if total_seconds else 0.),
+                 "", "dispatch latency per event (time until the event handler returned):"]
+        for kind in sorted(self.latencies):
+            if kind not in execution_kinds:
+                lines.append(format_latencies(kind, self.latencies[kind]))
+
+        lines += ["", "execution latency (time until the command or referral answer was done):"]
+        lines += [format_latencies(kind, self.latencies[kind]) for kind in execution_kinds]
+
+        lines += ["", "event loop lag:", format_latencies("loop lag", self.lag_samples),
+                  "", "throttle: {0}".format(dict(bot_main.main_code.throttle.metrics)),
+                  "scheduler: {0}".format({name: {key: value for key, value in class_metrics.items() if value}
+                                           for name, class_metrics in bot_main.main_code.command_scheduler.get_metrics().items()}),
+                  "ignored message registry: {0}".format(bot_main.ignored_command_message_ids.metrics),
+                  "fake api calls: {0}".format(dict(self.client.calls)),
+                  "errors: {0}".format(dict(self.errors) if self.errors else "none")]
+
+        return "\n".join(lines)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Replays synthetic discord events into anna-bot with a fake client, and reports latencies.")
+    parser.add_argument("--rate", type=float, default=200, help="events per second to replay, 0 for as fast as possible")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to replay events for")
+    parser.add_argument("--servers", type=int, default=20, help="number of synthetic servers")
+    parser.add_argument("--members", type=int, default=100, help="number of members per synthetic server")
+    parser.add_argument("--event-mix", type=json.loads, default=default_event_mix,
+                        help="json object with the weights of the event kinds, default: {0}".format(json.dumps(default_event_mix)))
+    parser.add_argument("--api-latency", type=float, default=0.05, help="seconds the fake discord and http apis take to respond")
+    parser.add_argument("--max-wait", type=float, default=2, help="max seconds that wait_for_message waits")
+    parser.add_argument("--referral-answer-rate", type=float, default=0.5, help="fraction of joining members that answer the referral question")
+    parser.add_argument("--drain-timeout", type=float, default=30, help="max seconds to wait for running work after the replay")
+    parser.add_argument("--no-throttle", action="store_true", help="disable the command throttle, to measure the raw dispatch path")
+    parser.add_argument("--seed", type=int, default=1, help="seed for the synthetic event stream")
+    parser.add_argument("--verbose", action="store_true", help="show the bot's own log output")
+    parser.add_argument("--keep-workdir", action="store_true", help="don't remove the directory the bot wrote its files to")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # The bot reads and writes its files relative to the working directory, so we give it its own
+    workdir = tempfile.mkdtemp(prefix="anna-load-test-")
+    os.makedirs(os.path.join(workdir, "persistent_state"))
+    for filename, data in (("referrals.json", {"servers": {}}),
+                           (os.path.join("persistent_state", "configured_prefixes.json"), {})):
+        with open(os.path.join(workdir, filename), mode="w", encoding="utf-8") as file:
+            json.dump(data, file)
+
+    # We build the synthetic servers before the bot is imported, as the config has to exist when helpers is imported
+    ids = (str(100000000000000100 + i) for i in itertools.count())
+    bot_user_id = "100000000000000001"
+    servers = [FakeServer(next(ids), "server {0}".format(i), bot_user_id, lambda: next(ids)) for i in range(args.servers)]
+
+    with open(os.path.join(workdir, "config.json"), mode="w", encoding="utf-8") as config_file:
+        json.dump(build_config(args, servers, os.path.join(workdir, "discord.log")), config_file)
+
+    # We swap in the fakes before the bot is imported, as it creates its client (and some sessions) at import time
+    import aiohttp
+    import discord
+
+    api_calls = collections.Counter()
+    discord.Client = FakeClient
+    aiohttp.ClientSession = make_session_class(api_calls, args.api_latency)
+    aiohttp.TCPConnector = lambda *connector_args, **connector_kwargs: None
+
+    real_stdout = sys.stdout
+    if not args.verbose:
+        sys.stdout = open(os.devnull, mode="w")
+
+    previous_directory = os.getcwd()
+    os.chdir(workdir)
+    sys.path.insert(0, repo_root)
+    bot_main = None
+    try:
+        import bot_main
+
+        client = bot_main.client
+        client.api_latency = args.api_latency
+        client.max_wait_seconds = args.max_wait
+        client.message_class = make_message_class()
+        client.message_ids = ids
+        client.calls = api_calls
+        client.servers.extend(servers)
+        for server in servers:
+            for channel in server.channels:
+                client.channels[channel.id] = channel
+
+        bot_main.load_anna()
+
+        load_test = LoadTest(args, bot_main, client)
+        for server in servers:
+            for _ in range(args.members):
+                load_test.next_member(server)
+
+        # We time the commands the scheduler runs and the referral answers, on_message looks these up when it's called so we can wrap them
+        # They're recorded separately from the dispatch latencies, which only measure how long on_message took to hand them off
+        run_command = bot_main.run_command
+        handle_referral_answer = bot_main.handle_referral_answer
+
+        # run_command raises the errors of the commands again for the scheduler, after on_error (where we count them) has logged them
+        def timed_run_command(*run_args):
+            return load_test.timed("command_run", run_command(*run_args), count_errors=False)
+
+        def timed_handle_referral_answer(*answer_args):
+            return load_test.timed("referral_run", handle_referral_answer(*answer_args))
+
+        bot_main.run_command = timed_run_command
+        bot_main.handle_referral_answer = timed_handle_referral_answer
+
+        # run_command catches the errors of the commands and hands them to on_error, so we count them there
+        on_error = bot_main.on_error
+
+        async def counting_on_error(event, *error_args, **error_kwargs):
+            load_test.errors["{0}: {1}".format(event, getattr(sys.exc_info()[0], "__name__", "unknown error"))] += 1
+            await on_error(event, *error_args, **error_kwargs)
+
+        bot_main.on_error = counting_on_error
+
+        sent, replay_seconds, total_seconds = client.loop.run_until_complete(load_test.run())
+        load_test.count_hook_failures()
+        report = load_test.report(sent, replay_seconds, total_seconds)
+
+        # We shut down like the bot does, which cancels the commands and join hooks that are still running
+        client.loop.run_until_complete(client.close())
+    finally:
+        # We stop the ytdl worker processes, close the state store and stop the log threads like start_anna does, before we remove their files
+        if bot_main is not None:
+            bot_main.main_code.ytdl_extractor.shutdown()
+            bot_main.main_code.state_store.close()
+            bot_main.main_code.log_pipeline.stop()
+
+        os.chdir(previous_directory)
+        if not args.verbose:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+
+        if args.keep_workdir:
+            print("The bot's files are in {0}".format(workdir))
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(report)
+
+    # A run where the handlers failed didn't measure anything, so it mustn't pass as a benchmark
+    if load_test.errors:
+        print("The bot's handlers raised {0} error(s), the numbers above are not valid.".format(
+            sum(load_test.errors.values())), file=sys.stderr)
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
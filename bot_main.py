@@ -13,7 +13,26 @@ import discord
 import websockets.exceptions
 import youtube_dl
 
+import main_code.command_context
 import main_code.command_decorator
+import main_code.command_router
+import main_code.command_scheduler
+import main_code.config_index
+import main_code.ignored_messages
+import main_code.join_pipeline
+import main_code.last_seen
+import main_code.last_seen_server
+import main_code.last_seen_sync
+import main_code.log_pipeline
+import main_code.presence_coalescer
+import main_code.referral_rewards
+import main_code.referral_router
+import main_code.referral_store
+import main_code.state_store
+import main_code.stats
+import main_code.throttle
+import main_code.voice_queue
+import main_code.ytdl_extractor
 import main_code.commands.admin.broadcast
 import main_code.commands.admin.change_icon
 import main_code.commands.admin.list_referrals
@@ -28,6 +47,7 @@ import main_code.commands.regular.invite_link
 import main_code.commands.regular.list_ids
 import main_code.commands.regular.meme_maker
 import main_code.commands.regular.pokemon_go_commands
+import main_code.commands.regular.referral_commands
 import main_code.commands.regular.report_stats
 import main_code.commands.regular.start_server
 import main_code.commands.regular.vanity_role_commands
@@ -43,13 +63,10 @@ client = helpers.actual_client
 
 @client.event
 async def on_message(message: discord.Message):
-    # We wait for a split second so we can be assured that ignoring of messages and other things have finished before the message is processed here
     # We make sure the message is a regular one
     if message.type != discord.MessageType.default:
         return
 
-    await asyncio.sleep(0.1)
-
     global config
 
     # The weird mention for the bot user (mention code starts with an exclamation mark instead of just the user ID), the string manipulation is due to mention strings not being the same all the time
@@ -89,17 +106,8 @@ async def on_message(message: discord.Message):
                                 message.author.name, attachment["filename"], attachment["size"]))
 
     else:
-        # We sent a message and we are going to increase the sent messages counter in the config
-        # We first load the config
-        with open("config.json", mode="r", encoding="utf-8") as config_file:
-            current_config = json.load(config_file)
-
-        # Now we change the actual value and then dump it back into the file
-        current_config["stats"]["messages_sent"] += 1
-
-        with open("config.json", mode="w", encoding="utf-8") as config_file:
-            # Dump back the changed data
-            json.dump(current_config, config_file, indent=2)
+        # We sent a message and we are going to increase the sent messages counter (it gets flushed to disk by the stats module)
+        main_code.stats.increment("messages_sent")
 
         # We sent a message and we are going to log it appropriately
         if message.channel.is_private:
@@ -109,203 +117,121 @@ async def on_message(message: discord.Message):
                 helpers.log_info(
                     "We said: \"" + message.content + "\" in channel: \"" + message.channel.name + "\" on server \"" + message.server.name + "\".")
 
-    # Checking if the user used a command, but we first wait to make sure that the message gets ignored if necessary
-    await asyncio.sleep(0.2)
-
-    # We need to define all the special params as globals to be able to access them without sneaky namespace stuff biting us in the ass
-    global ignored_command_message_ids
-
-    # We define the list of special parameters that may be sent to the message functions, and also have to be returned from them (in a list)
-    special_params = [ignored_command_message_ids, config, last_online_time_dict]
+    # Checking if the user used a command, messages that should be ignored (answers to questions from other commands) have already been claimed by the check that accepted them
+    # We take the message out of the ignored registry right away (if it's in there), so we don't accumulate ids to check against
+    is_ignored_message = ignored_command_message_ids.pop(message.id)
 
     # Checking if we sent the message, so we don't trigger ourselves and checking if the message should be ignored or not (such as it being a response to another command)
     # We also check if the message was sent by a bot account, as we don't allow them to use commands
-    if not ((message.author.id == client.user.id) or (message.id in ignored_command_message_ids) or message.author.bot):
-        # If a command is used with the message that was passed to the event, we know that a command has been triggered
-        used_command = False
+    if not ((message.author.id == client.user.id) or is_ignored_message or message.author.bot):
 
-        # Check if the message was sent in a PM to anna
-        if message.channel.is_private:
+        # PMs from users who we've asked about a referral are routed to the referral, for everyone else this is a single dict lookup
+        if message.channel.is_private and main_code.referral_router.is_pending(message.author.id) and is_referral_answer(
+                message.content):
+            server_id, deadline = main_code.referral_router.take(message.author.id)
+            main_code.join_pipeline.spawn_supervised("handle_referral_answer",
+                                                     handle_referral_answer(message, server_id, deadline))
 
-            # Going through all the public commands we've specified and checking if they match the message
-            for command in public_commands:
-                if message.content.lower().strip().startswith(command["command"]):
-                    # We log what command was used by who
-                    helpers.log_info("The " + command[
-                        "command"] + " command was triggered by \"" + message.author.name + "\" in a PM.")
-
-                    # The command matches, so we call the method that was specified in the command list
-                    temp_result = await command["method"](message, client, config,
-                                                          *[x[0] for x in
-                                                            zip(special_params,
-                                                                command["special_params"])
-                                                            if x[1]])
-                    x = 0
-                    # We put back all the values that we got returned
-                    if temp_result:
-                        for i in range(len(special_params)):
-                            if command["special_params"][i]:
-                                set_special_param(i, temp_result[x])
-                                x += 1
-
-                    # We note that a command was triggered so we don't output the message about what "!" means
-                    used_command = True
-                    break
+            # The answer isn't a command
+            return
 
-            # Checking if the issuing user is in the admin list
-            if helpers.is_member_anna_admin(message.author, config):
-
-                # Going through all the admin commands we've specified and checking if they match the message
-                for command in admin_commands:
-                    if message.content.lower().strip().startswith("admin " + command["command"]):
-                        # We log what command was used by who
-                        helpers.log_info("The " + command[
-                            "command"] + " admin command was triggered by admin \"" + message.author.name + "\" in a PM.")
-
-                        # The command matches, so we call the method that was specified in the command list
-                        temp_result = await command["method"](message, client, config, *[x[0] for x in
-                                                                                         zip(special_params,
-                                                                                             command["special_params"])
-                                                                                         if x[1]])
-                        x = 0
-                        # We put back all the values that we got returned
-                        if temp_result:
-                            for i in range(len(special_params)):
-                                if command["special_params"][i]:
-                                    set_special_param(i, temp_result[x])
-                                    x += 1
-
-                        # We note that a command was triggered so we don't output the message about what anna can do
-                        used_command = True
-                        break
+        # Server messages need to start with the prefix/mention of anna to be commands, PMs don't use prefixes
+        if not (message.channel.is_private or helpers.is_message_command(message, client)):
+            # The message isn't a command
+            return
+
+        # We parse the message once, and pass the result to the command so it doesn't need to parse the message again
+        context = main_code.command_context.CommandContext(message, client,
+                                                           helpers.is_member_anna_admin(message.author, config),
+                                                           ignored_command_message_ids)
+
+        # We find the command that the message triggers (if any) with a single lookup in the command router
+        command, is_admin_command = command_router.resolve(context.content.lower(), context.is_admin)
 
-            # If the message started with an command trigger and it didn't have a valid command we try to teach the user which commands are available
-            if not used_command:
-                # Sending the message to the user
+        # If the message started with an command trigger and it didn't have a valid command we try to teach the user which commands are available
+        if command is None:
+            if message.channel.is_private:
                 await client.send_message(message.channel,
                                           "You seemingly just tried to use an " + client_mention + " command, but I couldn't figure out which one you wanted to use, if you want to know what commands I can do for you, please type \"" + client_mention + " help\" :smile:")
             else:
-                # If the message was a command of any sort, we increment the commands received counter on anna
-                # We first load the config
-                with open("config.json", mode="r", encoding="utf-8") as config_file:
-                    current_config = json.load(config_file)
+                await client.send_message(message.channel,
+                                          message.author.mention + ", you seemingly just tried to use an " + client_mention + " command, but I couldn't figure out which one you wanted to use, if you want to know what commands I can do for you, please type \"" + client_mention + " help\" :smile:")
 
-                # Now we change the actual value and then dump it back into the file
-                current_config["stats"]["commands_received"] += 1
+            # We're done here
+            return
 
-                with open("config.json", mode="w", encoding="utf-8") as config_file:
-                    # Dump back the changed data
-                    json.dump(current_config, config_file, indent=2)
+        # We check that the user, server and bot haven't used up their command tokens, and that we aren't shedding this kind of command because the event loop is lagging
+        # Admin commands are exempt, so the admins can still reload the config or stop things when the bot is overloaded
+        throttle_reason = main_code.throttle.check(message.author.id, None if message.channel.is_private else message.server.id,
+                                                   command["cost_class"], is_admin_command)
+        if throttle_reason is not None:
+            helpers.log_info("The {0} command from {1} was throttled ({2}).".format(command["command"], message.author.name,
+                                                                                   throttle_reason))
 
-        # We're in a regular server channel
-        else:
-            # Checking if the message is a command, (starts with a mention of anna)
-            if helpers.is_message_command(message, client):
-                # Going through all the public commands we've specified and checking if they match the message
-                for command in public_commands:
-                    if helpers.remove_anna_mention(client, message).lower().strip().startswith(
-                            command["command"]):
-                        # We log what command was used by who and where
-                        helpers.log_info("The " + command[
-                            "command"] + " command was triggered by \"" + message.author.name + "\" in channel \"" + message.channel.name + "\" on server \"" + message.server.name + "\".")
-
-                        # The command matches, so we call the method that was specified in the command list
-                        temp_result = await command["method"](message, client, config, *[x[0] for x in
-                                                                                         zip(special_params,
-                                                                                             command["special_params"])
-                                                                                         if x[1]])
-                        x = 0
-                        # We put back all the values that we got returned
-                        if temp_result:
-                            for i in range(len(special_params)):
-                                if command["special_params"][i]:
-                                    set_special_param(i, temp_result[x])
-                                    x += 1
-
-                        # We note that a command was triggered so we don't output the message about what anna can do
-                        used_command = True
-                        break
+            # We tell the user why nothing happened, but not every time, as that would just be more spam
+            if main_code.throttle.should_notify(message.author.id):
+                await client.send_message(message.channel, "{0}I'm getting too many commands right now, please slow down and try again in a bit.".format(
+                    "" if message.channel.is_private else message.author.mention + ", "))
 
-                # Checking if the issuing user is in the admin list
-                if helpers.is_member_anna_admin(message.author, config):
-                    # Going through all the admin commands we've specified and checking if they match the message
-                    for command in admin_commands:
-                        if helpers.remove_anna_mention(client, message).lower().strip().startswith(
-                                        "admin " + command["command"]):
-
-                            # We check if the command was triggered in a private channel/PM or not
-                            if message.channel.is_private:
-
-                                # We log what command was used by who
-                                helpers.log_info("The " + command[
-                                    "command"] + " admin command was triggered by admin \"" + message.author.name + "\" in a PM.")
-
-                            else:
-                                # We log what command was used by who and where
-                                helpers.log_info("The " + command[
-                                    "command"] + " admin command was triggered by admin \"" + message.author.name + "\" in channel \"" + message.channel.name + "\" on server \"" + message.server.name + "\".")
-
-                            # The command matches, so we call the method that was specified in the command list
-                            temp_result = await command["method"](message, client, config, *[x[0] for x in
-                                                                                             zip(special_params,
-                                                                                                 command[
-                                                                                                     "special_params"])
-                                                                                             if x[1]])
-                            x = 0
-                            # We put back all the values that we got returned
-                            if temp_result:
-                                for i in range(len(special_params)):
-                                    if command["special_params"][i]:
-                                        set_special_param(i, temp_result[x])
-                                        x += 1
-
-                            # We note that a command was triggered so we don't output the message about what anna can do
-                            used_command = True
-                            break
+            # We're done here
+            return
 
-                # If the message started with an command trigger and it didn't have a valid command we try to teach the user which commands are available
-                if not used_command:
-                    # Sending the message to the user
-                    await client.send_message(message.channel,
-                                              message.author.mention + ", you seemingly just tried to use an " + client_mention + " command, but I couldn't figure out which one you wanted to use, if you want to know what commands I can do for you, please type \"" + client_mention + " help\" :smile:")
-                else:
-                    # If the message was a command of any sort, we increment the commands received counter on anna
-                    # We first load the config
-                    with open("config.json", mode="r", encoding="utf-8") as config_file:
-                        current_config = json.load(config_file)
+        # We log what command was used by who and where
+        helpers.log_info("The {0} {1}command was triggered by {2}\"{3}\" {4}.".format(
+            command["command"], "admin " if is_admin_command else "", "admin " if is_admin_command else "",
+            message.author.name, "in a PM" if message.channel.is_private else "in channel \"{0}\" on server \"{1}\"".format(
+                message.channel.name, message.server.name)))
 
-                    # Now we change the actual value and then dump it back into the file
-                    current_config["stats"]["commands_received"] += 1
+        # We split the arguments off from the trigger that matched
+        context.set_trigger(("admin " if is_admin_command else "") + command["command"])
 
-                    with open("config.json", mode="w", encoding="utf-8") as config_file:
-                        # Dump back the changed data
-                        json.dump(current_config, config_file, indent=2)
+        # The command matches, so we hand it to the scheduler, which runs it as soon as its execution class has room for it
+        # We don't wait for the command to finish, so a slow command doesn't hold on to the on_message coroutine
+        if not main_code.command_scheduler.submit(run_command(command, message, context), command["cost_class"],
+                                                  main_code.command_scheduler.get_priority(command["cost_class"],
+                                                                                           is_admin_command)):
+            helpers.log_warning("The {0} command from {1} was rejected because too many commands are waiting.".format(
+                command["command"], message.author.name))
 
-                    # We remove stream players that are done playing, as this is done on every command and every commands can only create at most 1 stream player, we guarantee no memory leak
-                    server_and_stream_players[:] = [x for x in server_and_stream_players if not x[1].is_done()]
 
-    else:
-        # Checking if we didn't check if the message was a command because the message id was in the ignored ids list
-        if message.id in ignored_command_message_ids:
-            # We remove the ignored id from the list so we don't accumulate ids to check against
-            ignored_command_message_ids.remove(message.id)
+async def run_command(command: dict, message: discord.Message, context: main_code.command_context.CommandContext):
+    """Runs a command that the scheduler has started, and does the bookkeeping that's done after every command."""
+
+    error = None
+    try:
+        # We call the method that was specified in the command list
+        await command["method"](message, client, config, context)
+    except asyncio.CancelledError:
+        # We're shutting down
+        raise
+    except Exception as e:
+        # The command is run in its own task, so we log the error the same way as errors in events
+        await on_error("command " + context.trigger)
+        error = e
+
+    # If the message was a command of any sort, we increment the commands received counter on anna
+    main_code.stats.increment("commands_received")
+
+    if not message.channel.is_private:
+        # We remove stream players that are done playing, as this is done on every command and every commands can only create at most 1 stream player, we guarantee no memory leak
+        server_and_stream_players[:] = [x for x in server_and_stream_players if not x[1].is_done()]
+
+    if error is not None:
+        # We raise the error again after the bookkeeping, so the scheduler counts the command as failed (it retrieves the error, so it isn't logged twice)
+        raise error
 
 
 @client.event
 async def on_member_join(member: discord.Member):
     """This event is called when a member joins a server, we use it for various features."""
 
-    # We wait as to not do stuff before the user has actually joined the server
-    await asyncio.sleep(0.2)
-
     # We log that a user has joined the server
     helpers.log_info(
         "User {0:s} ({1:s}) has joined server {2:s} ({3:s}).".format(member.name, member.id, member.server.name,
                                                                      member.server.id))
 
-    # We call all the join functions, and pass them the member who joined
-    for join_function in join_functions:
-        await join_function(member)
+    # We start all the join functions as independent tasks, and pass them the member who joined, so a slow one doesn't hold the others up
+    main_code.join_pipeline.run_hooks(member, join_functions)
 
 
 @client.event
@@ -317,97 +243,28 @@ async def on_member_remove(member: discord.Member):
         "User {0:s} ({1:s}) has left server {2:s} ({3:s}).".format(member.name, member.id, member.server.name,
                                                                    member.server.id))
 
-    # We check if the server is on the list of servers who use the leave message feature
-    if int(member.server.id) in [x[0] for x in config["leave_msg"]["server_and_channel_id_pairs"]]:
+    # We send the leave message to the channels that the server has configured (if any), these were resolved from the config once
+    for channel in main_code.config_index.get(member.server).leave_channels:
+        await client.send_message(channel, config["leave_msg"]["leave_msg"].format(member.mention, member.server.name))
 
-        # We send a message to the specified channels in that server (you can have however many channels you want, but we check if they are on the correct server)
-        channel_ids = \
-            [x[1:] for x in config["leave_msg"]["server_and_channel_id_pairs"] if x[0] == int(member.server.id)][0]
 
-        # We loop through all the possible channels and check if they're valid
-        for channel_id in [int(x) for x in channel_ids]:
-            # We check if the channel id is on the server that the member left
-            if discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels) is not None:
-                # We send the leave message:
-                await client.send_message(discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels),
-                                          config["leave_msg"]["leave_msg"].format(member.mention, member.server.name))
+def uses_last_seen() -> bool:
+    """Returns True if we keep last seen records, which is when we push them to the webserver or serve them from the pull server."""
+    return config["webserver_config"]["use_webserver"] or config["webserver_config"].get("pull_server", {}).get("enabled", False)
 
 
 @client.event
 async def on_member_update(before: discord.Member, after: discord.Member):
     """This method handles people updating their status and such, it needs to run fast to not be a performance hog."""
     # We check if the user update is someone changing their online-status from not-offline to offline
-    if (before.status != discord.Status.offline and after.status == discord.Status.offline) and (
-            config["webserver_config"]["use_webserver"]):
-        # We add the user to the last-online-list dict
-        # We get the server list index of the server we want to add this user's info to
-        info_dict_servers_index = [inx for inx, x in enumerate(last_online_time_dict["servers"]) if
-                                   x["server_id"] == after.server.id]
-
-        # We check if the server that the user is on exists
-        if not info_dict_servers_index:
-            # We add an entry for the new server
-            info_dict_servers_index = len(last_online_time_dict["servers"])
-            last_online_time_dict["servers"].append({"server_id": after.server.id, "users": []})
-        else:
-            info_dict_servers_index = info_dict_servers_index[0]
-
-        # We add the user info to the server entry
-
-        # We check if the user already has an entry
-        info_dict_users_index = [inx for inx, x in
-                                 enumerate(last_online_time_dict["servers"][info_dict_servers_index]["users"]) if
-                                 x.get("username", "") == "#".join((after.name, str(after.discriminator)))]
-
-        if not info_dict_users_index:
-            # We add an entry for the new user
-            info_dict_users_index = len(last_online_time_dict["servers"][info_dict_servers_index]["users"])
-            last_online_time_dict["servers"][info_dict_servers_index]["users"].append({})
-        else:
-            info_dict_users_index = info_dict_users_index[0]
-
-        # We actually add the data
-        last_online_time_dict["servers"][info_dict_servers_index]["users"][info_dict_users_index][
-            "username"] = "#".join((after.name, str(after.discriminator)))
-        last_online_time_dict["servers"][info_dict_servers_index]["users"][info_dict_users_index][
-            "icon_url"] = after.avatar_url if after.avatar_url is not "" else after.default_avatar_url
-        last_online_time_dict["servers"][info_dict_servers_index]["users"][info_dict_users_index][
-            "last_seen_time"] = time.asctime(time.gmtime())
-
-    elif (before.status == discord.Status.offline and after.status == discord.Status.online) and (
-            config["webserver_config"]["use_webserver"]):
-
-        # We delete a user from the dict since the user went online
-        # We get the server list index of the server we want to remove this user's info from
-        info_dict_servers_index = [inx for inx, x in enumerate(last_online_time_dict["servers"]) if
-                                   x["server_id"] == after.server.id]
-
-        # We check if the server that the user is on exists
-        if not info_dict_servers_index:
-            # We return, we tried to remove from something that doesn't exist
-            return
+    if (before.status != discord.Status.offline and after.status == discord.Status.offline) and uses_last_seen():
+        # We buffer the transition, a user gets an update like this for every server they share with us, so the coalescer collapses them
+        # and adds (or updates) the user's last seen records in one batch
+        main_code.presence_coalescer.add(after, True, client.loop)
 
-        info_dict_servers_index = info_dict_servers_index[0]
-
-        # We remove the user info from the server entry and then check if we should remove the server entry
-
-        # We check if the user already has an entry
-        info_dict_users_index = [inx for inx, x in
-                                 enumerate(last_online_time_dict["servers"][info_dict_servers_index]["users"]) if
-                                 x.get("username", "") == "#".join((after.name, str(after.discriminator)))]
-
-        if not info_dict_users_index:
-            # We return, we tried to remove something that didn't exist from the beginning
-            return
-
-        info_dict_users_index = info_dict_users_index[0]
-
-        # We remove the user's data
-        del last_online_time_dict["servers"][info_dict_servers_index]["users"][info_dict_users_index]
-
-        # We check if we should remove the whole server entry (we check if the list of users is empty), and we delete it if possible
-        if len(last_online_time_dict["servers"][info_dict_servers_index]["users"]) == 0:
-            del last_online_time_dict["servers"][info_dict_servers_index]
+    elif (before.status == discord.Status.offline and after.status == discord.Status.online) and uses_last_seen():
+        # We buffer the transition, the user's last seen records are deleted in the next batch since the user went online
+        main_code.presence_coalescer.add(after, False, client.loop)
 
 
 @client.event
@@ -419,7 +276,7 @@ async def on_ready():
     helpers.log_info("Restoring pokemon state...")
 
     # We restore the pokemon state
-    restore_pokemon_state()
+    await restore_pokemon_state()
 
     # We setup a recurring task that handles pokemon go notifications, as we pass a config here, the config reloader changes the config object in that file
     background_tasks["pokemon_go_handler"] = client.loop.create_task(
@@ -427,6 +284,12 @@ async def on_ready():
 
     helpers.log_info("Done restoring pokemon state.")
 
+    # We setup a recurring task that times out the referral questions that weren't answered, we do this once we're logged in so the members can be found
+    # (on_ready is called again when we reconnect, so we make sure we only start it once)
+    if "referral_deadlines" not in background_tasks:
+        background_tasks["referral_deadlines"] = client.loop.create_task(
+            main_code.referral_router.deadline_loop(referral_timed_out))
+
     # We restore the voice state from file, and also store it to the voice_commands_playlist file's info dict
     try:
         await restore_voice_persistent_state()
@@ -436,20 +299,18 @@ async def on_ready():
         traceback.print_exception(*sys.exc_info())
 
 
-def restore_pokemon_state():
-    """Takes the /persistent_state/pokemon_state.json and interprets it to restore the data into the pokemon_go_commands.py file."""
+async def restore_pokemon_state():
+    """Takes the pokemon state from the state store and interprets it to restore the data into the pokemon_go_commands.py file."""
 
-    # We open and close the state file
+    # We load the state
     try:
-        with open(os.path.join(os.path.dirname(__file__), "persistent_state", "pokemon_state.json"),
-                  mode="r") as poke_state_file:
+        # We get the persistent data from the state store, there isn't any if the pokemon commands have never been used
+        saved_data = await main_code.state_store.run(main_code.state_store.load_pokemon_state)
 
+        if saved_data is not None:
             # A pokemon object, values will be "N/A" if no data was available
             PoGoPokemon = namedtuple("PoGoPokemon", ("lat", "lng", "pkdex_id", "iv", "name", "f", "g", "h"))
 
-            # We get the persistent data from disk via json
-            saved_data = json.load(poke_state_file)
-
             # The set of pokemons from the persistent state
             pokemons = set()
 
@@ -466,18 +327,20 @@ def restore_pokemon_state():
 
 
 async def restore_voice_persistent_state():
-    """This function is called on on_ready, and takes the persistent_state/voice_state.json file and tries to restore that state of voice."""
+    """This function is called on on_ready, and takes the voice state from the state store and tries to restore that state of voice."""
 
     # Log the beginning of the process
     helpers.log_info("Restoring voice state...")
 
-    # We try to parse the json in the file
+    # We try to load the state
     try:
-        with open(os.path.join("persistent_state", "voice_state.json")) as state_file:
-            # We try to parse the json
-            loaded_voice_state = json.load(state_file)
+        loaded_voice_state = await main_code.state_store.run(main_code.state_store.load_voice_state)
+
+        # These are the rows that are in the state store now
+        main_code.commands.regular.voice_commands_playlist.stored_voice_states.update(
+            {server_id: json.dumps(state, sort_keys=True) for server_id, state in loaded_voice_state.items()})
     except Exception as e:
-        # We catch all errors as this file is not trusted in any way at all.
+        # We catch all errors as this state is not trusted in any way at all.
         # We just print info about the error
         traceback.print_exception(*sys.exc_info())
         return
@@ -570,15 +433,17 @@ async def restore_voice_persistent_state():
 
                     # We try to play the link, and just log and skip if we fail
                     try:
-                        # We're connected to a voice channel, so we try to create the ytdl stream player
-                        # I found these ytdl options here: https://github.com/rg3/youtube-dl/blob/master/youtube_dl/YoutubeDL.py https://github.com/rg3/youtube-dl/blob/e7ac722d6276198c8b88986f06a4e3c55366cb58/README.md
+                        # We're connected to a voice channel, so we try to create the stream player, the info of the link is cached by the extractor
                         helpers.log_info(
                             "Creating YTDL player for link {0}, at index {1} in playlist, in channel {2} and playlist {3}.".format(
                                 line, num, info["channel_id"],
                                 info["playlist_info"]["playlist_name"]))
-                        youtube_player = await voice.create_ytdl_player(line,
-                                                                        ytdl_options={"noplaylist": True},
-                                                                        after=main_code.commands.regular.voice_commands_playlist.queue_handler)
+                        youtube_player = await main_code.ytdl_extractor.create_player(
+                            voice, line, after=main_code.commands.regular.voice_commands_playlist.queue_handler)
+
+                        # The queue holds entries, which we make of the player
+                        youtube_player = main_code.commands.regular.voice_commands_playlist.queue_entry_from_player(
+                            youtube_player, server_id, None)
                     except youtube_dl.DownloadError:
                         # The URL failed to load, it's probably invalid
                         helpers.log_info(
@@ -630,7 +495,7 @@ async def restore_voice_persistent_state():
     # We set the real info dict to the one we managed to create from rejoining and playing links
     main_code.commands.regular.voice_commands_playlist.server_queue_info_dict = real_voice_state
 
-    # We write the info dict we were able to create to the persistent state file
+    # We mark the info dict we were able to create as changed, so it is written to the state store
     main_code.commands.regular.voice_commands_playlist.store_persistent_voice_state()
 
     # We handle setting the name of the audio as playing game name
@@ -641,177 +506,173 @@ async def restore_voice_persistent_state():
 
 
 async def join_welcome_message(member: discord.Member):
-    """This function is called when a user joins a server, and welcomes them if the server has enabled the welcome message feature."""
+    """This function is called when a user joins a server, and welcomes them if the server has enabled the welcome message feature.
+    The welcome is batched per channel, so a wave of joins gets one welcome message for all of them."""
+
+    # We add the member to the next welcome message of every channel that the server has configured (if any), these were resolved from the config once
+    for channel in main_code.config_index.get(member.server).welcome_channels:
+        welcome_batcher.add(channel, member, client.loop)
 
-    # We check if the server is on the list of servers who use the welcome message feature
-    if int(member.server.id) in [x[0] for x in config["join_msg"]["server_and_channel_id_pairs"]]:
 
-        # We send a message to the specified channels in that server (you can have however many channels you want, but we check if they are on the correct server)
-        channel_ids = \
-            [x[1:] for x in config["join_msg"]["server_and_channel_id_pairs"] if x[0] == int(member.server.id)][0]
+async def send_welcome_messages(channel: discord.Channel, members: list):
+    """Sends one welcome message in the channel for all the members who joined since the last one."""
+    mentions = [member.mention for member in members]
 
-        # We loop through all the possible channels and check if they're valid
-        for channel_id in [int(x) for x in channel_ids]:
-            # We check if the channel id is on the server that the member joined
-            if discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels) is not None:
-                # We send the welcome message:
-                await client.send_message(discord.utils.find(lambda c: int(c.id) == channel_id, member.server.channels),
-                                          config["join_msg"]["welcome_msg"].format(member.mention, member.server.name))
+    # We split the mentions over several messages if there are too many of them to fit in one
+    while mentions:
+        batch_size = len(mentions)
+        while batch_size > 1 and len(config["join_msg"]["welcome_msg"].format(", ".join(mentions[:batch_size]),
+                                                                               channel.server.name)) > 2000:
+            batch_size //= 2
+
+        # We send the welcome message:
+        await client.send_message(channel, config["join_msg"]["welcome_msg"].format(", ".join(mentions[:batch_size]),
+                                                                                     channel.server.name))
+        mentions = mentions[batch_size:]
 
 
 async def join_automatic_role(member: discord.Member):
-    """This function is called when a user joins a server and puts the user in a default role if the server has enabled the automatic role feature."""
+    """This function is called when a user joins a server and puts the user in a default role if the server has enabled the automatic role feature.
+    The members are batched per server, so the default role and our permissions are only looked up once for a wave of joins."""
 
     # We check if the user joined a server that has enabled the automatic role moving feature
-    if int(member.server.id) in [x[0] for x in config["default_role"]["server_and_default_role_id_pairs"]]:
-
-        # Logging that we're going to try putting the new user into the default role for the server
-        helpers.log_info(
-            "Going to try putting user {0:s} ({1:s}) in default role for server {2:s} ({3:s}).".format(member.name,
-                                                                                                       member.id,
-                                                                                                       member.server.name,
-                                                                                                       member.server.id))
-
-        # We store the role that we want to move the new user into
-        target_role = discord.utils.get(member.server.roles, id=
-        str([x[1] for x in config["default_role"]["server_and_default_role_id_pairs"] if x[0] == int(member.server.id)][
-                0]))
-
-        # The user has joined a server where we should put them into a role, so we check if we have the permission to do that (if we are higher up in the role hierarchy than the user and the target role and if we have the manage roles permission)
-        if (max([x.position for x in member.server.me.roles]) > max([x.position for x in member.roles])) and (
-                    max([x.position for x in member.server.me.roles]) > target_role.position):
-
-            # We check if we have the manage roles permission
-            if member.server.me.server_permissions.manage_roles:
-                # Logging that we're putting the user in the target role
-                helpers.log_info(
-                    "Putting user {0:s} ({1:s}) into role {2:s} ({3:s}) which is the default role for server {4:s} ({5:s}).".format(
-                        member.name,
-                        member.id,
-                        target_role.name,
-                        target_role.id,
-                        member.server.name,
-                        member.server.id))
-
-                # We have all the appropriate permissions to move the user to the target role, so we do it :)
-                await client.add_roles(member, target_role)
+    if main_code.config_index.get(member.server).default_role_id is not None:
+        # We add the member to the server's next batch
+        default_role_batcher.add(member.server, member, client.loop)
 
 
-async def join_referral_asker(member: discord.Member):
-    """This function is called when a user joins a server, and asks the user if they were invited / referred to the server by another user on the server."""
+async def add_default_roles(server: discord.Server, members: list):
+    """Puts all the members who joined the server since the last batch into the server's default role."""
 
-    # We check if the server has enabled referrals
-    if str(member.server.id) in config["referral_config"]:
-        retried = False
+    # Logging that we're going to try putting the new users into the default role for the server
+    helpers.log_info(
+        "Going to try putting {0} user(s) in default role for server {1:s} ({2:s}).".format(len(members), server.name,
+                                                                                           server.id))
 
-        # We loop until we've got a correct answer or been ignored until the timeout
-        while True:
-            # We check if this is the first time we ask or not
-            if not retried:
-                # We PM the user and ask them who referred them (if anyone)
-                await client.send_message(member,
-                                          "Hi {0:s}! I'm a bot on **{1}**, which you just joined, and I want to know if someone referred you to **{1}**.\nIf so, please tell me within {2} minutes, by responding with \"*referrer: <REFERRER'S USERNAME#DISCRIMINATOR>*\", *\"referrer: <REFERRER'S NICK ON {1}>\"*, or just ignore this if you weren't referred by anyone.".format(
-                                              member.name, member.server.name,
-                                              config["referral_config"][str(member.server.id)]["referral_timeout_min"]))
-            else:
-                # We PM the user and ask them to try again
-                await client.send_message(member,
-                                          "That user does not exist on **{0}**, please try again, or ignore until the timeout".format(
-                                              member.server.name))
+    # We get the role that we want to move the new users into, it was resolved from the config once
+    target_role = main_code.config_index.get(server).default_role
 
-            # We create a function that checks if a message is a referrer answer
-            check_response = lambda x: x.content.lower().strip().startswith("referrer: ") and len(
-                x.content.lower().strip()) > len("referrer: ")
+    # We check if the role still exists and if we have the manage roles permission, these are the same for the whole batch
+    if target_role is None or not server.me.server_permissions.manage_roles:
+        return
 
-            # We wait for a response, if we don't get one within the configured number of minutes we just exit
-            response_message = await client.wait_for_message(
-                timeout=config["referral_config"][str(member.server.id)]["referral_timeout_min"] * 60, author=member,
-                channel=client.get_channel(member.id), check=check_response)
+    # Our position in the role hierarchy, we have to be higher up than the users and the target role
+    own_position = max([x.position for x in server.me.roles])
+    if own_position <= target_role.position:
+        return
 
-            # We check if we got a response, if not, we exit
-            if response_message:
+    for member in members:
+        # The user has joined a server where we should put them into a role, so we check if we're higher up in the role hierarchy than the user
+        if own_position > max([x.position for x in member.roles]):
+            # Logging that we're putting the user in the target role
+            helpers.log_info(
+                "Putting user {0:s} ({1:s}) into role {2:s} ({3:s}) which is the default role for server {4:s} ({5:s}).".format(
+                    member.name,
+                    member.id,
+                    target_role.name,
+                    target_role.id,
+                    server.name,
+                    server.id))
+
+            # We have all the appropriate permissions to move the user to the target role, so we do it :)
+            # A failure for one member (like a member who left while the batch was collected) mustn't stop the rest of the batch from getting the role
+            try:
+                await client.add_roles(member, target_role)
+            except discord.HTTPException as e:
+                helpers.log_warning("Could not put user {0:s} ({1:s}) into the default role for server {2:s} ({3:s}), info: {4}".format(
+                    member.name, member.id, server.name, server.id, e))
 
-                # We add the message to the "messages to ignore" list
-                ignored_command_message_ids.append(response_message.id)
 
-                # We check if the user specified in the response exists on the server that the user joined
-                referrer = member.server.get_member_named(response_message.content.strip()[len("referrer: "):])
+async def join_referral_asker(member: discord.Member):
+    """This function is called when a user joins a server, and asks the user if they were invited / referred to the server by another user on the server.
+    The answer is routed to handle_referral_answer by on_message, through the referral router."""
 
-                if referrer:
+    # We check if the server has enabled referrals
+    if str(member.server.id) in config["referral_config"]:
+        # We PM the user and ask them who referred them (if anyone)
+        await client.send_message(member,
+                                  "Hi {0:s}! I'm a bot on **{1}**, which you just joined, and I want to know if someone referred you to **{1}**.\nIf so, please tell me within {2} minutes, by responding with \"*referrer: <REFERRER'S USERNAME#DISCRIMINATOR>*\", *\"referrer: <REFERRER'S NICK ON {1}>\"*, or just ignore this if you weren't referred by anyone.".format(
+                                      member.name, member.server.name,
+                                      config["referral_config"][str(member.server.id)]["referral_timeout_min"]))
 
-                    # We load the referrals file
-                    with open("referrals.json", mode="r", encoding="utf-8") as referrals_file:
-                        referrals = json.load(referrals_file)
+        # We register the question, if we don't get an answer within the configured number of minutes the referral router times it out
+        main_code.referral_router.register(member.id, member.server.id,
+                                           time.time() + config["referral_config"][str(member.server.id)][
+                                               "referral_timeout_min"] * 60)
 
-                    # We check if the server exists in the referrals data
-                    if not str(member.server.id) in referrals["servers"]:
-                        # We add the server to the servers list (in the referrals data)
-                        referrals["servers"][str(member.server.id)] = {"been_referred": {}, "have_referred": []}
 
-                    # We check if the referring user has referred before, if they have, we tell them that they have already referred and exit
-                    if not member.id in referrals["servers"][str(member.server.id)]["have_referred"]:
+def is_referral_answer(content: str) -> bool:
+    """Returns True if the content of a message is a referrer answer."""
+    return content.lower().strip().startswith("referrer: ") and len(content.lower().strip()) > len("referrer: ")
 
-                        # We check if we should announce that a user has been referred
-                        if config["referral_config"][str(member.server.id)]["announce_channel_id"] != 0:
-                            # We get and check that the announce channel id is valid
-                            announce_channel = client.get_channel(
-                                config["referral_config"][str(member.server.id)]["announce_channel_id"])
 
-                            if announce_channel is not None:
-                                if announce_channel.server.id == member.server.id:
-                                    # We send the announcement that a user has been referred
-                                    await client.send_message(announce_channel,
-                                                              "{0} has been referred by {1}! :tada::tada::tada:".format(
-                                                                  referrer.mention, member.mention))
+async def handle_referral_answer(response_message: discord.Message, server_id: str, deadline: float):
+    """This function is called with the answer of a user to a referral question, and registers the referral if the referrer exists on the server."""
 
-                        # We check if the referrer exists in the server referrals data
-                        if not str(referrer.id) in referrals["servers"][str(member.server.id)]["been_referred"]:
-                            # We add the referrer to the server referrals data
-                            referrals["servers"][str(member.server.id)]["been_referred"][str(referrer.id)] = 1
+    # We get the member object of the user on the server they were asked about, if they have left it since there's nothing to do
+    server = client.get_server(server_id)
+    member = server.get_member(response_message.author.id) if server is not None else None
+    if member is None:
+        return
 
-                        else:
-                            # If the user already exists in the data we just increment the number of times the user has been referred
-                            referrals["servers"][str(member.server.id)]["been_referred"][str(referrer.id)] += 1
+    # We check if the user specified in the response exists on the server that the user joined
+    referrer = member.server.get_member_named(response_message.content.strip()[len("referrer: "):])
 
-                        # We add the referred to the "have_referred" list
-                        referrals["servers"][str(member.server.id)]["have_referred"].append(member.id)
+    if referrer:
+        # We record the referral, this returns None if the user has already referred someone on the server (a set lookup)
+        num_refs = await main_code.referral_store.record_referral(member.server.id, member.id, referrer.id)
 
-                        # We log that the referred has referred the referrer
-                        helpers.log_info(
-                            "User {0} has referred user {1} to server {2}.".format(member.name, referrer.name,
-                                                                                   member.server.name))
+        # We check if the referring user has referred before, if they have, we tell them that they have already referred and exit
+        if num_refs is not None:
 
-                        # We tell the user that their referral has been registered
-                        await client.send_message(member, "Ok, your referral has been registered.")
+            # We check if we should announce that a user has been referred
+            if config["referral_config"][str(member.server.id)]["announce_channel_id"] != 0:
+                # We get and check that the announce channel id is valid
+                announce_channel = client.get_channel(
+                    config["referral_config"][str(member.server.id)]["announce_channel_id"])
 
-                        # We call the referral reward function and pass the referrer and the number of referrals that member now has
-                        await referral_reward_handler(referrer,
-                                                      referrals["servers"][str(member.server.id)]["been_referred"][
-                                                          str(referrer.id)])
+                if announce_channel is not None:
+                    if announce_channel.server.id == member.server.id:
+                        # We send the announcement that a user has been referred
+                        await client.send_message(announce_channel,
+                                                  "{0} has been referred by {1}! :tada::tada::tada:".format(
+                                                      referrer.mention, member.mention))
 
-                    else:
-                        # We tell the user that they have already referred before, and then we exit
-                        await client.send_message(member,
-                                                  "You have already referred a user on {0}, and you can not do that again.".format(
-                                                      member.server.name))
+            # We log that the referred has referred the referrer
+            helpers.log_info(
+                "User {0} has referred user {1} to server {2}.".format(member.name, referrer.name,
+                                                                       member.server.name))
 
-                    # We write the modified referrals back to the file
-                    with open("referrals.json", mode="w", encoding="utf-8") as referrals_file:
-                        json.dump(referrals, referrals_file, indent=2, sort_keys=True)
+            # We tell the user that their referral has been registered
+            await client.send_message(member, "Ok, your referral has been registered.")
 
-                else:
-                    # The user did not exist on the server, we try again
-                    retried = True
-                    continue
+            # We call the referral reward function and pass the referrer and the number of referrals that member now has
+            await referral_reward_handler(referrer, num_refs)
 
-            else:
-                # We tell the user that the referral period has ended
-                await client.send_message(member,
-                                          "The referral timeout has been reached, you can no longer refer someone (for **{0}**, does not apply to other servers)".format(
-                                              member.server.name))
+        else:
+            # We tell the user that they have already referred before, and then we exit
+            await client.send_message(member,
+                                      "You have already referred a user on {0}, and you can not do that again.".format(
+                                          member.server.name))
 
-            # If we haven't redone the loop by now we exit the loop
-            break
+    else:
+        # The user did not exist on the server, we ask them to try again, and wait for another answer until the same deadline
+        await client.send_message(member,
+                                  "That user does not exist on **{0}**, please try again, or ignore until the timeout".format(
+                                      member.server.name))
+        main_code.referral_router.register(member.id, member.server.id, deadline)
+
+
+async def referral_timed_out(user_id: str, server_id: str):
+    """This function is called by the referral router when a referral question wasn't answered in time."""
+    server = client.get_server(server_id)
+    member = server.get_member(user_id) if server is not None else None
+
+    if member is not None:
+        # We tell the user that the referral period has ended
+        await client.send_message(member,
+                                  "The referral timeout has been reached, you can no longer refer someone (for **{0}**, does not apply to other servers)".format(
+                                      member.server.name))
 
 
 @client.event
@@ -834,49 +695,77 @@ async def on_error(event, *args, **kwargs):
 async def referral_reward_handler(member: discord.Member, num_refs: int):
     """This method is used to (according to the config) reward users with roles once they get a certain amount of referrals."""
 
-    # We make a list of all the roles that we need to be higher than in the role hierarchy
-    reward_roles = {int(x): discord.utils.get(member.server.roles, id=int(
-        config["referral_config"][str(member.server.id)]["referral_rewards"][x])) for x in
-                    config["referral_config"][str(member.server.id)]["referral_rewards"] if
-                    x.isdigit() and discord.utils.get(member.server.roles, id=int(
-                        config["referral_config"][str(member.server.id)]["referral_rewards"][x])) is not None}
+    # We get the compiled reward ladder of the server, and check if there are any reward roles at all
+    ladder = main_code.referral_rewards.get_ladder(member.server, config)
+    if ladder is None:
+        return
 
-    # We check if there are any reward roles at all
-    if len(reward_roles) > 0:
-        # We store the highest hierarchy position of the reward roles
-        max_reward_role_position = max([reward_roles[x].position for x in reward_roles])
+    # We find the tier that the user has reached with a bisect, if they haven't reached any there's nothing to do
+    tier = ladder.get_tier(num_refs)
+    if tier < 0:
+        return
 
-        # We check if we have the proper permissions to add and remove all the roles that can be gotten from referrals
-        if (member.server.me.top_role.position > member.top_role.position) and (
-                    member.server.me.top_role.position > max_reward_role_position):
+    # We check if we have the proper permissions to add and remove all the roles that can be gotten from referrals
+    if (member.server.me.top_role.position > member.top_role.position) and (
+                member.server.me.top_role.position > max([x.position for x in ladder.roles])):
 
-            # We check if we have the manage roles permission
-            if member.server.me.server_permissions.manage_roles:
+        # We check if we have the manage roles permission
+        if member.server.me.server_permissions.manage_roles:
+            current_reward_role = ladder.roles[tier]
 
-                # We have all the permissions we need, so we get the role for the current referral level. If there isn't a reward for the current referral level, we exit, as we know that we have already given the user the reward
-                if num_refs in reward_roles:
-                    current_reward_role = reward_roles[num_refs]
+            # We remove all the reward roles under the current tier, not just the previous one, as the timespans for referrals may be quite large, and the config may therefore have changed in ways that require us to use all previous roles.
+            previous_reward_roles = set(ladder.roles[:tier])
 
-                    # We log that we're going to move a user to a higher level reward role
-                    helpers.log_info(
-                        "Moving user {0} to role {1} on server {2} because user reached {3} referrals.".format(
-                            member.name,
-                            current_reward_role.name,
-                            member.server.name,
-                            num_refs))
+            # If the user already has the current role and none of the previous ones, we have already given the user the reward
+            if current_reward_role in member.roles and previous_reward_roles.isdisjoint(member.roles):
+                return
+
+            new_roles = [x for x in member.roles if x not in previous_reward_roles and x != current_reward_role] + [
+                current_reward_role]
+
+            # We log that we're going to move a user to a higher level reward role
+            helpers.log_info(
+                "Moving user {0} to role {1} on server {2} because user reached {3} referrals.".format(
+                    member.name,
+                    current_reward_role.name,
+                    member.server.name,
+                    num_refs))
 
-                    # We make a list of all the reward roles under the current level so we can remove them. We can't just remove the previous role here, as the timespans for referrals may be quite large, and the config may therefore have changed in ways that require us to use all previous roles.
-                    prev_reward_roles = [x for i, x in reward_roles if i < num_refs and x in member.roles]
+            # We add the current reward level's role and remove the previous ones in one role edit
+            await client.replace_roles(member, *new_roles)
 
-                    # We remove all the previous roles
-                    await client.remove_roles(member, *prev_reward_roles)
 
-                    # We add the current reward level's role
-                    await client.add_roles(member, current_reward_role)
+@client.event
+async def on_server_role_create(role: discord.Role):
+    """This event is called when a role is created, a role in the config might exist now, so we recompile the server's reward ladder and resolve its config again."""
+    main_code.referral_rewards.invalidate(role.server.id)
+    main_code.config_index.invalidate(role.server.id)
+
+
+@client.event
+async def on_server_role_delete(role: discord.Role):
+    """This event is called when a role is deleted, it might have been in the config, so we recompile the server's reward ladder and resolve its config again."""
+    main_code.referral_rewards.invalidate(role.server.id)
+    main_code.config_index.invalidate(role.server.id)
+
 
+@client.event
+async def on_channel_create(channel: discord.Channel):
+    """This event is called when a channel is created, a channel in the config might exist now, so we resolve the server's config again."""
+    if not channel.is_private:
+        main_code.config_index.invalidate(channel.server.id)
+
+
+@client.event
+async def on_channel_delete(channel: discord.Channel):
+    """This event is called when a channel is deleted, it might have been in the config, so we resolve the server's config again."""
+    if not channel.is_private:
+        main_code.config_index.invalidate(channel.server.id)
 
-@main_code.command_decorator.command("help", "Do I really need to explain this...")
-async def cmd_help(message: discord.Message, passed_client: discord.Client, passed_config: dict):
+
+@main_code.command_decorator.command("help", "Do I really need to explain this...", cost_class="light")
+async def cmd_help(message: discord.Message, passed_client: discord.Client, passed_config: dict,
+                   context: main_code.command_context.CommandContext):
     """This method is called to handle someone needing information about the commands they can use anna for.
     Because of code simplicity this is one of the command functions that needs to stay in the __init__py file."""
 
@@ -904,7 +793,7 @@ async def cmd_help(message: discord.Message, passed_client: discord.Client, pass
             "command"] + "**\n" + helpcommand["helptext"]
 
     # Checking if the issuer is an admin user, so we know if we should show them the admin commands
-    if int(message.author.id) in passed_config["somewhat_weird_shit"]["admin_user_ids"]:
+    if context.is_admin:
         # Generating the combined and formatted helptext of all the admin commands (we do this in >2000 char chunks, as 2000 chars is the max length of a discord message)
         admin_commands_helptext = [""]
 
@@ -930,7 +819,7 @@ async def cmd_help(message: discord.Message, passed_client: discord.Client, pass
                                          "Sure thing " + message.author.mention + ", you'll see the commands and how to use them in our PMs :smile:")
 
     # Checking if the issuer is an admin user, so we know if we should show them the admin commands
-    if int(message.author.id) in passed_config["somewhat_weird_shit"]["admin_user_ids"]:
+    if context.is_admin:
 
         # Just putting the helptexts we made in the PM with the command issuer
         await passed_client.send_message(message.author, "Ok, here are the commands you can use me for :smile:")
@@ -973,7 +862,8 @@ async def cmd_help(message: discord.Message, passed_client: discord.Client, pass
 
 
 @main_code.command_decorator.command("reload config", "Reloads the config file that anna-bot uses.", admin=True)
-async def cmd_admin_reload_config(message: discord.Message, passed_client: discord.Client, passed_config: dict):
+async def cmd_admin_reload_config(message: discord.Message, passed_client: discord.Client, passed_config: dict,
+                                  context: main_code.command_context.CommandContext):
     """This method is used to handle an admin user wanting us to reload the config file.
     Because of code simplicity this is one of the command functions that needs to stay in the __init__py file."""
 
@@ -996,6 +886,27 @@ async def cmd_admin_reload_config(message: discord.Message, passed_client: disco
         global config
         config = json.load(opened_config_file)
 
+    # The stats on disk are older than the ones in memory, so we keep using the ones in memory
+    main_code.stats.attach(config)
+
+    # The throttle settings might have changed
+    main_code.throttle.configure(config)
+
+    # And so might the join batching intervals
+    main_code.join_pipeline.configure(config)
+
+    # And the prefetch window of the voice queues
+    main_code.voice_queue.configure(config)
+
+    # And the youtube_dl extraction limits and cache settings
+    main_code.ytdl_extractor.configure(config)
+
+    # The referral rewards might have changed too, so the reward ladders are compiled again when they're needed
+    main_code.referral_rewards.invalidate()
+
+    # We compile the per-server lookup tables from the new config
+    main_code.config_index.build(config)
+
     # Logging that we're done loading the config
     helpers.log_info("Done reloading the config")
 
@@ -1041,24 +952,6 @@ async def cmd_admin_reload_config(message: discord.Message, passed_client: disco
                                          "Ok " + message.author.mention + ", I'm done reloading it now :smile:")
 
 
-def set_special_param(index: int, value):
-    """This function handles resolving a special param index into being able to set that variable (it can be immutable) to the inputted value.
-    We need this function since python doesn't have a concept of references."""
-
-    global ignored_command_message_ids
-    global config
-    global last_online_time_dict
-
-    # This code is really ugly because we need performance (dictionaries with lambdas with exec it very slow since it compiles every time we define it),
-    # because python doesn't have any concept of references, and because python doesn't have any equivalent to switch/case
-    if index == 0:
-        ignored_command_message_ids = value
-    elif index == 1:
-        config = value
-    elif index == 2:
-        last_online_time_dict = value
-
-
 async def set_playing_game_name(interval: int = 2):
     """Sets the playing game name to be whatever is in helpers.playing_game_name."""
 
@@ -1087,39 +980,9 @@ async def set_playing_game_name(interval: int = 2):
 
 async def webserver_post_last_online_list(server_address: str, server_port: int, interval: int):
     """This method is called periodically and handler posting data about last online times for users
-    on a discord server to an anna-falcon-server instance."""
-
-    async def do_async_list_post(passed_session: aiohttp.ClientSession):
-        try:
-            with async_timeout.timeout(interval / 2, loop=client.loop):
-                return await asyncio.wait_for(
-                    passed_session.post("http://" + server_address + ":{0}/lastseen".format(server_port),
-                                        timeout=interval / 2,
-                                        data=json.dumps(last_online_time_dict)), interval / 2, loop=client.loop)
-        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
-            helpers.log_info("Got error when trying to send data to webserver, info: \n{0}".format(e))
-
-    # This runs forever (until the bot exits)
-    while True:
-        # We log
-        helpers.log_info("Sending last-online-list info to webserver at {0}:{1}.".format(server_address, server_port))
-
-        # We post the data to the appropriate address and port
-        async with aiohttp.ClientSession(loop=client.loop, connector=aiohttp.TCPConnector(verify_ssl=False,
-                                                                                          keepalive_timeout=5)) as session:
-            try:
-                (await do_async_list_post(session)).close()
-            except Exception as e:
-                helpers.log_info("Got unusual error when trying to send data to webserver, info: \n{0}".format(e))
-            else:
-                helpers.log_info(
-                    "Sent last-online-list info to webserver at {0}:{1}. Now waiting for {2} seconds.".format(
-                        server_address,
-                        server_port,
-                        interval))
-
-        # We wait until the next time we're supposed to send the info.
-        await asyncio.sleep(interval)
+    on a discord server to an anna-falcon-server instance. Only the changes since the last acknowledged post are sent, see last_seen_sync."""
+    await main_code.last_seen_sync.sync_loop(server_address, server_port, config["webserver_config"]["auth_token"],
+                                             interval, client.loop)
 
 
 # We define the objects that we have to use in the file scope
@@ -1129,58 +992,83 @@ config = {}
 public_commands = []
 # Admin commands
 admin_commands = []
+# The router that resolves message contents into commands, built from the public and admin commands at startup
+command_router = main_code.command_router.CommandRouter([], [])
 # Functions to run when people join a server
 join_functions = []
-# Msg ideas that should be ignored
-ignored_command_message_ids = []
+
+# The batchers that collect joining members for the welcome messages (per channel) and the default roles (per server)
+welcome_batcher = main_code.join_pipeline.KeyedBatcher("welcome", send_welcome_messages)
+default_role_batcher = main_code.join_pipeline.KeyedBatcher("default_role", add_default_roles)
+# Msg ids that should be ignored
+ignored_command_message_ids = main_code.ignored_messages.IgnoredMessageRegistry()
 # Voice stream players for each server
 server_and_stream_players = []
-# The info to send to the anna-falcon webserver
-last_online_time_dict = {}
 # The background asyncio tasks we have, keys are names of tasks, vals are the tasks
 background_tasks = {}
 
+# The close coroutine of the client, which close_client wraps
+client_close = client.close
 
-def start_anna():
-    """Starts anna-bot, and returns when anna exits. If anna throws an exception, this exception is propagated. If anna exits peacefully, this returns with no exception."""
+
+async def close_client():
+    """Cancels the commands and join hooks that are still running, waits (a bit) for them to finish cancelling, and then closes the client.
+    This replaces client.close, which logout calls (discord.py's run calls logout on CTRL+C), so it runs while the event loop is still running,
+    run closes the loop right after it, and tasks can't be cancelled after that."""
+    cancelled_tasks = main_code.command_scheduler.cancel_all(client.loop) + main_code.join_pipeline.cancel_all(client.loop)
+    if cancelled_tasks:
+        await asyncio.wait(cancelled_tasks, timeout=5)
+
+    await client_close()
+
+client.close = close_client
+
+
+def load_anna():
+    """Loads the config and everything that depends on it, and builds the command router, without logging in.
+    start_anna calls this before it runs the client, and the load test harness (benchmarks/load_test.py) calls it to get a bot it can replay events into."""
 
     # Logging that we're loading the config
     helpers.log_info("Loading the config file...")
 
     # We make sure we use the global objects
-    global config, public_commands, admin_commands, join_functions, ignored_command_message_ids, server_and_stream_players, last_online_time_dict
+    global config, public_commands, admin_commands, command_router, join_functions, ignored_command_message_ids, server_and_stream_players
     config = {}
 
     # Loading the config file and then parsing it as json and storing it in a python object
     with open("config.json", mode="r", encoding="utf-8") as config_file:
         config = json.load(config_file)
 
-    # We store the bot start time in the volatile stats section
-    config["stats"]["volatile"]["start_time"] = time.time()
+    # We load the youtube_dl extraction settings and start the worker processes first, before the state store opens its database (and starts its thread)
+    # and before we connect, so those aren't copied into the workers when they're forked
+    # The log pipeline's threads are already running though, helpers starts them when it's imported
+    main_code.ytdl_extractor.configure(config)
+    main_code.ytdl_extractor.start()
 
-    # We write the modified config back to the file
-    with open("config.json", mode="w", encoding="utf-8") as config_file:
-        json.dump(config, config_file, indent=2, sort_keys=False)
+    # We load the stats counters from the config, from now on they're kept in memory and flushed to disk by the stats module
+    main_code.stats.load(config)
 
     # Logging that we're done loading the config
     helpers.log_info("Done loading the config")
 
+    # We load the custom server prefixes into memory, so checking if a message is a command never needs to read the file
+    helpers.load_configured_prefixes()
+
     commands = main_code.command_decorator.get_command_lists()
 
     # The commands people can use and the method that will be called when a command is used
-    # The special params are defined in the on_message function, but they basically just pass all the special params as KW arguments
-    # Most commands use the helpers.command(command_trigger, description, special_params, admin) decorator, but these cannot use that since they have config based command parameters
+    # Most commands use the command_decorator.command(command_trigger, description, admin, cost_class) decorator, but these cannot use that since they have config based command parameters
     public_commands = [dict(command="invite", method=main_code.commands.regular.invite_link.invite_link,
                             helptext="Generate an invite link to the current channel, the link will be valid for " + str(
                                 config["invite_cmd"]["invite_valid_time_min"] if config["invite_cmd"][
                                                                                      "invite_valid_time_min"] > 0 else "infinite") + " minutes and " + str(
                                 config["invite_cmd"]["invite_max_uses"] if config["invite_cmd"][
                                                                                "invite_max_uses"] > 0 else "infinite") + " use[s].",
-                            special_params=[False, False, False]),
+                            cost_class="normal"),
                        dict(command=config["start_server_cmd"]["start_server_command"],
                             method=main_code.commands.regular.start_server.start_server,
                             helptext="Start the minecraft server (if the channel and users have the necessary permissions to do so).",
-                            special_params=[False, False, False])
+                            cost_class="cpu_heavy")
                        ]
 
     # The commands authorised users can use, these are some pretty powerful commands, so be careful with which users you give administrative access to the bot to
@@ -1190,22 +1078,53 @@ def start_anna():
     public_commands.extend(commands[0])
     admin_commands.extend(commands[1])
 
+    # We compile the command lists into the router that on_message uses to find which command a message triggers
+    command_router = main_code.command_router.CommandRouter(public_commands, admin_commands)
+
     # The functions to call when someone joins the server, these get passed the member object of the user who joined
     join_functions = [join_welcome_message,
                       join_automatic_role,
                       join_referral_asker]
 
-    # The list of message ids (this list will fill and empty) that the command checker should ignore
-    ignored_command_message_ids = []
+    # The registry of message ids that the command checker should ignore, ids expire after a while and the size is capped so it can't grow without bound
+    ignored_command_message_ids = main_code.ignored_messages.IgnoredMessageRegistry()
 
     # The list of tuples of voice stream players and server ids
     server_and_stream_players = []
 
+    # We load the throttle settings
+    main_code.throttle.configure(config)
+
+    # We load the join batching intervals
+    main_code.join_pipeline.configure(config)
+
+    # We load the prefetch window of the voice queues
+    main_code.voice_queue.configure(config)
+
+    # We load the referral questions that were still waiting for an answer when we were stopped
+    main_code.referral_router.load()
+
+    # We load the referrals into their indexes
+    main_code.referral_store.load()
+
+    # The reward ladders are compiled from the (new) config when they're first needed
+    main_code.referral_rewards.invalidate()
+
+    # We compile the per-server lookup tables from the config
+    main_code.config_index.build(config)
+
+
+def start_anna():
+    """Starts anna-bot, and returns when anna exits. If anna throws an exception, this exception is propagated. If anna exits peacefully, this returns with no exception."""
+
+    # We load the config and build everything that depends on it
+    load_anna()
+
     # Logging that we're starting the bot
     helpers.log_info("Anna-bot is now logging in (you'll notice if we get any errors)")
 
     # Storing the time at which the bot was started
-    config["stats"]["volatile"]["start_time"] = time.time()
+    main_code.stats.start_time = time.time()
 
     # We setup a recurring task that will cleanup timeouted chess sessions
     background_tasks["chess_session_cleaner"] = client.loop.create_task(
@@ -1214,15 +1133,25 @@ def start_anna():
     # We setup a recurring task that will set the name of the playing game to be whatever is in helpers.playing_game_name
     background_tasks["game_name_setter"] = client.loop.create_task(set_playing_game_name())
 
-    # We set up the webserver handling if the user has indicated that we're using a webserver
-    if config["webserver_config"]["use_webserver"]:
-        # We create the object we're going to send to the webserver
-        last_online_time_dict = {"servers": [], "auth_token": config["webserver_config"]["auth_token"]}
+    # We setup a recurring task that measures the event loop lag that the throttle sheds commands by
+    background_tasks["loop_lag_monitor"] = client.loop.create_task(main_code.throttle.monitor_loop_lag())
 
-    background_tasks["webserver_task"] = client.loop.create_task(
-        webserver_post_last_online_list(config["webserver_config"]["server_address"],
-                                        config["webserver_config"]["server_port"],
-                                        config["webserver_config"]["update_interval_seconds"]))
+    # We setup a recurring task that flushes the stats counters to disk
+    background_tasks["stats_flusher"] = client.loop.create_task(main_code.stats.flush_loop(client.loop))
+
+    # We setup a recurring task that posts the last online list to the webserver, if we use one
+    if config["webserver_config"]["use_webserver"]:
+        background_tasks["webserver_task"] = client.loop.create_task(
+            webserver_post_last_online_list(config["webserver_config"]["server_address"],
+                                            config["webserver_config"]["server_port"],
+                                            config["webserver_config"]["update_interval_seconds"]))
+
+    # We start the pull server that serves the last seen records, if it's enabled
+    pull_server_config = config["webserver_config"].get("pull_server", {})
+    if pull_server_config.get("enabled", False):
+        background_tasks["pull_server_starter"] = client.loop.create_task(
+            main_code.last_seen_server.start(pull_server_config["host"], pull_server_config["port"],
+                                             config["webserver_config"]["auth_token"], client.loop))
 
     try:
         # We have a while loop here because some errors are only catchable from the client.run method, as they are raised by tasks in the event loop
@@ -1275,16 +1204,32 @@ def start_anna():
         helpers.log_info("Client exited, but we didn't get an error, probably CTRL+C or command exit...")
         exit_code = 0
 
-    # Calculating and formatting how long the bot was online so we can log it, this is on multiple statements for clarity
-    end_time = time.time()
-    uptime_secs_noformat = (end_time - config["stats"]["volatile"]["start_time"]) // 1
-    formatted_uptime = helpers.get_formatted_duration_fromtime(uptime_secs_noformat)
+    # We flush the stats counters one last time, so we don't lose the counts since the last periodic flush
+    main_code.stats.flush()
+
+    # We write out the pending referral questions, so they're still waiting for an answer when we're started again
+    main_code.referral_router.flush()
+
+    # We write out the voice state of the servers that have changed since the last flush
+    main_code.commands.regular.voice_commands_playlist.flush_voice_state()
+
+    # We stop the youtube_dl worker processes
+    main_code.ytdl_extractor.shutdown()
+
+    # We wait for the state store to finish its writes, and close it
+    main_code.state_store.close()
+
+    # Calculating and formatting how long the bot was online so we can log it
+    formatted_uptime = helpers.get_formatted_duration_fromtime(main_code.stats.get_uptime_seconds())
 
     # Logging that we've stopped the bot
     helpers.log_info(
         "Anna-bot has now exited (you'll notice if we got any errors), we have been up for {0}.".format(
             formatted_uptime))
 
+    # We wait for the log pipeline to write out everything that's still queued (and send any pending alert emails)
+    main_code.log_pipeline.stop()
+
     # We exit with the proper code
     exit(exit_code)
 
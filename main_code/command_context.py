@@ -0,0 +1,40 @@
+import discord
+
+from . import helpers
+from . import ignored_messages
+
+"""This file defines the context object that command dispatch builds once per command message and passes to the command."""
+
+
+class CommandContext:
+    """Everything dispatch has already worked out about a command message, so commands don't need to parse the message again.
+    content is the message content without the prefix/mention (stripped, case preserved), trigger is the (lowercase) trigger that matched,
+    and arguments is the rest of content after the trigger (stripped, case preserved)."""
+
+    __slots__ = ("message", "content", "trigger", "arguments", "prefix", "is_pm", "is_admin", "ignored_message_ids")
+
+    def __init__(self, message: discord.Message, client: discord.Client, is_admin: bool,
+                 ignored_message_ids: ignored_messages.IgnoredMessageRegistry):
+        self.message = message
+        self.is_pm = message.channel.is_private
+        self.is_admin = is_admin
+
+        # The registry of message ids that command dispatch should ignore, commands that wait for answers add the answers to this
+        self.ignored_message_ids = ignored_message_ids
+
+        # PMs don't use prefixes, so we only need to remove the prefix/mention from server messages
+        if self.is_pm:
+            self.prefix = ""
+            self.content = message.content.strip()
+        else:
+            self.prefix = helpers.get_command_prefix(client, message.server.id)
+            self.content = helpers.remove_anna_mention(client, message).strip()
+
+        # These are set when we know which command the message triggers
+        self.trigger = ""
+        self.arguments = self.content
+
+    def set_trigger(self, trigger: str):
+        """Sets the trigger of the command that the message triggered, and splits the arguments off from it."""
+        self.trigger = trigger
+        self.arguments = self.content[len(trigger):].strip()
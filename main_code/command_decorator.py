@@ -1,13 +1,21 @@
+from . import throttle
+
 public_commands = []
 admin_commands = []
 
 
-def command(command_trigger: str, cmd_helptext: str, cmd_special_params=(False, False), admin=False):
-    """This function defines the decorator with arguments that we use to quite dynamically create the command dicts in the main file."""
+def command(command_trigger: str, cmd_helptext: str, admin=False, cost_class="normal"):
+    """This function defines the decorator with arguments that we use to quite dynamically create the command dicts in the main file.
+    Command methods are called with (message, client, config, context), where context is the command_context.CommandContext of the message.
+    The cost class is one of the classes in throttle.cost_classes, and decides how the command is rate limited."""
 
     global public_commands
     global admin_commands
 
+    # We catch typos in cost classes when the command is registered, instead of when it's used
+    if cost_class not in throttle.cost_classes:
+        raise ValueError("Unknown cost class \"{0}\" for the {1} command.".format(cost_class, command_trigger))
+
     # The actual decorator that gets used on the function
     # Decorators with arguments basically return a parametrised decorator that then gets to decorate the actual function
     def real_decorator(cmd_method):
@@ -16,11 +24,11 @@ def command(command_trigger: str, cmd_helptext: str, cmd_special_params=(False,
         if not admin:
             # The command is public so we append to the public command list
             public_commands.append(dict(command=command_trigger, method=cmd_method, helptext=cmd_helptext,
-                                        special_params=cmd_special_params))
+                                        cost_class=cost_class))
         else:
             # The command is an admin command, so we append to the admin command list
             admin_commands.append(dict(command=command_trigger, method=cmd_method, helptext=cmd_helptext,
-                                       special_params=cmd_special_params))
+                                       cost_class=cost_class))
 
         # We actually don't modify the cmd method itself, we just need to register it as a command
         return cmd_method
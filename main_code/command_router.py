@@ -0,0 +1,69 @@
+"""This file handles resolving the content of a command message into the command it triggers."""
+
+
+class _TrieNode:
+    """A node in the command trigger trie. Holds the children (keyed by character) and the commands whose trigger ends here."""
+
+    __slots__ = ("children", "public_command", "admin_command")
+
+    def __init__(self):
+        self.children = {}
+        self.public_command = None
+        self.admin_command = None
+
+
+class CommandRouter:
+    """A character trie built once from the public and admin command lists.
+    Resolving a message is a single walk down the trie (bounded by the length of the longest trigger) instead of a startswith check against every command.
+    The matching is still prefix based like before, but when several triggers are prefixes of the message (e.g. "voice play" and "voice play link"), the longest one wins."""
+
+    def __init__(self, public_commands: list, admin_commands: list):
+        # The root of the trie, it never holds any commands itself
+        self.root = _TrieNode()
+
+        # We add all the commands, admin commands are triggered by "admin " + their trigger, just like before
+        for command in public_commands:
+            self._insert(command["command"].lower(), command, admin=False)
+
+        for command in admin_commands:
+            self._insert("admin " + command["command"].lower(), command, admin=True)
+
+    def _insert(self, trigger: str, command: dict, admin: bool):
+        """Adds a command to the trie under the passed trigger. If two commands share a trigger, the first one registered wins (like the old list scan)."""
+
+        # We walk (and create) the path for the trigger
+        node = self.root
+        for char in trigger:
+            node = node.children.setdefault(char, _TrieNode())
+
+        # We store the command at the end of the path
+        if admin:
+            if node.admin_command is None:
+                node.admin_command = command
+        else:
+            if node.public_command is None:
+                node.public_command = command
+
+    def resolve(self, content: str, allow_admin: bool = False):
+        """Returns a tuple of (command dict, is admin command) for the longest trigger that the passed content starts with,
+        or (None, False) if the content doesn't trigger any command. The content should already be lowercased and stripped.
+        Admin commands are only considered if allow_admin is True."""
+
+        # The best match we've found so far
+        match = (None, False)
+
+        node = self.root
+        for char in content:
+            node = node.children.get(char)
+
+            # We've walked off the trie, so there can't be any longer matches
+            if node is None:
+                break
+
+            # Public commands win over admin commands with the same trigger, just like they were checked first before
+            if node.public_command is not None:
+                match = (node.public_command, False)
+            elif allow_admin and node.admin_command is not None:
+                match = (node.admin_command, True)
+
+        return match
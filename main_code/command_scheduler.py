@@ -0,0 +1,135 @@
+import asyncio
+import heapq
+import itertools
+
+"""This file handles running commands as tracked tasks, instead of awaiting them inline in on_message.
+Every command runs in an execution class (decided by its cost class), and each execution class has a limit on how many of its commands can run at the same time.
+Commands that can't run yet wait in their class's queue, where higher priority commands (admin and moderation commands) go first."""
+
+# The execution class that the commands of each cost class (see throttle.cost_classes) run in
+execution_classes = {"light": "general", "normal": "general", "voice": "voice", "moderation": "moderation",
+                     "external_api": "external_api", "external_api_bulk": "external_api", "cpu_heavy": "cpu_heavy"}
+
+# The max number of commands of each execution class that can run at the same time
+concurrency_limits = {"general": 16, "voice": 8, "moderation": 8, "external_api": 6, "cpu_heavy": 2}
+
+# The max number of commands that can wait in the queue of each execution class, commands that don't fit are rejected
+max_queue_depth = 100
+
+# The priority lanes, lower values go first
+PRIORITY_ADMIN = 0
+PRIORITY_MODERATION = 1
+PRIORITY_VOICE = 2
+PRIORITY_DEFAULT = 3
+
+
+class _ExecutionClass:
+    """The state of an execution class, the tasks that are running and the heap of commands that are waiting."""
+
+    __slots__ = ("name", "limit", "running", "waiting", "metrics")
+
+    def __init__(self, name: str, limit: int):
+        self.name = name
+        self.limit = limit
+        self.running = set()
+
+        # The waiting commands, as (priority, sequence number, coroutine) tuples, the sequence number keeps the order within a priority lane
+        self.waiting = []
+
+        self.metrics = {"started": 0, "completed": 0, "failed": 0, "cancelled": 0, "rejected": 0, "max_queue_depth": 0}
+
+
+# The state of the execution classes, with the names as keys
+classes = {name: _ExecutionClass(name, limit) for name, limit in concurrency_limits.items()}
+
+# The sequence numbers for the waiting commands
+_sequence = itertools.count()
+
+# If we're shutting down, in which case we don't start anything new
+is_shutting_down = False
+
+
+def get_priority(cost_class: str, is_admin_command: bool) -> int:
+    """Returns the priority lane that a command should wait in."""
+    if is_admin_command:
+        return PRIORITY_ADMIN
+    elif cost_class == "moderation":
+        return PRIORITY_MODERATION
+    elif cost_class == "voice":
+        return PRIORITY_VOICE
+
+    return PRIORITY_DEFAULT
+
+
+def submit(coroutine, cost_class: str, priority: int) -> bool:
+    """Schedules the coroutine to run in the execution class of the cost class.
+    Returns False (and closes the coroutine) if it was rejected because the queue of the execution class is full or we're shutting down, True otherwise.
+    Admin commands are never rejected because of a full queue."""
+    execution_class = classes[execution_classes[cost_class]]
+
+    if is_shutting_down or (len(execution_class.waiting) >= max_queue_depth and priority != PRIORITY_ADMIN):
+        execution_class.metrics["rejected"] += 1
+        coroutine.close()
+        return False
+
+    # We run the command right away if the class has room for it, and queue it otherwise
+    if len(execution_class.running) < execution_class.limit:
+        _start(execution_class, coroutine)
+    else:
+        heapq.heappush(execution_class.waiting, (priority, next(_sequence), coroutine))
+        execution_class.metrics["max_queue_depth"] = max(execution_class.metrics["max_queue_depth"],
+                                                         len(execution_class.waiting))
+
+    return True
+
+
+def _start(execution_class: _ExecutionClass, coroutine):
+    """Starts the coroutine as a tracked task of the execution class."""
+    task = asyncio.ensure_future(coroutine)
+    execution_class.running.add(task)
+    execution_class.metrics["started"] += 1
+
+    task.add_done_callback(lambda done_task: _on_done(execution_class, done_task))
+
+
+def _on_done(execution_class: _ExecutionClass, task: asyncio.Task):
+    """Called when a task of the execution class is done, we record how it went and start the next waiting command (if any)."""
+    execution_class.running.discard(task)
+
+    if task.cancelled():
+        execution_class.metrics["cancelled"] += 1
+    elif task.exception() is not None:
+        execution_class.metrics["failed"] += 1
+    else:
+        execution_class.metrics["completed"] += 1
+
+    if execution_class.waiting and not is_shutting_down:
+        _start(execution_class, heapq.heappop(execution_class.waiting)[2])
+
+
+def get_metrics() -> dict:
+    """Returns the queue depth, the number of running commands and the counters of each execution class, with the class names as keys."""
+    return {name: dict(execution_class.metrics, queue_depth=len(execution_class.waiting),
+                       running=len(execution_class.running)) for name, execution_class in classes.items()}
+
+
+def cancel_all(loop: asyncio.AbstractEventLoop) -> list:
+    """Drops all the waiting commands and cancels all the running ones, this is called when we shut down.
+    Returns the tasks that were cancelled, so the caller can wait for them to finish cancelling."""
+    global is_shutting_down
+    is_shutting_down = True
+
+    cancelled_tasks = []
+    for execution_class in classes.values():
+        # The waiting commands were never started, so we just close them
+        for _, _, coroutine in execution_class.waiting:
+            coroutine.close()
+        execution_class.waiting.clear()
+
+        # We can't cancel tasks of a loop that has already been closed
+        if not loop.is_closed():
+            for task in list(execution_class.running):
+                task.cancel()
+                cancelled_tasks.append(task)
+
+    return cancelled_tasks
@@ -1,21 +1,19 @@
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
 
 @command_decorator.command("broadcast", "Broadcasts a message to all the channels that anna-bot has access to.",
-                           admin=True)
-async def cmd_admin_broadcast(message: discord.Message, client: discord.Client, config: dict):
+                           admin=True, cost_class="external_api_bulk")
+async def cmd_admin_broadcast(message: discord.Message, client: discord.Client, config: dict,
+                              context: command_context.CommandContext):
     """This method is used to handle admins wanting to broadcast a message to all servers and channel that anna-bot is in."""
 
     # We know that the issuing user is an admin
-    if not message.channel.is_private:
-        # The message to send in all the channels, we do this by just stripping off the first characters (the command part of the issuing message)
-        message_content = helpers.remove_anna_mention(client, message).strip()[16:]
-
-    else:
-        message_content = message.content
+    # The message to send in all the channels, this is everything after the command part of the issuing message
+    message_content = context.arguments
 
     # Logging that we're going to broadcast the message
     helpers.log_info(message.author.name + " issued a broadcast of the message \"" + message_content + "\"!")
@@ -1,14 +1,16 @@
 import discord
 import requests
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
 
 @command_decorator.command("change icon",
                            "Changes the anna-bot's profile icon to an image that the user attaches to the command message.",
-                           admin=True)
-async def cmd_admin_change_icon(message: discord.Message, client: discord.Client, config: dict):
+                           admin=True, cost_class="external_api")
+async def cmd_admin_change_icon(message: discord.Message, client: discord.Client, config: dict,
+                                context: command_context.CommandContext):
     """This admin command is used to change the icon of the bot user to a specified image."""
 
     # Checking if the message has an attachment
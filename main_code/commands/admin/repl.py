@@ -31,6 +31,7 @@ from contextlib import redirect_stdout
 
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
@@ -60,7 +61,8 @@ def get_syntax_error(e):
     \t__server__ -> The server in which the eval was issued. \n\
     \t__message__ -> The message which issued the eval. \n\
     \t__last_result__ -> The result of the last eval, if no eval has been done yet, this is None.", admin=True)
-async def cmd_admin_eval(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_admin_eval(message: discord.Message, client: discord.Client, config: dict,
+                         context: command_context.CommandContext):
     global last_result
 
     # The variables we give access to
@@ -76,17 +78,14 @@ async def cmd_admin_eval(message: discord.Message, client: discord.Client, confi
     # We insert the globals into the environment
     env.update(globals())
 
-    no_mention_content = helpers.remove_anna_mention(client,
-                                                     message) if not message.channel.is_private else message.content
-
     # We make sure that there's code in the message
-    if len(no_mention_content) < len("admin eval "):
+    if not context.arguments:
         # We didn't get any code
         await client.send_message(message.channel, message.author.mention + ", you did not give any code to run.")
         return
     else:
         # We have atleast some maybe-valid input
-        uncleaned_code = no_mention_content[11:]
+        uncleaned_code = context.arguments
         await client.send_message(message.channel, message.author.mention + ", ok, running now...")
         helpers.log_info(
             "Running code from eval command issued by {0} ({1}).".format(message.author.name, message.author.id))
@@ -6,13 +6,15 @@ import aiohttp
 import async_timeout
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
 
 @command_decorator.command("cat",
-                           "Sends a cute cat. Powered by https://random.cat .")
-async def cat_cmd(message: discord.Message, client: discord.Client, config: dict):
+                           "Sends a cute cat. Powered by https://random.cat .", cost_class="external_api")
+async def cat_cmd(message: discord.Message, client: discord.Client, config: dict,
+                  context: command_context.CommandContext):
     """Pulls a url from the random.cat api at random.cat/meow, decodes it and then sends that picture in an embed."""
 
     try:
@@ -33,8 +35,9 @@ async def cat_cmd(message: discord.Message, client: discord.Client, config: dict
     await send_animal_embed(client, message.channel, cat_url, "Here's a cute cat!", "Cat")
 
 
-@command_decorator.command("kitten", "Sends a cute kitten.")
-async def kitten_cmd(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("kitten", "Sends a cute kitten.", cost_class="external_api_bulk")
+async def kitten_cmd(message: discord.Message, client: discord.Client, config: dict,
+                     context: command_context.CommandContext):
     """Uses the mashape api here: https://market.mashape.com/nijikokun/kitten-placeholder to get a picture of a kitten"""
 
     # A function to get a kitten img url
@@ -96,8 +99,9 @@ async def kitten_cmd(message: discord.Message, client: discord.Client, config: d
 
 
 @command_decorator.command("dog",
-                           "Sends a cute dog. Powered by https://random.dog .")
-async def dog_cmd(message: discord.Message, client: discord.Client, config: dict):
+                           "Sends a cute dog. Powered by https://random.dog .", cost_class="external_api")
+async def dog_cmd(message: discord.Message, client: discord.Client, config: dict,
+                  context: command_context.CommandContext):
     """Pulls a url from the random.dog api at random.dog/woof.json, decodes it and then sends that picture in an embed."""
 
     helpers.log_info("Fetching dog url.")
@@ -10,6 +10,7 @@ import chess as chess
 import chess.uci as uci
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
@@ -218,9 +219,10 @@ def check_chess_enabled(func):
                            "Starts a chess game, you can specify a difficulty if you want to. Valid difficulties are 0-20, "
                            "where 20 is grandmaster level and 0 is not very good. "
                            "Only integers are allowed (`19.5` doesn't work, but `19` works), default difficulty is 10. "
-                           "Engine is stockfish. Moves are made with the `move` command.")
+                           "Engine is stockfish. Moves are made with the `move` command.", cost_class="cpu_heavy")
 @check_chess_enabled
-async def start_chess_cmd(message: discord.Message, client: discord.Client, config: dict):
+async def start_chess_cmd(message: discord.Message, client: discord.Client, config: dict,
+                          context: command_context.CommandContext):
     """Creates new chess session if none exists. User plays white."""
 
     # We check if the user already has a session
@@ -231,9 +233,7 @@ async def start_chess_cmd(message: discord.Message, client: discord.Client, conf
         return
 
     # We check if the user specified a difficulty
-    cleaned_content = helpers.remove_anna_mention(client, message)[
-                      len("chess "):] if not message.channel.is_private else message.content[len("chess "):]
-    cleaned_content = cleaned_content[:2]
+    cleaned_content = context.arguments[:2]
 
     # We get the value to use as difficulty
     try:
@@ -261,9 +261,11 @@ async def start_chess_cmd(message: discord.Message, client: discord.Client, conf
 
 
 @command_decorator.command("stop chess",
-                           "Stops the chess game you're playing, obviously doesn't work if you aren't playing a chess game.")
+                           "Stops the chess game you're playing, obviously doesn't work if you aren't playing a chess game.",
+                           cost_class="light")
 @check_chess_enabled
-async def stop_chess_cmd(message: discord.Message, client: discord.Client, config: dict):
+async def stop_chess_cmd(message: discord.Message, client: discord.Client, config: dict,
+                         context: command_context.CommandContext):
     """Stops chess session if one exists."""
 
     # We check if the user already has a session
@@ -287,9 +289,10 @@ async def stop_chess_cmd(message: discord.Message, client: discord.Client, confi
                            "Moves one of your chess pieces as specified. The move format is \"coordinate notation\", "
                            "check wikipedia for a description. https://en.wikipedia.org/wiki/Chess_notation#Notation_systems_for_humans ."
                            "Moves are not strictly coordinate notation, only alphanumeric characters "
-                           "will be taken into consideration (alphabet + digits)")
+                           "will be taken into consideration (alphabet + digits)", cost_class="cpu_heavy")
 @check_chess_enabled
-async def chess_move_cmd(message: discord.Message, client: discord.Client, config: dict):
+async def chess_move_cmd(message: discord.Message, client: discord.Client, config: dict,
+                         context: command_context.CommandContext):
     """Moves a chess piece for a user."""
 
     # We check if the user is in a chess session
@@ -298,11 +301,8 @@ async def chess_move_cmd(message: discord.Message, client: discord.Client, confi
                                   "You're not in a chess game, you need to use the `chess` command to start a chess game.")
         return
 
-    # We parse the message content (the raw move string)
-    if message.channel.is_private:
-        raw_move_str = message.content.strip()[len("move "):]
-    else:
-        raw_move_str = helpers.remove_anna_mention(client, message).strip()[len("move "):]
+    # The raw move string
+    raw_move_str = context.arguments
 
     # We try to apply the move
     async with chess_sessions[message.author.id] as chess_session:
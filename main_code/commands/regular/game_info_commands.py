@@ -5,20 +5,18 @@ import discord
 from overwatch_api import constants as ow_con
 from overwatch_api import exceptions as ow_exc
 from overwatch_api.core import AsyncOWAPI
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
 
-@command_decorator.command("overwatch", "Displays info about an overwatch battletag.")
-async def game_searchall_player(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("overwatch", "Displays info about an overwatch battletag.", cost_class="external_api")
+async def game_searchall_player(message: discord.Message, client: discord.Client, config: dict,
+                                context: command_context.CommandContext):
     """We fetch and display info about one or multiple overwatch accounts."""
 
-    # We parse the battletag to search for from the issuing message
-    # We parse the name that we should search for
-    if message.channel.is_private:
-        search_name = message.content.strip()[len("overwatch "):].strip()
-    else:
-        search_name = helpers.remove_anna_mention(client, message.content.strip())[len("overwatch "):].strip()
+    # The battletag to search for
+    search_name = context.arguments
 
     # We check if the name is more than 4 chars or more
     if not 100 > len(search_name) > 3:
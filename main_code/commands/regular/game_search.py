@@ -6,6 +6,7 @@ import discord
 from overwatch_api import constants as ow_con
 from overwatch_api import exceptions as ow_exc
 from overwatch_api.core import AsyncOWAPI
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
@@ -13,18 +14,17 @@ from ... import helpers
 
 
 @command_decorator.command("game search",
-                           "Searches different games for the name given and returns matching accounts. Currently supports Overwatch.")
-async def game_searchall_player(message: discord.Message, client: discord.Client, config: dict):
+                           "Searches different games for the name given and returns matching accounts. Currently supports Overwatch.",
+                           cost_class="external_api")
+async def game_searchall_player(message: discord.Message, client: discord.Client, config: dict,
+                                context: command_context.CommandContext):
     """Searches all supported games for a player."""
 
     # The searchers for playernames of different games / platforms
     player_searchers = {"Overwatch": overwatch_player_search}
 
-    # We parse the name that we should search for
-    if message.channel.is_private:
-        search_name = message.content.strip()[len("game search "):].strip()
-    else:
-        search_name = helpers.remove_anna_mention(client, message.content.strip())[len("game search "):].strip()
+    # The name that we should search for
+    search_name = context.arguments
 
     # We check if the name is more than 4 chars or more
     if not 100 > len(search_name) > 3:
@@ -1,11 +1,14 @@
 import discord
 
+from ... import command_context
 from ... import command_decorator
 
 
 @command_decorator.command("add-bot",
-                           "Generate an invite link so you can add the bot to your own server, (with proper permissions of course).")
-async def gen_bot_invite(message: discord.Message, client: discord.Client, config: dict):
+                           "Generate an invite link so you can add the bot to your own server, (with proper permissions of course).",
+                           cost_class="light")
+async def gen_bot_invite(message: discord.Message, client: discord.Client, config: dict,
+                         context: command_context.CommandContext):
     """This method is called to handle someone wanting to invite anna-bot to their own server"""
 
     # We check if this command is enabled
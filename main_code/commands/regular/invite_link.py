@@ -1,7 +1,10 @@
 import discord
 
+from ... import command_context
 
-async def invite_link(message: discord.Message, client: discord.Client, config: dict):
+
+async def invite_link(message: discord.Message, client: discord.Client, config: dict,
+                      context: command_context.CommandContext):
     """This method is called to handle someone typing the message '!invite'.
     Note that this doesn't use the regular command decorator, because it uses config-based formatting in the helptext."""
 
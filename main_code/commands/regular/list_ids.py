@@ -1,11 +1,14 @@
 import discord
 
+from ... import command_context
 from ... import command_decorator
 
 
 @command_decorator.command("list ids",
-                           "PMs you with a list of all the ids of all the things on the server. This includes roles, users, channels, and the server itself.")
-async def list_ids(message: discord.Message, client: discord.Client, config: dict):
+                           "PMs you with a list of all the ids of all the things on the server. This includes roles, users, channels, and the server itself.",
+                           cost_class="light")
+async def list_ids(message: discord.Message, client: discord.Client, config: dict,
+                   context: command_context.CommandContext):
     """This command is used to get a list of all the ids of all things in the server."""
 
     # We check if the command was issued in a PM
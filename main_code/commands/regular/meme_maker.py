@@ -7,6 +7,7 @@ import aiohttp
 import async_timeout
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
@@ -67,8 +68,9 @@ async def send_meme_in_channel(meme: str, top_text: str, bottom_text: str, msg_t
                                       "" if passed_channel.is_private else recipient.mention + ", ", meme, msg_text))
 
 
-@command_decorator.command("meme list", "Gives you a list of all the memes you can use.")
-async def cmd_meme_list(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("meme list", "Gives you a list of all the memes you can use.", cost_class="external_api")
+async def cmd_meme_list(message: discord.Message, client: discord.Client, config: dict,
+                        context: command_context.CommandContext):
     """Uses the mashape api here: https://market.mashape.com/ronreiter/meme-generator
     To return the list of available images to use for meme generating."""
 
@@ -94,8 +96,9 @@ async def cmd_meme_list(message: discord.Message, client: discord.Client, config
                                "" if message.channel.is_private else message.author.mention + ", "))
 
 
-@command_decorator.command("meme search", "Shows the closest memes to a search request.")
-async def cmd_meme_list(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("meme search", "Shows the closest memes to a search request.", cost_class="cpu_heavy")
+async def cmd_meme_list(message: discord.Message, client: discord.Client, config: dict,
+                        context: command_context.CommandContext):
     """Uses the mashape api here: https://market.mashape.com/ronreiter/meme-generator
     To return the list of most closely matching memes"""
 
@@ -113,10 +116,7 @@ async def cmd_meme_list(message: discord.Message, client: discord.Client, config
         return
 
     # We parse the input
-    if not message.channel.is_private:
-        cleaned_raw_content = helpers.remove_anna_mention(client, message)[len("meme search "):].lower()
-    else:
-        cleaned_raw_content = message.content[len("meme search "):].lower()
+    cleaned_raw_content = context.arguments.lower()
 
     # The input has to be atleast 1 char
     if not (100 > len(cleaned_raw_content) > 1):
@@ -148,16 +148,15 @@ async def cmd_meme_list(message: discord.Message, client: discord.Client, config
 @command_decorator.command("meme make", "Creates a meme with the specified meme and bottom and top text. "
                                         "Use `meme make \"MEME_NAME\" \"TOP_TEXT\" \"BOTTOM_TEXT\"` "
                                         "to specify what image and texts you want. "
-                                        "An example is `meme make \"Condescending Wonka\" \"AYLMAO\" \"M8\"`")
-async def cmd_make_meme(message: discord.Message, client: discord.Client, config: dict):
+                                        "An example is `meme make \"Condescending Wonka\" \"AYLMAO\" \"M8\"`",
+                                        cost_class="external_api")
+async def cmd_make_meme(message: discord.Message, client: discord.Client, config: dict,
+                        context: command_context.CommandContext):
     """Creates a meme with he specified image, bottom and top text.
     Memes are not case sensitive, as we do a levenshtein minimisation."""
 
     # We parse the input
-    if not message.channel.is_private:
-        cleaned_raw_content = helpers.remove_anna_mention(client, message)[len("meme make"):]
-    else:
-        cleaned_raw_content = message.content[len("meme make"):]
+    cleaned_raw_content = context.arguments
 
     # The content HAS TO BE in the format
     # "IMAGE" WHITESPACE "TOP" WHITESPACE "BOTTOM"
@@ -238,8 +237,10 @@ async def cmd_make_meme(message: discord.Message, client: discord.Client, config
 
 
 @command_decorator.command("meme upload", "Uploads a new image to make available for the meme commands. "
-                                          "Only image formats are supported. Filesize is limited to 6MB.")
-async def cmd_upload_meme(message: discord.Message, client: discord.Client, config: dict):
+                                          "Only image formats are supported. Filesize is limited to 6MB.",
+                                          cost_class="external_api")
+async def cmd_upload_meme(message: discord.Message, client: discord.Client, config: dict,
+                          context: command_context.CommandContext):
     """Uses the mashape api here: https://market.mashape.com/ronreiter/meme-generator
     Uploads a meme to the meme api. Only image formats are supported. We also limit to 6MB."""
 
@@ -1,6 +1,5 @@
 import asyncio
 import json
-import os
 import sys
 import traceback
 from collections import namedtuple
@@ -9,8 +8,10 @@ import aiohttp
 import async_timeout
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
+from ... import state_store
 
 # A pokemon object, values will be "N/A" if no data was available
 PoGoPokemon = namedtuple("PoGoPokemon", ("lat", "lng", "pkdex_id", "iv", "name", "cp", "lvl", "tl"))
@@ -26,29 +27,20 @@ poke_config = {}
 
 
 def store_persistent_poke_config():
-    """Uses the json module to store the data in poke_config to disk,
-    so we can recover voice state upon reboot of the bot."""
+    """Stores the data in poke_config (and the last pokemons) in the state store,
+    so we can recover the pokemon state upon reboot of the bot. The write is done by the state store's worker thread, so we don't wait for it."""
     global poke_config
 
-    # We open and close the state file, and we use some tricks to get the filepath since it is above this file
-    try:
-        with open(os.path.join(os.path.dirname(__file__), "..", "..", "..", "persistent_state", "pokemon_state.json"),
-                  mode="w") as poke_state_file:
-
-            # The data we're going to store
-            saved_data = {"pokemons": list(last_pokemons), "poke_config": poke_config}
+    # The data we're going to store, it's serialized here so the worker thread never sees the dicts while they're being changed
+    saved_data = json.loads(json.dumps({"pokemons": list(last_pokemons), "poke_config": poke_config}))
 
-            # We dump the persistent data to disk via json
-            json.dump(saved_data, poke_state_file)
-
-    except BaseException as e:
-        print(traceback.format_exception(*sys.exc_info()))
+    state_store.submit(state_store.save_pokemon_state, saved_data)
 
 
 def use_persistent_poke_dict(func):
     """This is meant to be used as a decorator to all functions
     that modify the last_pokemons or poke_config variables.
-    It saves the state into a json file (/persistent_state/pokemon_state.json from the top of the bot)"""
+    It saves the state into the state store"""
 
     def decorated_func(*args, **kwargs):
         # We execute the function
@@ -66,7 +58,7 @@ def use_persistent_poke_dict(func):
 def async_use_persistent_poke_dict(func):
     """This is meant to be used as a decorator to all functions
     that modify the last_pokemons or poke_config variables. This is for async functions.
-    It saves the state of the dict into a json file (/persistent_state/pokemon_state.json from the top of the bot)"""
+    It saves the state of the dict into the state store"""
 
     async def decorated_func(*args, **kwargs):
         # We execute the function
@@ -350,7 +342,8 @@ async def handle_notifications():
                                        "Use `-miniv AMOUNT` or `-maxiv AMOUNT` to only get notifications about pokemon with a minimum or maximum (respectively) IV of `AMOUNT`. \n"
                                        "Use `-mincp AMOUNT` or `-maxcp AMOUNT` to only get notifications about pokemon with a minimum or maximum (respectively) CP of `AMOUNT`.")
 @async_use_persistent_poke_dict
-async def subscribe_pogo_notification_channel(message: discord.Message, client: discord.Client, config: dict):
+async def subscribe_pogo_notification_channel(message: discord.Message, client: discord.Client, config: dict,
+                                              context: command_context.CommandContext):
     """Adds a server to the channels that have subscribed to pokemon go notifications."""
 
     # This command needs to be used in a regular channel
@@ -359,7 +352,7 @@ async def subscribe_pogo_notification_channel(message: discord.Message, client:
         return
 
     # The raw parameter text, split with spaces and all empty strings removed. All strings are also transformed to lowercase
-    split_query = helpers.remove_anna_mention(client, message)[len(" pogo sub"):].split(" ")
+    split_query = context.arguments.split(" ")
     split_query = [part.lower() for part in split_query if part != ""]
 
     # We make sure each type of flag is not used more than once
@@ -489,7 +482,8 @@ async def subscribe_pogo_notification_channel(message: discord.Message, client:
 
 @command_decorator.command("pogo unsub", "Unsubscribes the channel from pokemon go notifications.")
 @async_use_persistent_poke_dict
-async def unsubscribe_pogo_notification_channel(message: discord.Message, client: discord.Client, config: dict):
+async def unsubscribe_pogo_notification_channel(message: discord.Message, client: discord.Client, config: dict,
+                                                context: command_context.CommandContext):
     """Removes a server from the channels that have subscribed to pokemon go notifications."""
 
     # This command needs to be used in a regular channel
@@ -0,0 +1,79 @@
+import discord
+
+from ... import command_context
+from ... import command_decorator
+from ... import helpers
+from ... import referral_store
+
+# The number of users in a page of the referral leaderboard
+leaderboard_page_size = 10
+
+
+@command_decorator.command("referrals top", "Shows the users with the most referrals on the server, add a page number to see more of them.",
+                           cost_class="light")
+async def cmd_referrals_top(message: discord.Message, client: discord.Client, config: dict,
+                            context: command_context.CommandContext):
+    """This function is used to show a page of the referral leaderboard of the server."""
+
+    # The leaderboard only exists on servers
+    if message.channel.is_private:
+        await client.send_message(message.channel, "You can only see the referral leaderboard on a server.")
+        return
+
+    # We get the page number the user asked for, the pages start at 1 for users
+    page_number = context.arguments
+    if page_number == "":
+        page_number = "1"
+
+    if not page_number.isdigit() or int(page_number) < 1:
+        await client.send_message(message.channel, message.author.mention + ", the page number has to be a positive number.")
+        return
+
+    # We get the page from the ranking, which is always kept sorted so this is just a slice
+    page, total = referral_store.get_page(message.server.id, int(page_number) - 1, leaderboard_page_size)
+
+    if not page:
+        await client.send_message(message.channel, message.author.mention + (
+            ", nobody has referred anyone on this server yet." if total == 0 else ", there are only {0} page(s) of referrals.".format(
+                (total + leaderboard_page_size - 1) // leaderboard_page_size)))
+        return
+
+    # We list the users with their place and number of referrals, users who have left the server are shown by their id
+    lines = []
+    for index, (user_id, count) in enumerate(page):
+        member = message.server.get_member(user_id)
+        lines.append("**{0}.** {1} with **{2}** referral(s)".format(
+            (int(page_number) - 1) * leaderboard_page_size + index + 1,
+            helpers.remove_discord_formatting(member.name)[0] if member is not None else "(user {0})".format(user_id), count))
+
+    await client.send_message(message.channel, "Referral leaderboard of **{0}** (page {1} of {2}):\n{3}".format(
+        message.server.name, page_number, (total + leaderboard_page_size - 1) // leaderboard_page_size, "\n".join(lines)))
+
+
+@command_decorator.command("referrals user", "Shows how many referrals a user (@mention) has on the server, or how many you have.",
+                           cost_class="light")
+async def cmd_referrals_user(message: discord.Message, client: discord.Client, config: dict,
+                             context: command_context.CommandContext):
+    """This function is used to show the number of referrals and the leaderboard place of a user on the server."""
+
+    # The referrals are per server
+    if message.channel.is_private:
+        await client.send_message(message.channel, "You can only see referrals on a server.")
+        return
+
+    # We look up the mentioned user, or the user who used the command if nobody was mentioned
+    target_user = message.author if context.arguments == "" else discord.utils.get(message.server.members,
+                                                                                   mention=context.arguments)
+    if target_user is None:
+        await client.send_message(message.channel,
+                                  message.author.mention + ", you did not specify a valid user. Make sure to use @mentions.")
+        return
+
+    count, place = referral_store.get_user(message.server.id, target_user.id)
+
+    if place is None:
+        await client.send_message(message.channel, message.author.mention + ", **{0}** hasn't referred anyone to this server yet.".format(
+            helpers.remove_discord_formatting(target_user.name)[0]))
+    else:
+        await client.send_message(message.channel, message.author.mention + ", **{0}** has **{1}** referral(s), which is place **{2}** on this server.".format(
+            helpers.remove_discord_formatting(target_user.name)[0], count, place))
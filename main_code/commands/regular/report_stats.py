@@ -1,30 +1,66 @@
-import json
-import os.path
-import time
-from os import sep as dir_sep
-
 import discord
 
+from ... import command_context
+from ... import command_scheduler
 from ... import command_decorator
 from ... import helpers
+from ... import join_pipeline
+from ... import presence_coalescer
+from ... import stats
+from ... import voice_queue
+from ... import ytdl_extractor
 
 
-@command_decorator.command("anna-stats", "Report some stats about anna.")
-async def cmd_report_stats(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("anna-stats", "Report some stats about anna.", cost_class="light")
+async def cmd_report_stats(message: discord.Message, client: discord.Client, config: dict,
+                           context: command_context.CommandContext):
     """This method is used to handle reporting stats about the bot to the user who used the anna stats command."""
 
     # Creating the formatted string about how long the bot has been up for this "session"
-    uptime_string = helpers.get_formatted_duration_fromtime(
-        (time.time() - config["stats"]["volatile"]["start_time"]) // 1)
-
-    # Loading the config file so we can use the stats that exists in it
-    with open(os.path.dirname(__file__) + dir_sep + str(".." + dir_sep) * 3 + "config.json", mode="r",
-              encoding="utf-8") as config_file:
-        current_config = json.load(config_file)
+    uptime_string = helpers.get_formatted_duration_fromtime(stats.get_uptime_seconds())
 
-    # Reporting the stats back into the chat where the command was issued
+    # Reporting the stats back into the chat where the command was issued, the counters are kept in memory so we don't need to read the config file
     await client.send_message(message.channel,
                               "Some stats about **anna-bot**:\n\tIt has been up for **{0}**. \n\tIt has sent **{1}** message(s). \n\tIt has received **{2}** command(s).".format(
-                                  uptime_string, current_config["stats"]["messages_sent"],
-                                  current_config["stats"]["commands_received"])
+                                  uptime_string, stats.counters.get("messages_sent", 0),
+                                  stats.counters.get("commands_received", 0))
                               )
+
+    # Admins also get the metrics of the ignored message registry
+    if context.is_admin:
+        await client.send_message(message.channel,
+                                  "Ignored message registry:\n\tIt holds **{0}** id(s). \n\t**{added}** id(s) have been added, **{hits}** were hit, **{expired}** expired and **{evicted}** were evicted.".format(
+                                      len(context.ignored_message_ids), **context.ignored_message_ids.metrics))
+
+        # And the queue depths of the command scheduler
+        await client.send_message(message.channel, "Command scheduler:\n" + "\n".join(
+            "\t**{0}**: **{running}** running, **{queue_depth}** waiting (max **{max_queue_depth}**), **{completed}** completed, **{failed}** failed, **{rejected}** rejected.".format(
+                name, **class_metrics) for name, class_metrics in sorted(command_scheduler.get_metrics().items())))
+
+        # And how many presence transitions were coalesced
+        await client.send_message(message.channel,
+                                  "Presence coalescer:\n\t**{received}** transition(s) received, **{applied}** applied for **{users}** user(s) in **{batches}** batch(es).".format(
+                                      **presence_coalescer.metrics))
+
+        # And the timings of the join hooks
+        await client.send_message(message.channel, "Join hooks:\n" + "\n".join(
+            "\t**{0}**: **{calls}** call(s), **{failures}** failure(s), **{1:.2f}** s on average, **{max_seconds:.2f}** s at most.".format(
+                name, hook_metrics["total_seconds"] / hook_metrics["calls"], **hook_metrics)
+            for name, hook_metrics in sorted(join_pipeline.hook_metrics.items())))
+
+        # And how many queue entries got a player
+        await client.send_message(message.channel,
+                                  "Voice queue:\n\t**{created}** entries created, **{instantiated}** player(s) created, **{prefetched}** prefetched and **{discarded}** discarded.".format(
+                                      **voice_queue.metrics))
+
+        # And how well the youtube_dl info cache works
+        await client.send_message(message.channel,
+                                  "youtube_dl extractor:\n\t**{0}** url(s) cached, **{hits}** hit(s), **{misses}** miss(es), **{extractions}** extraction(s) (**{failures}** failed), **{rejected}** rejected and **{evicted}** evicted.".format(
+                                      len(ytdl_extractor.cache), **ytdl_extractor.metrics))
+
+        # And the gaps between the tracks on this server
+        gap_metrics = voice_queue.gap_metrics.get(message.server.id) if message.server else None
+        if gap_metrics is not None:
+            await client.send_message(message.channel,
+                                      "Voice gaps on this server:\n\t**{transitions}** track transition(s), **{0:.2f}** s on average, **{max_seconds:.2f}** s at most, **{last_seconds:.2f}** s last time.".format(
+                                          gap_metrics["total_seconds"] / gap_metrics["transitions"], **gap_metrics))
@@ -2,8 +2,11 @@ import subprocess
 
 import discord
 
+from ... import command_context
 
-async def start_server(message: discord.Message, client: discord.Client, config: dict):
+
+async def start_server(message: discord.Message, client: discord.Client, config: dict,
+                       context: command_context.CommandContext):
     """This method is called to handle when someone wants to launch the server (a bat file).
     Note that this doesn't use the command decorator, because the command trigger is config based."""
     if message.content.lower().startswith(
@@ -2,6 +2,7 @@ import asyncio
 
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
@@ -9,8 +10,10 @@ from ... import helpers
 vanity_commands = -1
 
 
-@command_decorator.command("role list", "PMs you with a list of all available vanity roles for this server.")
-async def list_vanity_roles(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("role list", "PMs you with a list of all available vanity roles for this server.",
+                           cost_class="light")
+async def list_vanity_roles(message: discord.Message, client: discord.Client, config: dict,
+                            context: command_context.CommandContext):
     """This method is used to list all available vanity roles on a server."""
 
     # We check if we should fill the vanity commands dict
@@ -60,7 +63,8 @@ async def list_vanity_roles(message: discord.Message, client: discord.Client, co
 
 @command_decorator.command("role change",
                            "Use this to change to another vanity role (**role list** to list all available roles).")
-async def change_vanity_role(message: discord.Message, client: discord.Client, config: dict):
+async def change_vanity_role(message: discord.Message, client: discord.Client, config: dict,
+                             context: command_context.CommandContext):
     """This function is used to change or add a user to a vanity role of their choosing."""
 
     # We check if we should fill the vanity commands dict
@@ -80,8 +84,8 @@ async def change_vanity_role(message: discord.Message, client: discord.Client, c
 
         return
 
-    # We remove the anna-bot mention and parse the role that the user wants to change to
-    clean_message_content = helpers.remove_anna_mention(client, message)[len("role change "):].lower().strip()
+    # The role that the user wants to change to
+    clean_message_content = context.arguments.lower()
 
     # We check if the role exists in the vanity command dictionary, if it doesn't we tell the user and return
     if not clean_message_content in vanity_commands[message.server.id]:
@@ -143,7 +147,8 @@ async def change_vanity_role(message: discord.Message, client: discord.Client, c
 
 
 @command_decorator.command("role remove", "Use this to remove all your vanity roles.")
-async def remove_vanity_roles(message: discord.Message, client: discord.Client, config: dict):
+async def remove_vanity_roles(message: discord.Message, client: discord.Client, config: dict,
+                              context: command_context.CommandContext):
     """This function is used to remove all vanity roles for a server from a user."""
 
     # We check if we should fill the vanity commands dict
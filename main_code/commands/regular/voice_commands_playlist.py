@@ -4,6 +4,8 @@ import json
 import os.path
 import re
 import sys
+import threading
+import time
 import traceback
 
 import discord
@@ -11,38 +13,107 @@ import requests
 import youtube_dl
 from websockets.exceptions import ConnectionClosed
 
+from ... import command_context
 from ... import command_decorator
+from ... import config_index
 from ... import helpers
+from ... import state_store
+from ... import voice_queue
+from ... import ytdl_extractor
 
 """This file handles the voice command interactions, state, and commands."""
 
-# The dict which describes the audio playing in a server, of form {"server id" : {"playlist_info" : {"is_playing" : Bool, "playlist_name" : str, "current_index" : int}, "channel_id": str, "queue" : [streamplayer, ...]}, ...}
-# The current player for the playlist (if enabled) will be queue[0]
+# The dict which describes the audio playing in a server, of form {"server id" : {"playlist_info" : {"is_playing" : Bool, "playlist_name" : str, "current_index" : int}, "channel_id": str, "queue" : [voice_queue.QueueEntry, ...]}, ...}
+# The current entry for the playlist (if enabled) will be queue[0], only the entry at the front of the queue (and the one after it, shortly before the first one ends) has a player
 server_queue_info_dict = {}
 
 
-def store_persistent_voice_state():
-    """Uses the json module to store the data in server_queue_info_dict to disk,
-    so we can recover voice state upon reboot of the bot."""
-    global server_queue_info_dict
+# The voice state of the servers as it is in the state store (serialized as json), with server ids as keys, so we know which rows changed and which to remove
+stored_voice_states = {}
 
-    # We open and close the state file, and we use some tricks to get the filepath since it is above this file
+# The playlist entries that were prefetched before the current entry of the playlist ended,
+# in the format of {server id: (playlist name, current index when it was prefetched, line index of the entry, voice_queue.QueueEntry)}
+prefetched_playlist_entries = {}
+
+# The ids of the servers whose voice state may have changed since the last flush, None in here means that any server may have changed
+dirty_voice_server_ids = set()
+
+# The lock for dirty_voice_server_ids and voice_state_flush_scheduled, since the audio player threads mark servers as dirty too
+voice_state_lock = threading.Lock()
+
+# If a flush of the voice state is scheduled on the event loop
+voice_state_flush_scheduled = False
+
+# The voice state is flushed at most once every this many seconds, so a burst of track changes is written as one snapshot
+voice_state_flush_interval = 2.
+
+
+def _get_voice_state(info: dict) -> dict:
+    """Returns the persistent data (everything except the players in the queue) of a server's voice info."""
+    # Note that we don't copy the queue and then empty it. This is because lists are mutable, and doing that would empty the list in server_queue_info_dict aswell
+    saved_data = {k: v for k, v in info.items() if k != "queue"}
+    saved_data["queue"] = []
+    saved_data["volume"] = [player.volume for player in info["queue"]]
+    saved_data["paused"] = [not player.is_playing() for player in info["queue"]]
+    return saved_data
+
+
+def store_persistent_voice_state(server_id: str = None):
+    """Marks the voice state of the server as changed (or any server's, if server_id is None), and schedules a flush to the state store.
+    This can be called from any thread, it never waits for the disk, the flush runs on the event loop and the write is done by the state store's worker thread."""
+    global voice_state_flush_scheduled
+
+    with voice_state_lock:
+        dirty_voice_server_ids.add(server_id)
+
+        if voice_state_flush_scheduled:
+            # The scheduled flush will pick this server up
+            return
+        voice_state_flush_scheduled = True
+
+    loop = helpers.actual_client.loop
     try:
-        with open(os.path.join(os.path.dirname(__file__), "..", "..", "..", "persistent_state", "voice_state.json"),
-                  mode="w") as voice_state_file:
-
-            # We store the data that is persistent (everything except the queue)
-            saved_data = {}
-            for key, val in server_queue_info_dict.items():
-                saved_data[key] = {k: v for k, v in val.items() if k is not "queue"}
-                # Note that we don't copy the queue and then empty it. This is because lists are mutable, and doing that would empty the list in server_queue_info_dict aswell
-                saved_data[key]["queue"] = []
-                saved_data[key]["volume"] = [player.volume for player in val["queue"]]
-                saved_data[key]["paused"] = [not player.is_playing() for player in val["queue"]]
-
-            # We dump the persistent data to disk via json
-            json.dump(saved_data, voice_state_file)
-            helpers.log_info("Stored voice state to disk.")
+        loop.call_soon_threadsafe(loop.call_later, voice_state_flush_interval, flush_voice_state)
+    except RuntimeError:
+        # The loop has been closed, so we're shutting down, and the flush at exit writes the state
+        pass
+
+
+def flush_voice_state():
+    """Writes the voice state of the servers that were marked as changed to the state store, only the servers whose state actually changed are written.
+    This is called on the event loop (and once more at exit), so the dicts aren't changed by commands while we read them."""
+    global voice_state_flush_scheduled
+
+    with voice_state_lock:
+        server_ids = set(dirty_voice_server_ids)
+        dirty_voice_server_ids.clear()
+        voice_state_flush_scheduled = False
+
+    # If any server may have changed, we check all the servers we have state for, and all the ones that are in the state store
+    if None in server_ids:
+        server_ids = set(server_queue_info_dict).union(stored_voice_states)
+
+    try:
+        changed = {}
+        removed = []
+        for server_id in server_ids:
+            info = server_queue_info_dict.get(server_id)
+
+            if info is None:
+                # We remove the rows of the servers that don't have any voice state anymore
+                if stored_voice_states.pop(server_id, None) is not None:
+                    removed.append(server_id)
+                continue
+
+            # We serialize the data here, so the worker thread never sees the dicts while they're being changed
+            serialized_state = json.dumps(_get_voice_state(info), sort_keys=True)
+            if stored_voice_states.get(server_id) != serialized_state:
+                stored_voice_states[server_id] = serialized_state
+                changed[server_id] = json.loads(serialized_state)
+
+        if changed or removed:
+            state_store.submit(state_store.save_voice_state, changed, removed)
+            helpers.log_info("Stored voice state of {0} servers to disk.".format(len(changed) + len(removed)))
 
     except BaseException as e:
         print(traceback.format_exception(*sys.exc_info()))
@@ -51,13 +122,13 @@ def store_persistent_voice_state():
 def use_persistent_info_dict(func):
     """This is meant to be used as a decorator to all functions 
     that modify the server_queue_info_dict. 
-    It saves the state of the dict into a json file (/persistent_state/voice_state.json from the top of the bot)"""
+    It marks the state of the dict as changed, so it is saved into the state store"""
 
     def decorated_func(*args, **kwargs):
         # We execute the function
         result = func(*args, **kwargs)
 
-        # We store the persistent state from the info dict to disk
+        # We mark the voice state as changed, it is stored to disk by the next flush
         store_persistent_voice_state()
 
         return result
@@ -69,14 +140,15 @@ def use_persistent_info_dict(func):
 def async_use_persistent_info_dict(func):
     """This is meant to be used as a decorator to all functions 
     that modify the server_queue_info_dict. This is for async functions.
-    It saves the state of the dict into a json file (/persistent_state/voice_state.json from the top of the bot)"""
+    It marks the state of the dict as changed, so it is saved into the state store"""
 
     async def decorated_func(*args, **kwargs):
         # We execute the function
         result = await func(*args, **kwargs)
 
-        # We store the persistent state from the info dict to disk
-        store_persistent_voice_state()
+        # We mark the voice state of the server the command was used on as changed, it is stored to disk by the next flush
+        message = args[0] if args else kwargs.get("message")
+        store_persistent_voice_state(message.server.id if isinstance(message, discord.Message) and message.server else None)
 
         return result
 
@@ -98,10 +170,10 @@ def async_use_game_name_changer(func):
     return decorated_func
 
 @command_decorator.command("voice join channel", "Joins the specified voice channel if anna can access it.",
-                           cmd_special_params=[True, False, False])
+                           cost_class="voice")
 @async_use_persistent_info_dict
 async def cmd_join_voice_channel(message: discord.Message, client: discord.Client, config: dict,
-                                 ignored_command_message_ids: list):
+                                 context: command_context.CommandContext):
     """This command is issued to make anna join a voice channel if she has access to it on the server where this command was issued."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -109,11 +181,8 @@ async def cmd_join_voice_channel(message: discord.Message, client: discord.Clien
         # We're done here
         return
 
-    # Removing the anna-bot mention
-    cleaned_message = helpers.remove_anna_mention(client, message)
-
     # The user is not an idiot, so we parse the message for the voice channel name, if there are two or more channels with the same name, we tell the user to choose between them using channel order numbers that we give to them depending on the channel IDs
-    voice_channel_name = cleaned_message[len("voice join channel "):]
+    voice_channel_name = context.arguments
 
     # Checking how many voice channels in the server match the given name. If none match, we try to strip the name (the user might have been an idiot contrary to popular belief)
     num_matching_voice_channels = [
@@ -163,13 +232,12 @@ async def cmd_join_voice_channel(message: discord.Message, client: discord.Clien
                                               in
                                               channel_candidates]))
 
+                # The response message is claimed (added to the registry of ignored message ids) as soon as it is accepted, so on_message never runs it as a command
                 response_message = await client.wait_for_message(timeout=60, author=message.author,
                                                                  channel=message.channel,
-                                                                 check=lambda msg: helpers.is_message_command(msg,
-                                                                                                              client))
-
-                # We add the response message id to the ignored list of message ids
-                ignored_command_message_ids.append(response_message.id)
+                                                                 check=helpers.claim_accepted_messages(
+                                                                     lambda msg: helpers.is_message_command(msg, client),
+                                                                     context.ignored_message_ids))
 
                 # We wait for the caller to send back a message to us so we can determine what channel we should join
                 user_response = helpers.remove_anna_mention(client, response_message).strip()
@@ -249,13 +317,12 @@ async def cmd_join_voice_channel(message: discord.Message, client: discord.Clien
                                                   str(len(candidate[0].voice_members)))) for candidate in
                                               channel_candidates]))
 
+                # The response message is claimed (added to the registry of ignored message ids) as soon as it is accepted, so on_message never runs it as a command
                 response_message = await client.wait_for_message(timeout=60, author=message.author,
                                                                  channel=message.channel,
-                                                                 check=lambda msg: helpers.is_message_command(msg,
-                                                                                                              client))
-
-                # We add the response message id to the ignored list of message ids
-                ignored_command_message_ids.append(response_message.id)
+                                                                 check=helpers.claim_accepted_messages(
+                                                                     lambda msg: helpers.is_message_command(msg, client),
+                                                                     context.ignored_message_ids))
 
                 # We wait for the caller to send back a message to us so we can determine what channel we should join
                 user_response = helpers.remove_anna_mention(client, response_message).strip()
@@ -328,12 +395,12 @@ async def cmd_join_voice_channel(message: discord.Message, client: discord.Clien
         "playlist_info": {"is_playing": False, "playlist_name": "", "current_index": -1}, "queue": [],
         "channel_id": voice_channel.id}
 
-    return ignored_command_message_ids
 
-
-@command_decorator.command("voice joinme", "Joins the voice channel you are connected to if anna can access it.")
+@command_decorator.command("voice joinme", "Joins the voice channel you are connected to if anna can access it.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
-async def cmd_join_self_voice_channel(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_join_self_voice_channel(message: discord.Message, client: discord.Client, config: dict,
+                                      context: command_context.CommandContext):
     """This method makes anna-bot join the voice channel of the member who called the command."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -384,10 +451,11 @@ async def cmd_join_self_voice_channel(message: discord.Message, client: discord.
         "channel_id": member_channel.id}
 
 
-@command_decorator.command("voice leave", "Leaves the voice channel anna is connected to")
+@command_decorator.command("voice leave", "Leaves the voice channel anna is connected to", cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_leave_voice_channel(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_leave_voice_channel(message: discord.Message, client: discord.Client, config: dict,
+                                  context: command_context.CommandContext):
     """This command is issued to make anna leave a voice channel if she is connected to it on the server where this command was issued."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -410,6 +478,8 @@ async def cmd_leave_voice_channel(message: discord.Message, client: discord.Clie
 
         # We remove the stopped server's voice info
         del server_queue_info_dict[message.server.id]
+        discard_prefetched_playlist_entry(message.server.id)
+        voice_queue.cancel_transition(message.server.id)
 
         # We leave the voice channel that we're connected to on that server
         await client.voice_client_in(message.server).disconnect()
@@ -422,10 +492,12 @@ async def cmd_leave_voice_channel(message: discord.Message, client: discord.Clie
 
 
 @command_decorator.command("voice play link",
-                           "Adds the audio of the given link to the voice queue. The only platform that is guaranteed to work is youtube but it should work with all the sites listed here: https://rg3.github.io/youtube-dl/supportedsites.html , but I give no guarantees.")
+                           "Adds the audio of the given link to the voice queue. The only platform that is guaranteed to work is youtube but it should work with all the sites listed here: https://rg3.github.io/youtube-dl/supportedsites.html , but I give no guarantees.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_play_link(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_play_link(message: discord.Message, client: discord.Client, config: dict,
+                              context: command_context.CommandContext):
     """This command is used to queue up the audio of a youtube video at the given link, to the server's queue."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -434,7 +506,7 @@ async def cmd_voice_play_link(message: discord.Message, client: discord.Client,
         return
 
     # We parse the url from the command message
-    youtube_url = helpers.remove_anna_mention(client, message).strip()[len("voice play link "):]
+    youtube_url = context.arguments
 
     # We get the voice client on the server in which the command was issued
     voice = client.voice_client_in(message.server)
@@ -450,10 +522,8 @@ async def cmd_voice_play_link(message: discord.Message, client: discord.Client,
 
         # We need to catch some errors
         try:
-            # We're connected to a voice channel, so we try to create the ytdl stream player
-            # I found these ytdl options here: https://github.com/rg3/youtube-dl/blob/master/youtube_dl/YoutubeDL.py https://github.com/rg3/youtube-dl/blob/e7ac722d6276198c8b88986f06a4e3c55366cb58/README.md
-            youtube_player = await voice.create_ytdl_player(youtube_url, ytdl_options={"noplaylist": True},
-                                                            after=queue_handler)
+            # We're connected to a voice channel, so we try to create the queue entry
+            youtube_player = await create_queue_entry(voice, message.server.id, youtube_url, message.author.id)
         except youtube_dl.DownloadError:
             # The URL failed to load, it's probably invalid
             await client.send_message(message.channel,
@@ -462,6 +532,14 @@ async def cmd_voice_play_link(message: discord.Message, client: discord.Client,
             # We're done here
             return
 
+        except ytdl_extractor.ExtractionQueueFull:
+            # There are too many links being loaded right now
+            await client.send_message(message.channel,
+                                      message.author.mention + ", I'm loading too many links right now, please try again in a bit.")
+
+            # We're done here
+            return
+
         except ConnectionClosed:
             # This can happen with code 1000 "No reason"...
 
@@ -480,7 +558,7 @@ async def cmd_voice_play_link(message: discord.Message, client: discord.Client,
             # We reraise
             raise
 
-        # We append the streamplayer to the server's queue
+        # We append the entry to the server's queue
         server_queue_info_dict[message.server.id]["queue"].append(youtube_player)
 
         # If the server doesn't have any currently playing stream players, we start the new stream player
@@ -516,10 +594,12 @@ async def cmd_voice_play_link(message: discord.Message, client: discord.Client,
 
 
 @command_decorator.command("voice play search youtube",
-                           "Adds the audio of the first youtube search result from given query to the voice queue.")
+                           "Adds the audio of the first youtube search result from given query to the voice queue.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_play_youtube_search(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_play_youtube_search(message: discord.Message, client: discord.Client, config: dict,
+                                        context: command_context.CommandContext):
     """This method is used to add a youtube video to the server queue by picking the top search result from youtube on the specified query."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -528,7 +608,7 @@ async def cmd_voice_play_youtube_search(message: discord.Message, client: discor
         return
 
     # We parse the url from the command message
-    user_query = helpers.remove_anna_mention(client, message).strip()[len("voice play search youtube "):]
+    user_query = context.arguments
 
     # We get the voice client on the server in which the command was issued
     voice = client.voice_client_in(message.server)
@@ -560,11 +640,11 @@ async def cmd_voice_play_youtube_search(message: discord.Message, client: discor
 
         # We need to catch some errors
         try:
-            # We're connected to a voice channel, so we try to create the ytdl stream player with the search result we got
-            youtube_player = await voice.create_ytdl_player(
-                "http://www.youtube.com/watch?v={0}".format(search_results[0]), ytdl_options={"noplaylist": True},
-                after=queue_handler)
-        except youtube_dl.utils.ExtractorError:
+            # We're connected to a voice channel, so we try to create the queue entry with the search result we got
+            youtube_player = await create_queue_entry(voice, message.server.id,
+                                                      "http://www.youtube.com/watch?v={0}".format(search_results[0]),
+                                                      message.author.id)
+        except (youtube_dl.DownloadError, youtube_dl.utils.ExtractorError):
             # The URL failed to load, it's probably invalid
             await client.send_message(message.channel,
                                       message.author.mention + ", that URL failed to load, is it valid?")
@@ -572,7 +652,15 @@ async def cmd_voice_play_youtube_search(message: discord.Message, client: discor
             # We're done here
             return
 
-        # We append the streamplayer to the server's queue
+        except ytdl_extractor.ExtractionQueueFull:
+            # There are too many links being loaded right now
+            await client.send_message(message.channel,
+                                      message.author.mention + ", I'm loading too many links right now, please try again in a bit.")
+
+            # We're done here
+            return
+
+        # We append the entry to the server's queue
         server_queue_info_dict[message.server.id]["queue"].append(youtube_player)
 
         # If the server doesn't have any currently playing stream players, we start the new stream player
@@ -607,7 +695,8 @@ async def cmd_voice_play_youtube_search(message: discord.Message, client: discor
 
 
 # TODO remake
-async def cmd_voice_sound_effect(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_sound_effect(message: discord.Message, client: discord.Client, config: dict,
+                                 context: command_context.CommandContext):
     """This method is used to play a sound effect in the voice channel anna is connected to on the issuing server."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -616,7 +705,7 @@ async def cmd_voice_sound_effect(message: discord.Message, client: discord.Clien
         return
 
     # We parse the sound effect name from the command TODO
-    sound_effect_name = helpers.remove_anna_mention(client, message).strip()
+    sound_effect_name = context.arguments
 
     # We get the voice client on the server in which the command was issued
     voice = client.voice_client_in(message.server)
@@ -652,10 +741,12 @@ async def cmd_voice_sound_effect(message: discord.Message, client: discord.Clien
 
 
 @command_decorator.command("voice playlist play",
-                           "Starts playing a playlist, and puts the playlist at the front of the queue.")
+                           "Starts playing a playlist, and puts the playlist at the front of the queue.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_playlist_play(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_playlist_play(message: discord.Message, client: discord.Client, config: dict,
+                                  context: command_context.CommandContext):
     """This command plays the specified playlist file if it exists."""
 
     # We check if the user is allowed to use voice commands
@@ -683,7 +774,7 @@ async def cmd_voice_playlist_play(message: discord.Message, client: discord.Clie
         return
 
     # We parse the user input / specified playlist
-    user_playlist = helpers.remove_anna_mention(client, message)[len("voice playlist play "):]
+    user_playlist = context.arguments
     # We remove unsafe chars from the user specified playlist filename
     # Note that we don't allow dots/full stops in the file name, this is so we don't need to use regular expressions to remove multiple dots in a row (try ../../../../kek.txt)
     user_playlist = "".join(c for c in user_playlist if c.isalnum() or c in (' ', '_')).rstrip()
@@ -702,10 +793,11 @@ async def cmd_voice_playlist_play(message: discord.Message, client: discord.Clie
             # We need to catch some errors
             try:
                 # We're connected to a voice channel, so we try to create the ytdl stream player
-                # I found these ytdl options here: https://github.com/rg3/youtube-dl/blob/master/youtube_dl/YoutubeDL.py https://github.com/rg3/youtube-dl/blob/e7ac722d6276198c8b88986f06a4e3c55366cb58/README.md
-                youtube_player = await voice.create_ytdl_player(playlist_file.readline().strip(),
-                                                                ytdl_options={"noplaylist": True},
-                                                                after=queue_handler)
+                youtube_player = await ytdl_extractor.create_player(voice, playlist_file.readline().strip(),
+                                                                    after=queue_handler)
+
+                # The playlist entry goes to the front of the queue right away, so we create it with its player
+                youtube_player = queue_entry_from_player(youtube_player, message.server.id, message.author.id)
             except youtube_dl.DownloadError:
                 # The URL failed to load, it's probably invalid
                 await client.send_message(message.channel,
@@ -714,6 +806,14 @@ async def cmd_voice_playlist_play(message: discord.Message, client: discord.Clie
                 # We're done here
                 return
 
+            except ytdl_extractor.ExtractionQueueFull:
+                # There are too many links being loaded right now
+                await client.send_message(message.channel,
+                                          message.author.mention + ", I'm loading too many links right now, please try again in a bit.")
+
+                # We're done here
+                return
+
             except ConnectionClosed:
                 # This can happen with code 1000 "No reason"...
 
@@ -739,7 +839,7 @@ async def cmd_voice_playlist_play(message: discord.Message, client: discord.Clie
             if len(server_queue_info_dict[message.server.id]["queue"]) > 0:
                 server_queue_info_dict[message.server.id]["queue"][0].pause()
 
-            # We insert the streamplayer in the front of the queue
+            # We insert the entry in the front of the queue
             server_queue_info_dict[message.server.id]["queue"].insert(0, youtube_player)
 
             # We update the server info dict for using playlists
@@ -774,10 +874,12 @@ async def cmd_voice_playlist_play(message: discord.Message, client: discord.Clie
 
 
 @command_decorator.command("voice playlist stop",
-                           "Stops playing the current playlist, and starts playing the rest of the queue.")
+                           "Stops playing the current playlist, and starts playing the rest of the queue.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_playlist_stop(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_playlist_stop(message: discord.Message, client: discord.Client, config: dict,
+                                  context: command_context.CommandContext):
     """This command stops playing a playlist and switches to the regular queue playing. It does this by invoking the queue handler."""
 
     # We check if the user is allowed to use voice commands
@@ -818,8 +920,9 @@ async def cmd_voice_playlist_stop(message: discord.Message, client: discord.Clie
 
 @command_decorator.command("voice playlist add",
                            "Uploads the attached file as a playlist file. Filenames cannot contain dots. Use with caution. Format for playlist files is \"LINK\\nLINK\\nLINK\\n...\".",
-                           admin=True)
-async def cmd_voice_playlist_add(message: discord.Message, client: discord.Client, config: dict):
+                           admin=True, cost_class="voice")
+async def cmd_voice_playlist_add(message: discord.Message, client: discord.Client, config: dict,
+                                 context: command_context.CommandContext):
     """This command lets an anna-bot admin upload a new playlist file to the bot. This doesn't allow regular users to do it because of DoS and space concerns."""
 
     # This command can be used anywhere, the only requirement is that the message has attached a playlist file (one link per line, unix file endings), and that the file does not share it's name with one of the already existing playlists
@@ -866,13 +969,14 @@ async def cmd_voice_playlist_add(message: discord.Message, client: discord.Clien
 
 @command_decorator.command("voice playlist remove",
                            "Removes an existing playlist file from anna-bot. Use with caution, as it will stop all playing of this playlist.",
-                           admin=True)
-async def cmd_voice_playlist_remove(message: discord.Message, client: discord.Client, config: dict):
+                           admin=True, cost_class="voice")
+async def cmd_voice_playlist_remove(message: discord.Message, client: discord.Client, config: dict,
+                                    context: command_context.CommandContext):
     """This command lets an anna-bot admin remove an existing playlist file from the bot. This doesn't allow regular users to do it because of abuse concerns."""
 
     # This command can be used anywhere, the only requirement is that the user specifies a playlist file that exists
     # We parse the specified filename
-    playlist_name = helpers.remove_anna_mention(client, message)[len("admin voice playlist remove "):].strip()
+    playlist_name = context.arguments
 
     # We check if it exists
     if not (os.path.isfile(os.path.join("playlists", playlist_name)) and not os.path.islink(
@@ -901,8 +1005,9 @@ async def cmd_voice_playlist_remove(message: discord.Message, client: discord.Cl
 
 
 @command_decorator.command("voice playlist list",
-                           "Lists the available playlist files that anna-bot can play.")
-async def cmd_voice_playlist_list(message: discord.Message, client: discord.Client, config: dict):
+                           "Lists the available playlist files that anna-bot can play.", cost_class="voice")
+async def cmd_voice_playlist_list(message: discord.Message, client: discord.Client, config: dict,
+                                  context: command_context.CommandContext):
     """This command lets a regular user list the available playlist files on the bot."""
 
     # We check if the message was sent in a regular channel
@@ -933,9 +1038,11 @@ async def cmd_voice_playlist_list(message: discord.Message, client: discord.Clie
     await helpers.send_long(client, list_message, message.channel)
 
 
-@command_decorator.command("voice volume", "Change the volume of the audio that anna plays (0% -> 200%).")
+@command_decorator.command("voice volume", "Change the volume of the audio that anna plays (0% -> 200%).",
+                           cost_class="voice")
 @async_use_persistent_info_dict
-async def cmd_voice_set_volume(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_set_volume(message: discord.Message, client: discord.Client, config: dict,
+                               context: command_context.CommandContext):
     """This command is used to change the volume of the audio that anna plays."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -950,7 +1057,7 @@ async def cmd_voice_set_volume(message: discord.Message, client: discord.Client,
         if len(server_queue_info_dict[message.server.id]["queue"]) > 0:
 
             # We parse the command and check if the specified volume is a valid non-negative integer
-            clean_argument = helpers.remove_anna_mention(client, message)[13:].strip()
+            clean_argument = context.arguments
 
             if clean_argument.isdigit():
 
@@ -982,9 +1089,11 @@ async def cmd_voice_set_volume(message: discord.Message, client: discord.Client,
                                   message.author.mention + ", I'm not connected to any voice channels on this server.")
 
 
-@command_decorator.command("voice toggle", "Toggle (pause or unpause) the audio anna is currently playing.")
+@command_decorator.command("voice toggle", "Toggle (pause or unpause) the audio anna is currently playing.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
-async def cmd_voice_play_toggle(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_play_toggle(message: discord.Message, client: discord.Client, config: dict,
+                                context: command_context.CommandContext):
     """This method is used to toggle playing (pausing and unpausing) the currently playing stream player in that server (if there is one)."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -1024,9 +1133,10 @@ async def cmd_voice_play_toggle(message: discord.Message, client: discord.Client
                                   message.author.mention + ", I'm not connected to any voice channels on this server.")
 
 
-@command_decorator.command("voice stop", "Stop the audio that anna is currently playing.")
+@command_decorator.command("voice stop", "Stop the audio that anna is currently playing.", cost_class="voice")
 @async_use_game_name_changer
-async def cmd_voice_play_stop(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_play_stop(message: discord.Message, client: discord.Client, config: dict,
+                              context: command_context.CommandContext):
     """This method is used to stop and remove the currently playing audio from anna in a server. This basically does queue.pop()"""
 
     # We check if the issuing user has the proper permissions on this server
@@ -1070,8 +1180,9 @@ async def cmd_voice_play_stop(message: discord.Message, client: discord.Client,
                                   message.author.mention + ", I'm not connected to any voice channels on this server.")
 
 
-@command_decorator.command("queue list", "Lists the current voice queue.")
-async def cmd_voice_queue_list(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("queue list", "Lists the current voice queue.", cost_class="voice")
+async def cmd_voice_queue_list(message: discord.Message, client: discord.Client, config: dict,
+                               context: command_context.CommandContext):
     """This method shows the audio current queue for the server that it was called from."""
 
     # We check if the message was sent in a regular channel
@@ -1148,10 +1259,12 @@ async def cmd_voice_queue_list(message: discord.Message, client: discord.Client,
 
 
 @command_decorator.command("queue remove",
-                           "Removes the specified queue index from the queue, if the index is 0, it effectively acts as a skip command.")
+                           "Removes the specified queue index from the queue, if the index is 0, it effectively acts as a skip command.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_queue_remove(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_queue_remove(message: discord.Message, client: discord.Client, config: dict,
+                                 context: command_context.CommandContext):
     """This method removes a specified stream from the current queue for the server that it was called from."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -1176,7 +1289,7 @@ async def cmd_voice_queue_remove(message: discord.Message, client: discord.Clien
         return
 
     # We parse the command and check if the specified volume is a valid non-negative integer
-    clean_argument = helpers.remove_anna_mention(client, message)[len("queue remove "):].strip()
+    clean_argument = context.arguments
 
     if clean_argument.isdigit():
         # We check if the requested id is valid
@@ -1217,10 +1330,11 @@ async def cmd_voice_queue_remove(message: discord.Message, client: discord.Clien
         return
 
 
-@command_decorator.command("queue skip", "Alias for **queue remove 0**.")
+@command_decorator.command("queue skip", "Alias for **queue remove 0**.", cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_queue_remove(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_queue_remove(message: discord.Message, client: discord.Client, config: dict,
+                                 context: command_context.CommandContext):
     """This method is an alias for queue remove 0."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -1266,10 +1380,12 @@ async def cmd_voice_queue_remove(message: discord.Message, client: discord.Clien
     helpers.log_info("Skipped entry in queue on server {0} ({1}).".format(message.server.name, message.server.id))
 
 
-@command_decorator.command("queue clear", "Clears the current voice queue, and stops the currently playing audio.")
+@command_decorator.command("queue clear", "Clears the current voice queue, and stops the currently playing audio.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_queue_clear(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_queue_clear(message: discord.Message, client: discord.Client, config: dict,
+                                context: command_context.CommandContext):
     """This method clears/resets the current queue for the server that ít was called from."""
 
     # We check if the issuing user has the proper permissions on this server
@@ -1293,16 +1409,18 @@ async def cmd_voice_queue_clear(message: discord.Message, client: discord.Client
         # We're done here
         return
 
-    # We make sure that the current player is paused, by pausing it :)
-    server_queue_info_dict[message.server.id]["queue"][0].pause()
-
     # We set the playlist info to not playing a playlist
     server_queue_info_dict[message.server.id]["playlist_info"]["is_playing"] = False
     server_queue_info_dict[message.server.id]["playlist_info"]["playlist_name"] = ""
     server_queue_info_dict[message.server.id]["playlist_info"]["current_index"] = -1
 
-    # We clear the queue, note that this removes ALL references to the players within
+    # We clear the queue, and then stop the entries, the queue handler doesn't find them in the queue anymore, so it doesn't start anything else
+    removed_entries = server_queue_info_dict[message.server.id]["queue"][:]
     del server_queue_info_dict[message.server.id]["queue"][:]
+    for entry in removed_entries:
+        entry.stop()
+    discard_prefetched_playlist_entry(message.server.id)
+    voice_queue.cancel_transition(message.server.id)
 
     # We tell the user that we've cleared the queue
     await client.send_message(message.channel, message.author.mention + ", I've now cleared the queue.")
@@ -1312,10 +1430,12 @@ async def cmd_voice_queue_clear(message: discord.Message, client: discord.Client
 
 
 @command_decorator.command("queue forward",
-                           "Pauses the currently playing audio, moves the specified queue index to the front, and starts playing that instead.")
+                           "Pauses the currently playing audio, moves the specified queue index to the front, and starts playing that instead.",
+                           cost_class="voice")
 @async_use_persistent_info_dict
 @async_use_game_name_changer
-async def cmd_voice_queue_forward(message: discord.Message, client: discord.Client, config: dict):
+async def cmd_voice_queue_forward(message: discord.Message, client: discord.Client, config: dict,
+                                  context: command_context.CommandContext):
     """This method brings a specified stream in the current queue (for the server that it was called from) forward to the front of the queue.
     It does not remove the currently playing stream, that's what the stop command does."""
 
@@ -1350,7 +1470,7 @@ async def cmd_voice_queue_forward(message: discord.Message, client: discord.Clie
         return
 
     # We parse the command and check if the specified volume is a valid non-negative integer
-    clean_argument = helpers.remove_anna_mention(client, message)[len(" queue forward"):].strip()
+    clean_argument = context.arguments
 
     if clean_argument.isdigit():
         # We check if the requested id is valid
@@ -1398,24 +1518,23 @@ async def cmd_voice_queue_forward(message: discord.Message, client: discord.Clie
 
 
 @command_decorator.command("voice roles list", "Lists the roles that are allowed to issue voice commands.",
-                           cmd_special_params=[False, True, False])
+                           cost_class="voice")
 async def cmd_voice_permissions_list_allowed(message: discord.Message, client: discord.Client, config: dict,
-                                             config_nope: dict):
-    """This command lists the current allowed voice roles. It takes 2 config parameters because it has special param index 1 enabled, this means it can change the global config object"""
+                                             context: command_context.CommandContext):
+    """This command lists the current allowed voice roles."""
 
     # We check if the message was sent in a regular channel
     if not await pm_checker(message, client):
         # They can't execute the commands
-        return [config]
+        return
 
     # We check if the user has the administrator permission
-    if (not message.author.server_permissions.administrator) and (
-            not helpers.is_member_anna_admin(message.author, config)):
+    if (not message.author.server_permissions.administrator) and (not context.is_admin):
         # We tell the user that they don't have permission to use this command
         await client.send_message(message.channel,
                                   message.author.mention + ", you do not have permission to use voice administration commands on this server. You need to have the \"Administrator\" permission on the server to use this command.")
         # No permission
-        return [config]
+        return
 
     # We make sure that the server has a valid voice command roles list
     if not message.server.id in config["voice_command_roles"]:
@@ -1442,6 +1561,7 @@ async def cmd_voice_permissions_list_allowed(message: discord.Message, client: d
     # We remove all invalid role ids and write the new config out to file so we can reload it later
     for index in sorted(invalid_indices, reverse=True):
         del config["voice_command_roles"][message.server.id][index]
+    config_index.set_voice_command_roles(message.server.id, config["voice_command_roles"][message.server.id])
     # We write out the config
     helpers.write_config(config)
 
@@ -1452,34 +1572,31 @@ async def cmd_voice_permissions_list_allowed(message: discord.Message, client: d
                                   message.author.mention + ", this server doesn't have any voice command roles, so everyone is able to use voice commands.")
 
         # We're done here
-        return [config]
+        return
 
     # We send the list message to the issuing user
     await helpers.send_long(client, list_message, message.channel)
 
-    return [config]
-
 
 @command_decorator.command("voice roles add",
                            "Adds a role to the list of roles that are allowed to issue voice commands.",
-                           cmd_special_params=[False, True, False])
+                           cost_class="voice")
 async def cmd_voice_permissions_add_allowed(message: discord.Message, client: discord.Client, config: dict,
-                                            config_nope: dict):
+                                            context: command_context.CommandContext):
     """This command adds a role to the current allowed voice roles, and writes it to the config."""
 
     # We check if the message was sent in a regular channel
     if not await pm_checker(message, client):
         # They can't execute the commands
-        return [config]
+        return
 
     # We check if the user has the administrator permission
-    if (not message.author.server_permissions.administrator) and (
-            not helpers.is_member_anna_admin(message.author, config)):
+    if (not message.author.server_permissions.administrator) and (not context.is_admin):
         # We tell the user that they don't have permission to use this command
         await client.send_message(message.channel,
                                   message.author.mention + ", you do not have permission to use voice administration commands on this server. You need to have the \"Administrator\" permission on the server to use this command.")
         # No permission
-        return [config]
+        return
 
     # We make sure that the server has a valid voice command roles list
     if not message.server.id in config["voice_command_roles"]:
@@ -1488,15 +1605,14 @@ async def cmd_voice_permissions_add_allowed(message: discord.Message, client: di
 
     # We parse the user specified role, if it isn't valid, we tell the user and exit
     user_add_role = helpers.get_role_from_mention(message.author,
-                                                  helpers.remove_anna_mention(client, message).strip()[
-                                                  len("voice roles add "):])
+                                                  context.arguments)
     if user_add_role is None:
         # The role isn't valid
         await client.send_message(message.channel,
                                   message.author.mention + ", that isn't a valid role mention or doesn't exist on this server.")
 
         # We're done here
-        return [config]
+        return
 
     # We check if the role already exists in the allowed command roles
     if user_add_role.id in config["voice_command_roles"][message.server.id]:
@@ -1505,38 +1621,37 @@ async def cmd_voice_permissions_add_allowed(message: discord.Message, client: di
                                   message.author.mention + ", that role is already configured as an allowed role.")
 
         # We're done here
-        return [config]
+        return
 
     # We add the role to the config
     config["voice_command_roles"][message.server.id].append(user_add_role.id)
+    config_index.set_voice_command_roles(message.server.id, config["voice_command_roles"][message.server.id])
 
     # We write out the config to file, and tell the user that we're done
     helpers.write_config(config)
 
     await client.send_message(message.channel, message.author.mention + ", I've now added it to the allowed role list.")
-    return [config]
 
 
 @command_decorator.command("voice roles remove",
                            "Removes a role from the list of roles that are allowed to issue voice commands.",
-                           cmd_special_params=[False, True, False])
+                           cost_class="voice")
 async def cmd_voice_permissions_remove_allowed(message: discord.Message, client: discord.Client, config: dict,
-                                               config_nope: dict):
+                                               context: command_context.CommandContext):
     """This command removes a role to the current allowed voice roles, and writes it to the config."""
 
     # We check if the message was sent in a regular channel
     if not await pm_checker(message, client):
         # They can't execute the commands
-        return [config]
+        return
 
     # We check if the user has the administrator permission
-    if (not message.author.server_permissions.administrator) and (
-            not helpers.is_member_anna_admin(message.author, config)):
+    if (not message.author.server_permissions.administrator) and (not context.is_admin):
         # We tell the user that they don't have permission to use this command
         await client.send_message(message.channel,
                                   message.author.mention + ", you do not have permission to use voice administration commands on this server. You need to have the \"Administrator\" permission on the server to use this command.")
         # No permission
-        return [config]
+        return
 
     # We make sure that the server has a valid voice command roles list
     if not message.server.id in config["voice_command_roles"]:
@@ -1545,15 +1660,14 @@ async def cmd_voice_permissions_remove_allowed(message: discord.Message, client:
 
     # We parse the user specified role, if it isn't valid, we tell the user and exit
     user_add_role = helpers.get_role_from_mention(message.author,
-                                                  helpers.remove_anna_mention(client, message).strip()[
-                                                  len("voice roles add "):])
+                                                  context.arguments)
     if user_add_role is None:
         # The role isn't valid
         await client.send_message(message.channel,
                                   message.author.mention + ", that isn't a valid role mention or doesn't exist on this server.")
 
         # We're done here
-        return [config]
+        return
 
     # We check if the role doesn't exists in the allowed command roles
     if user_add_role.id not in config["voice_command_roles"][message.server.id]:
@@ -1562,17 +1676,17 @@ async def cmd_voice_permissions_remove_allowed(message: discord.Message, client:
                                   message.author.mention + ", that role is not configured as an allowed role.")
 
         # We're done here
-        return [config]
+        return
 
     # We remove the role from the config
     config["voice_command_roles"][message.server.id].remove(user_add_role.id)
+    config_index.set_voice_command_roles(message.server.id, config["voice_command_roles"][message.server.id])
 
     # We write out the config to file, and tell the user that we're done
     helpers.write_config(config)
 
     await client.send_message(message.channel,
                               message.author.mention + ", I've now removed it from the allowed role list.")
-    return [config]
 
 
 async def permission_checker(message: discord.Message, client: discord.Client, config: dict):
@@ -1584,17 +1698,16 @@ async def permission_checker(message: discord.Message, client: discord.Client, c
         # They can't execute the commands
         return False
 
-    # We check if the server has configured allowed voice roles
-    if message.server.id in config["voice_command_roles"]:
-        # We check if the issuing user has an allowed role
-        if not any(i in config["voice_command_roles"][message.server.id] for i in [x.id for x in message.author.roles]):
-            # We check if the server purposefully doesn't have any roles
-            if len(config["voice_command_roles"][message.server.id]) > 0:
-                # The user does not have permission to use the command
-                await client.send_message(message.channel,
-                                          message.author.mention + ", you do not have permission to use voice commands on this server.")
-                # No permission
-                return False
+    # We get the allowed voice roles of the server (if it has configured any), which are kept as a set by the config index
+    voice_command_role_ids = config_index.get(message.server).voice_command_role_ids
+
+    # We check if the issuing user has an allowed role, servers that purposefully don't have any roles allow everyone
+    if voice_command_role_ids and voice_command_role_ids.isdisjoint(x.id for x in message.author.roles):
+        # The user does not have permission to use the command
+        await client.send_message(message.channel,
+                                  message.author.mention + ", you do not have permission to use voice commands on this server.")
+        # No permission
+        return False
 
     # They can and are allowed to execute the commands
     return True
@@ -1626,28 +1739,92 @@ def is_playing(server_id: str):
 
 
 def find_stream_player(stream_player):
-    """This method returns the server id and queue index of a stream player, returns (False, False, False) if they don't exist."""
+    """This method returns the server id and queue index of a queue entry, or of the entry whose player stream_player is, returns (None, None) if it isn't in any queue."""
 
-    # If we found the stream player that we got passed (This will always be true, but this variable is used for signaling)
-    found = True
-
-    # We find the exited streamplayer in the server and info list Since we have no info on which server the streamplayer is playing on, we have to use id()
+    # Since we have no info on which server the entry is on, we look through all the queues
     for server_id in server_queue_info_dict:
-        for inx_player, player in enumerate(server_queue_info_dict[server_id]["queue"]):
-            if stream_player is player:
-                found = True
-                break
-
-        if found:
-            break
-
-    # We make sure the impossible doesn't happen
-    if not found:
-        # We didn't find the stream player that was passed to us, which should never happen
-        helpers.log_error("Did not find the streamplayer that was passed to the find function, report the bug?")
+        for inx_player, entry in enumerate(server_queue_info_dict[server_id]["queue"]):
+            if stream_player is entry or stream_player is entry.player:
+                return server_id, inx_player
+
+    return None, None
+
+
+async def create_queue_entry(voice, server_id: str, url: str, requester: str) -> voice_queue.QueueEntry:
+    """Creates a queue entry for the url. If the server's queue is empty, the entry goes to the front of it right away, so we create its player at once (which gets the info too),
+    otherwise we only get the info of the url, and the player is created when the entry gets close to the front of the queue."""
+    if len(server_queue_info_dict[server_id]["queue"]) == 0:
+        player = await ytdl_extractor.create_player(voice, url, after=queue_handler)
+        return queue_entry_from_player(player, server_id, requester)
+
+    return await voice_queue.create_entry(server_id, url, requester, queue_handler, prefetch_next_entry)
+
+
+def queue_entry_from_player(player, server_id: str, requester) -> voice_queue.QueueEntry:
+    """Creates a queue entry of a player that was created with queue_handler as its after callback."""
+    return voice_queue.entry_from_player(player, server_id, requester, queue_handler, prefetch_next_entry)
+
+
+def prefetch_next_entry(entry: voice_queue.QueueEntry):
+    """This is called when the entry is close to its end, we create the player of the next track (the next entry in the queue, or the next line of the playlist),
+    so the next track doesn't have to wait for youtube_dl and starts without a gap."""
+    info = server_queue_info_dict.get(entry.server_id)
+    if info is None or len(info["queue"]) == 0 or info["queue"][0] is not entry:
         return
 
-    return server_id, inx_player
+    if info["playlist_info"]["is_playing"]:
+        prefetch_next_playlist_entry(entry.server_id)
+    elif len(info["queue"]) > 1:
+        info["queue"][1].prefetch()
+
+
+def get_next_playlist_line(playlist_name: str, current_index: int):
+    """Returns the index and the link of the line after current_index in the playlist file, we loop back to the beginning of the playlist if we reached the end.
+    Returns (None, None) if the playlist is empty, and raises IOError if the playlist file can't be read."""
+    with open(os.path.join("playlists", playlist_name), mode="r", encoding="utf-8") as playlist_file:
+        lines = playlist_file.readlines()
+
+    if len(lines) == 0:
+        return None, None
+
+    target_line = current_index + 1
+    target_line = 0 if target_line >= len(lines) else target_line
+    return target_line, lines[target_line].strip()
+
+
+def prefetch_next_playlist_entry(server_id: str):
+    """Creates an entry for the next line of the server's playlist and prefetches its player, update_server_playlist starts it when the current entry ends."""
+    playlist_info = server_queue_info_dict[server_id]["playlist_info"]
+
+    try:
+        target_line, link = get_next_playlist_line(playlist_info["playlist_name"], playlist_info["current_index"])
+    except IOError:
+        # update_server_playlist handles (and logs) this when the current entry ends
+        return
+
+    if link is None:
+        return
+
+    prefetched = prefetched_playlist_entries.get(server_id)
+    if prefetched is not None:
+        if prefetched[:3] == (playlist_info["playlist_name"], playlist_info["current_index"], target_line):
+            # We've already prefetched this line
+            return
+
+        discard_prefetched_playlist_entry(server_id)
+
+    # The playlist's entries are requested by nobody in particular, and we don't know their info until their player is created
+    entry = voice_queue.QueueEntry(server_id, link, {}, None, queue_handler, prefetch_next_entry)
+    prefetched_playlist_entries[server_id] = (playlist_info["playlist_name"], playlist_info["current_index"],
+                                              target_line, entry)
+    entry.prefetch()
+
+
+def discard_prefetched_playlist_entry(server_id: str):
+    """Stops the prefetched playlist entry of the server (if there is one), this ends its ffmpeg process."""
+    prefetched = prefetched_playlist_entries.pop(server_id, None)
+    if prefetched is not None:
+        prefetched[3].stop()
 
 
 def handle_audio_title_game_name():
@@ -1665,22 +1842,30 @@ def handle_audio_title_game_name():
             helpers.playing_game_info = [True, ""]
 
 @use_persistent_info_dict
-def queue_handler(current_player):
-    """This method gets called after each streamplayer stops, with current_player being the player that exited.
-    It handles removing the player from the server's queue, and starting playing the next in the queue, or if the server uses playlists, it starts the next audio feed in the playlist."""
+def queue_handler(stopped_player):
+    """This method gets called after each queue entry stops, with stopped_player being the entry (or the player of the entry) that exited.
+    It handles removing the entry from the server's queue, and starting playing the next in the queue, or if the server uses playlists, it starts the next audio feed in the playlist."""
 
-    # We save the volume of the exited stream
-    last_volume = current_player.volume
+    # The time the track ended, the gap until the next track starts is measured from this
+    ended_time = time.monotonic()
+
+    # We find the queue entry in the server voice info dict
+    server_id, inx_player = find_stream_player(stopped_player)
+    if server_id is None:
+        # The entry isn't in a queue anymore, the queue was cleared or we left the voice channel
+        return
 
-    # We find the stream player in the server voice info dict
-    server_id, inx_player = find_stream_player(current_player)
+    current_player = server_queue_info_dict[server_id]["queue"][inx_player]
+
+    # We save the volume of the exited entry
+    last_volume = current_player.volume
 
     # We log that we are handling the end of a player
     helpers.log_info(
         "Audio feed with title: \"{0}\", uploaded by: \"{1}\", duration: {2}, exited, handling server queue.".format(
             current_player.title, current_player.uploader, current_player.duration))
 
-    # We delete the old stream player
+    # We delete the old queue entry
     del server_queue_info_dict[server_id]["queue"][inx_player]
 
     # Here we split the logic to handle playlists (not youtube-like playlists, I mean the file playlists)
@@ -1688,6 +1873,7 @@ def queue_handler(current_player):
     if server_queue_info_dict[server_id]["playlist_info"]["is_playing"] and inx_player == 0:
 
         # We do playlist logic, and check whether it succeeded
+        voice_queue.start_transition(server_id, ended_time)
         if update_server_playlist(server_id, last_volume):
             # We're done here
             return
@@ -1699,20 +1885,23 @@ def queue_handler(current_player):
     server_queue_info_dict[server_id]["playlist_info"]["is_playing"] = False
     server_queue_info_dict[server_id]["playlist_info"]["current_index"] = -1
     server_queue_info_dict[server_id]["playlist_info"]["playlist_name"] = ""
+    discard_prefetched_playlist_entry(server_id)
 
     # We aren't playing a playlist file
-    # We check if the server has any more players in the queue
+    # We check if the server has any more entries in the queue
     if len(server_queue_info_dict[server_id]["queue"]) == 0:
         helpers.log_info(
             "Server on which audio feed with title: \"{0}\", uploaded by: \"{1}\", duration: {2}, played, has exhausted it's queue.".format(
                 current_player.title, current_player.uploader, current_player.duration))
+        voice_queue.cancel_transition(server_id)
         # We're done here
         return
 
     # We check if there is a new first player in the server queue
     if inx_player == 0:
-        # We set the volume and start the new first player in the queue
+        # We set the volume and start the new first entry in the queue, this creates its player if it wasn't prefetched
         server_queue_info_dict[server_id]["queue"][0].volume = last_volume
+        voice_queue.start_transition(server_id, ended_time)
         server_queue_info_dict[server_id]["queue"][0].start()
 
         current_player = server_queue_info_dict[server_id]["queue"][0]
@@ -1784,13 +1973,17 @@ def insert_start_player_future_in_queue(player_future, server_id: str, target_vo
         server_queue_info_dict[server_id]["playlist_info"]["is_playing"] = False
         server_queue_info_dict[server_id]["playlist_info"]["current_index"] = -1
         server_queue_info_dict[server_id]["playlist_info"]["playlist_name"] = ""
+        voice_queue.cancel_transition(server_id)
 
         # We're done here, and we don't retry
         return
 
+    # The playlist's entries are requested by nobody in particular
+    player = queue_entry_from_player(player, server_id, None)
+
     # We catch exception from trying to insert into a queue on a server that doesn't have a voice info object anymore
     try:
-        # We insert the streamplayer into the server's queue
+        # We insert the entry into the server's queue
         server_queue_info_dict[server_id]["queue"].insert(index, player)
     except KeyError as e:
         helpers.log_info(
@@ -1824,6 +2017,36 @@ def update_server_playlist(server_id: str, target_volume: float):
     It doesn't check if the current entry is playing.
     Returns False if it wasn't able to begin ytdl_player creation. Else returns False."""
 
+    playlist_info = server_queue_info_dict[server_id]["playlist_info"]
+
+    # If the next entry was prefetched while the current one was playing, we start it right away, so there's no gap between them
+    prefetched = prefetched_playlist_entries.pop(server_id, None)
+    if prefetched is not None:
+        playlist_name, prefetched_index, target_line, entry = prefetched
+
+        # The prefetched entry is only the next one if the playlist didn't change since it was prefetched
+        if (playlist_name, prefetched_index) == (playlist_info["playlist_name"], playlist_info["current_index"]):
+            server_queue_info_dict[server_id]["queue"].insert(0, entry)
+            entry.volume = target_volume
+
+            # This starts the player right away if it's done loading, otherwise it starts as soon as it is
+            entry.start()
+            if len(server_queue_info_dict[server_id]["queue"]) > 1:
+                server_queue_info_dict[server_id]["queue"][1].pause()
+
+            playlist_info["current_index"] = target_line
+
+            helpers.log_info("Started prefetched entry {0} in playlist {1} on server {2}.".format(
+                target_line, playlist_name, server_id))
+
+            # We handle the game name, if we know the title of the entry yet
+            if entry.title is not None:
+                handle_audio_title_game_name()
+
+            return True
+
+        entry.stop()
+
     # We check if we can read the playlist file
     try:
         with open(os.path.join("playlists", server_queue_info_dict[server_id]["playlist_info"]["playlist_name"]),
@@ -1879,10 +2102,8 @@ def update_server_playlist(server_id: str, target_volume: float):
                             return False
 
                     # We have the correct line, so we try to create a ytdl player
-                    # I found these ytdl options here: https://github.com/rg3/youtube-dl/blob/master/youtube_dl/YoutubeDL.py https://github.com/rg3/youtube-dl/blob/e7ac722d6276198c8b88986f06a4e3c55366cb58/README.md
                     youtube_player_future = asyncio.run_coroutine_threadsafe(
-                        voice.create_ytdl_player(line.strip(), ytdl_options={"noplaylist": True},
-                                                 after=queue_handler), client.loop)
+                        ytdl_extractor.create_player(voice, line.strip(), after=queue_handler), client.loop)
 
                     # We register a callback to the future, so it adds the player to the first position in the queue when ytdl is done
                     youtube_player_future.add_done_callback(
@@ -1,16 +1,23 @@
 import discord
 
+from ... import command_context
 from ... import command_decorator
+from ... import config_index
 from ... import helpers
 
 
 @command_decorator.command("warn",
-                           "Gives a warning to a user, if they reach the maximum number of warnings, (depending on the server's settings) they are banned or kicked. This command can only be used by certain roles.")
-async def add_warning(message: discord.Message, client: discord.Client, config: dict):
+                           "Gives a warning to a user, if they reach the maximum number of warnings, (depending on the server's settings) they are banned or kicked. This command can only be used by certain roles.",
+                           cost_class="moderation")
+async def add_warning(message: discord.Message, client: discord.Client, config: dict,
+                      context: command_context.CommandContext):
     """This command is used to warn a player and keep adding warnings until the max warning number and then taking action on it"""
 
+    # We get the warning settings of the server, which were compiled from the config once
+    server_config = config_index.get(message.server)
+
     # We check if the server supports warnings
-    if message.server.id not in config["warning_roles"]:
+    if server_config.warning is None:
         # Tell the user that this server doesn't support warnings
         await client.send_message(message.channel,
                                   message.author.mention + ", you can't warn people on this server because this server has not configured warning roles.")
@@ -22,8 +29,8 @@ async def add_warning(message: discord.Message, client: discord.Client, config:
         return
 
     # We check if the issuer has one of the authorised roles to add and remove warnings
-    if not (any(i in [str(x.id) for x in message.author.roles] for i in config["warning_roles"][message.server.id][
-        "roles_that_can_warn"]) or message.author == message.server.owner):
+    if not ((not server_config.warning.can_warn_role_ids.isdisjoint(x.id for x in message.author.roles)) or
+            message.author == message.server.owner):
         # We tell the issuer that they are not authorised to add or remove warnings
         await client.send_message(message.channel,
                                   message.author.mention + ", you are not authorised to add or remove warnings from people on this server.")
@@ -35,7 +42,7 @@ async def add_warning(message: discord.Message, client: discord.Client, config:
         return
 
     # We strip the message of the username, and then we check if it is a valid one
-    username_raw = helpers.remove_anna_mention(client, message.content.strip())[len("warn "):].strip()
+    username_raw = context.arguments
 
     # We try to get the user, by getting the one that the issuer mentioned
     target_user = discord.utils.get(message.server.members, mention=username_raw)
@@ -55,8 +62,7 @@ async def add_warning(message: discord.Message, client: discord.Client, config:
     if (message.author.top_role.position <= target_user.top_role.position) or (
             not helpers.check_add_remove_roles(target_user, message.channel)) or (not (
             message.channel.permissions_for(message.server.me).ban_members if
-            config["warning_roles"][message.server.id][
-                "ban_after_warnings"] else message.channel.permissions_for(message.server.me).kick_members)):
+            server_config.warning.ban_after_warnings else message.channel.permissions_for(message.server.me).kick_members)):
         print(message.author.top_role.position <= target_user.top_role.position)
 
         # We tell the user that we do not have the proper permissions
@@ -78,28 +84,20 @@ async def add_warning(message: discord.Message, client: discord.Client, config:
 
     # We check what warning the target user is on
     target_user_warning_level = -1
+    target_user_role_ids = {x.id for x in target_user.roles}
 
-    for warning_level, warning_role_id in enumerate(config["warning_roles"][message.server.id]["warning_role_ids"]):
+    for warning_level, warning_role_id in enumerate(server_config.warning.warning_role_ids):
         # We check if the user has the role
-        if warning_role_id in [str(x.id) for x in target_user.roles]:
+        if warning_role_id in target_user_role_ids:
             target_user_warning_level = warning_level
 
-    # The dict of warning roles
-    warning_role_list = {}
-
-    # We generate a list of all the warning roles, we do this in the correct order aswell
-    for warning_level, warning_role_id in enumerate(config["warning_roles"][message.server.id]["warning_role_ids"]):
-        # We get the role, if it doesn't exist we just let it be None
-        warning_role_list[warning_level] = discord.utils.get(message.server.roles, id=str(warning_role_id))
-
-    # We remove all warning roles from the user
-    await helpers.remove_roles(client, target_user, [warning_role_list[inx] for inx in warning_role_list if
-                                                     isinstance(warning_role_list[inx], discord.Role)])
+    # We remove all warning roles from the user, the roles were resolved from the config in order (the ones that don't exist are None)
+    await helpers.remove_roles(client, target_user, [x for x in server_config.warning_roles if x is not None])
 
     # We check if the user is going to exceed the max warning level
-    if target_user_warning_level == len(config["warning_roles"][message.server.id]["warning_role_ids"]) - 1:
+    if target_user_warning_level == len(server_config.warning.warning_role_ids) - 1:
         # We check if we should kick or ban them
-        if config["warning_roles"][message.server.id]["ban_after_warnings"]:
+        if server_config.warning.ban_after_warnings:
             # We ban them
             await client.ban(target_user, 0)
             # We tell the issuer that we banned them
@@ -127,8 +125,7 @@ async def add_warning(message: discord.Message, client: discord.Client, config:
             return
 
     # We get the role that the target user should get
-    new_warning_role = discord.utils.get(message.server.roles, id=str(
-        config["warning_roles"][message.server.id]["warning_role_ids"][target_user_warning_level + 1]))
+    new_warning_role = server_config.warning_roles[target_user_warning_level + 1]
 
     # We check if the configured warning is valid
     if isinstance(new_warning_role, discord.Role):
@@ -152,12 +149,17 @@ async def add_warning(message: discord.Message, client: discord.Client, config:
                 helpers.log_ob(message.author), helpers.log_ob(target_user), helpers.log_ob(message.server)))
 
 
-@command_decorator.command("unwarn", "Removes a warning from a user. This command can only be used by certain roles.")
-async def remove_warning(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("unwarn", "Removes a warning from a user. This command can only be used by certain roles.",
+                           cost_class="moderation")
+async def remove_warning(message: discord.Message, client: discord.Client, config: dict,
+                         context: command_context.CommandContext):
     """This command is used to remove a warning from a player if they have one"""
 
+    # We get the warning settings of the server, which were compiled from the config once
+    server_config = config_index.get(message.server)
+
     # We check if the server supports warnings
-    if message.server.id not in config["warning_roles"]:
+    if server_config.warning is None:
         # Tell the user that this server doesn't support warnings
         await client.send_message(message.channel,
                                   message.author.mention + ", you can't remove warnings from people on this server because this server has not configured warning roles.")
@@ -169,8 +171,8 @@ async def remove_warning(message: discord.Message, client: discord.Client, confi
         return
 
     # We check if the issuer has one of the authorised roles to add and remove warnings
-    if not (any(i in [str(x.id) for x in message.author.roles] for i in config["warning_roles"][message.server.id][
-        "roles_that_can_warn"]) or message.author == message.server.owner):
+    if not ((not server_config.warning.can_warn_role_ids.isdisjoint(x.id for x in message.author.roles)) or
+            message.author == message.server.owner):
         # We tell the issuer that they are not authorised to add or remove warnings
         await client.send_message(message.channel,
                                   message.author.mention + ", you are not authorised to add or remove warnings from people on this server.")
@@ -182,7 +184,7 @@ async def remove_warning(message: discord.Message, client: discord.Client, confi
         return
 
     # We strip the message of the username, and then we check if it is a valid one
-    username_raw = helpers.remove_anna_mention(client, message.content.strip())[len("unwarn "):].strip()
+    username_raw = context.arguments
 
     # We try to get the user, by getting the one that the issuer mentioned
     target_user = discord.utils.get(message.server.members, mention=username_raw)
@@ -202,8 +204,7 @@ async def remove_warning(message: discord.Message, client: discord.Client, confi
     if (message.author.top_role.position <= target_user.top_role.position) or (
             not helpers.check_add_remove_roles(target_user, message.channel)) or (not (
             message.channel.permissions_for(message.server.me).ban_members if
-            config["warning_roles"][message.server.id][
-                "ban_after_warnings"] else message.channel.permissions_for(message.server.me).kick_members)):
+            server_config.warning.ban_after_warnings else message.channel.permissions_for(message.server.me).kick_members)):
         # We tell the user that we do not have the proper permissions
         await client.send_message(message.channel,
                                   message.author.mention + ", you or I do not have the proper permissions to remove a warning from that player.")
@@ -224,23 +225,15 @@ async def remove_warning(message: discord.Message, client: discord.Client, confi
 
     # We check what warning the target user is on
     target_user_warning_level = -1
+    target_user_role_ids = {x.id for x in target_user.roles}
 
-    for warning_level, warning_role_id in enumerate(config["warning_roles"][message.server.id]["warning_role_ids"]):
+    for warning_level, warning_role_id in enumerate(server_config.warning.warning_role_ids):
         # We check if the user has the role
-        if warning_role_id in [str(x.id) for x in target_user.roles]:
+        if warning_role_id in target_user_role_ids:
             target_user_warning_level = warning_level
 
-    # The dict of warning roles
-    warning_role_list = {}
-
-    # We generate a list of all the warning roles, we do this in the correct order aswell
-    for warning_level, warning_role_id in enumerate(config["warning_roles"][message.server.id]["warning_role_ids"]):
-        # We get the role, if it doesn't exist we just let it be None
-        warning_role_list[warning_level] = discord.utils.get(message.server.roles, id=str(warning_role_id))
-
-    # We remove all warning roles from the user
-    await helpers.remove_roles(client, target_user, [warning_role_list[inx] for inx in warning_role_list if
-                                                     isinstance(warning_role_list[inx], discord.Role)])
+    # We remove all warning roles from the user, the roles were resolved from the config in order (the ones that don't exist are None)
+    await helpers.remove_roles(client, target_user, [x for x in server_config.warning_roles if x is not None])
 
     # We check if the user should get a lower warnings level, or if they now should have 0 warnings
     if target_user_warning_level == 0:
@@ -256,8 +249,7 @@ async def remove_warning(message: discord.Message, client: discord.Client, confi
         return
 
     # We get the role that the target user should get
-    new_warning_role = discord.utils.get(message.server.roles, id=str(
-        config["warning_roles"][message.server.id]["warning_role_ids"][target_user_warning_level - 1]))
+    new_warning_role = server_config.warning_roles[target_user_warning_level - 1]
 
     # We check if the configured warning is valid
     if isinstance(new_warning_role, discord.Role):
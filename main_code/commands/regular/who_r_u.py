@@ -1,10 +1,12 @@
 import discord
 
+from ... import command_context
 from ... import command_decorator
 
 
-@command_decorator.command("whoru", "Use this if you want an explanation as to what anna-bot is.")
-async def who_r_u(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("whoru", "Use this if you want an explanation as to what anna-bot is.", cost_class="light")
+async def who_r_u(message: discord.Message, client: discord.Client, config: dict,
+                  context: command_context.CommandContext):
     """This method is called to handle someone wanting to know who/what anna-bot is."""
 
     # Just sending an explanation back in the same channel as the command was issued in
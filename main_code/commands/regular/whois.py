@@ -1,15 +1,17 @@
 import discord
 
+from ... import command_context
 from ... import command_decorator
 from ... import helpers
 
 
-@command_decorator.command("whois", "Use this to get info about a user.")
-async def whois(message: discord.Message, client: discord.Client, config: dict):
+@command_decorator.command("whois", "Use this to get info about a user.", cost_class="light")
+async def whois(message: discord.Message, client: discord.Client, config: dict,
+                context: command_context.CommandContext):
 	"""This method is called to handle someone wanting to know some info about a user."""
 
 	# We strip the message of the username, and then we check if it is a valid one
-	username_raw = helpers.remove_anna_mention(client, message.content.strip())[len("whois "):].strip()
+	username_raw = context.arguments
 
 	# We try to get the user, by getting the one that the issuer mentioned
 	target_user = discord.utils.get(message.server.members, mention=username_raw)
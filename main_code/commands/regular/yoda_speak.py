@@ -3,19 +3,18 @@ import urllib.parse
 
 import discord
 
+from ... import command_context
 from ... import helpers
 
 
 # TODO Check if this is going to work anytime soon in the future, it's down atm
 # @command_decorator.command("yoda", "Infuses your text with midichlorians.")
-async def yoda_speak(message: discord.Message, client: discord.Client, config: dict):
+async def yoda_speak(message: discord.Message, client: discord.Client, config: dict,
+                     context: command_context.CommandContext):
     """Uses the mashape api here: https://market.mashape.com/ismaelc/yoda-speak to convert the inputted text to yoda-speak."""
 
     # We get the input text
-    if message.channel.is_private:
-        query = message.content[len("yoda "):].strip()
-    else:
-        query = helpers.remove_anna_mention(client, message)[len("yoda "):].strip()
+    query = context.arguments
 
     # We try to get the results from the yoda api
     try:
@@ -0,0 +1,138 @@
+from . import helpers
+
+"""This file handles the per-server lookup tables that are compiled from the config, so the hot paths (joins, leaves, warnings and voice commands)
+don't have to search the raw config lists with int conversions on every event.
+The tables are built from the config at startup and when it's reloaded, and invalid entries are logged and skipped instead of breaking every event.
+The channels and roles of a server are resolved into discord objects the first time the server's config is used, and resolved again after the
+server's roles or channels have been created or deleted."""
+
+
+class WarningConfig:
+    """The warning settings of a server, the role ids that can warn, the warning role ids (in order) and if users are banned (or kicked) at the end."""
+
+    __slots__ = ("can_warn_role_ids", "warning_role_ids", "ban_after_warnings")
+
+    def __init__(self, can_warn_role_ids: frozenset, warning_role_ids: list, ban_after_warnings: bool):
+        self.can_warn_role_ids = can_warn_role_ids
+        self.warning_role_ids = warning_role_ids
+        self.ban_after_warnings = ban_after_warnings
+
+
+class ServerConfig:
+    """The compiled config of a server. The ids come from the config, and the channel and role objects are resolved from them by resolve."""
+
+    __slots__ = ("welcome_channel_ids", "leave_channel_ids", "default_role_id", "warning", "voice_command_role_ids",
+                 "is_resolved", "welcome_channels", "leave_channels", "default_role", "warning_roles")
+
+    def __init__(self):
+        self.welcome_channel_ids = []
+        self.leave_channel_ids = []
+        self.default_role_id = None
+        self.warning = None
+        self.voice_command_role_ids = frozenset()
+
+        self.is_resolved = False
+        self.welcome_channels = []
+        self.leave_channels = []
+        self.default_role = None
+
+        # The warning roles in order, with None for the roles that don't exist on the server
+        self.warning_roles = []
+
+    def resolve(self, server):
+        """Resolves the channel and role ids into the objects of the server, the ones that aren't on the server are left out (or None)."""
+        server_channels = {channel.id: channel for channel in server.channels}
+        server_roles = {role.id: role for role in server.roles}
+
+        self.welcome_channels = [server_channels[x] for x in self.welcome_channel_ids if x in server_channels]
+        self.leave_channels = [server_channels[x] for x in self.leave_channel_ids if x in server_channels]
+        self.default_role = server_roles.get(self.default_role_id)
+        self.warning_roles = [server_roles.get(x) for x in self.warning.warning_role_ids] if self.warning is not None else []
+        self.is_resolved = True
+
+
+# The compiled configs of the servers that have anything configured, with server ids (as strings) as keys
+servers = {}
+
+# The config of servers that don't have anything configured, it never has anything to resolve
+_empty_server_config = ServerConfig()
+_empty_server_config.is_resolved = True
+
+
+def _id_list(values) -> list:
+    """Returns the passed ids as strings (which is how discord.py stores them), raises ValueError if any of them isn't an id."""
+    ids = [str(x) for x in values]
+    if not all(x.isdigit() for x in ids):
+        raise ValueError("{0} is not a list of ids".format(values))
+    return ids
+
+
+def _get_or_create(server_id) -> ServerConfig:
+    return servers.setdefault(str(server_id), ServerConfig())
+
+
+def build(passed_config: dict):
+    """Compiles the lookup tables from the config, this is called at startup and when the config is reloaded."""
+    servers.clear()
+
+    for section, attribute in (("join_msg", "welcome_channel_ids"), ("leave_msg", "leave_channel_ids")):
+        for pair in passed_config[section]["server_and_channel_id_pairs"]:
+            try:
+                server_id, *channel_ids = _id_list(pair)
+            except ValueError as e:
+                helpers.log_warning("Ignoring invalid {0} entry in the config, info: {1}".format(section, e))
+                continue
+
+            # Like before, only the first entry of a server counts
+            server_config = _get_or_create(server_id)
+            if not getattr(server_config, attribute):
+                setattr(server_config, attribute, channel_ids)
+
+    for pair in passed_config["default_role"]["server_and_default_role_id_pairs"]:
+        try:
+            server_id, role_id = _id_list(pair)
+        except ValueError as e:
+            helpers.log_warning("Ignoring invalid default_role entry in the config, info: {0}".format(e))
+            continue
+
+        server_config = _get_or_create(server_id)
+        if server_config.default_role_id is None:
+            server_config.default_role_id = role_id
+
+    for server_id, warning_config in passed_config["warning_roles"].items():
+        try:
+            _get_or_create(server_id).warning = WarningConfig(frozenset(_id_list(warning_config["roles_that_can_warn"])),
+                                                              _id_list(warning_config["warning_role_ids"]),
+                                                              bool(warning_config["ban_after_warnings"]))
+        except (KeyError, TypeError, ValueError) as e:
+            helpers.log_warning("Ignoring invalid warning_roles entry for server {0} in the config, info: {1}".format(server_id, e))
+
+    for server_id, role_ids in passed_config["voice_command_roles"].items():
+        set_voice_command_roles(server_id, role_ids)
+
+
+def set_voice_command_roles(server_id, role_ids: list):
+    """Updates the voice command roles of a server, this is called when they're changed by a command."""
+    try:
+        _get_or_create(server_id).voice_command_role_ids = frozenset(_id_list(role_ids))
+    except ValueError as e:
+        helpers.log_warning("Ignoring invalid voice_command_roles entry for server {0} in the config, info: {1}".format(server_id, e))
+
+
+def get(server) -> ServerConfig:
+    """Returns the compiled config of the server, with its channels and roles resolved."""
+    server_config = servers.get(server.id)
+    if server_config is None:
+        return _empty_server_config
+
+    if not server_config.is_resolved:
+        server_config.resolve(server)
+
+    return server_config
+
+
+def invalidate(server_id: str):
+    """Makes the server's channels and roles get resolved again the next time its config is used."""
+    server_config = servers.get(server_id)
+    if server_config is not None:
+        server_config.is_resolved = False
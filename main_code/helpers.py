@@ -1,49 +1,27 @@
 import asyncio
 import json
-import logging.handlers
+import logging
+import os
 import re
-import smtplib
+import shutil
+import tempfile
 
 import aiohttp
 import async_timeout
 import discord
 
+from . import log_pipeline
+from . import state_store
+
 # Setting up logging with the built in discord.py logger
 logger = logging.getLogger('discord')
 logger.setLevel(logging.INFO)
 
-# We load the log file depending on what log file filename the user has specified in the config
+# We load the log file and email settings from the config, the logger only queues records and the log pipeline writes them out from background threads
 with open("config.json", mode="r", encoding="utf-8") as config_file:
     config = json.load(config_file)
-    handler = logging.handlers.RotatingFileHandler(filename=config["logging"]["log_file_name"], encoding='utf-8',
-                                                   mode='a', maxBytes=2 ** 22,
-                                                   backupCount=0)
-
-# Continuing the logger setup
-handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)s: %(name)s: %(message)s'))
-logger.addHandler(handler)
-
-# We check if the user wants to use email to report errors
-if config["log_config"]["use_email_notifications"]:
-    # We create the SMTP loghandler with the proper settings from the config
-    mail_notification_handler = logging.handlers.SMTPHandler((config["log_config"]["email_settings"]["smtp_server"],
-                                                              config["log_config"]["email_settings"][
-                                                                  "smtp_port"]),
-                                                             config["log_config"]["email_settings"]["from_address"],
-                                                             config["log_config"]["email_settings"]["send_to"],
-                                                             config["log_config"]["email_settings"]["subject"],
-                                                             credentials=(
-                                                                 config["log_config"]["email_settings"]["username"],
-                                                                 config["log_config"]["email_settings"]["password"]),
-                                                             secure=())
-
-    # We change the level so it only sends emails about warnings or errors
-    mail_notification_handler.setLevel(logging.WARNING)
-    # We change the formatter to the formatter we use in the file handler
-    mail_notification_handler.setFormatter(handler.formatter)
-
-    # We add the mail handler to the logger
-    logger.addHandler(mail_notification_handler)
+
+log_pipeline.start(logger, config)
 
 # We compile the regular expressions we will need, for performance
 role_id_regex = re.compile(r'<@&\d+>')
@@ -51,66 +29,46 @@ role_id_regex = re.compile(r'<@&\d+>')
 # The client object
 actual_client = discord.Client(cache_auth=False)
 
+# The custom command prefixes of servers, with server ids as keys and prefixes as values. Servers that aren't in here use the @mention of anna
+# This is loaded from the state store once at startup, and the changed row is written through to it whenever it changes
+configured_prefixes = {}
+
 # Info about the name of the game we're playing. In the format of [Has been changed since last discord update, NAME]
 # If the name is "", this will be interpreted as No game
 playing_game_info = [True, ""]
 
 
-def async_uses_persistent_file(filename: str, write: bool = True):
-    """A decorator for async functions that use some kind of persistent file-backed data.
-    This does not work for function that return more than one value"""
-
-    def decorator(func):
-        async def decorated(*args, **kwargs):
-            with open("persistent_state/" + filename, mode="r", encoding="utf-8") as persistent_file:
-                previous_prefix_config = json.load(persistent_file)
-                result = await func(previous_prefix_config, *args, **kwargs)
-
-            if result is None:
-                result = (previous_prefix_config,)
-
-            if write:
-                with open("persistent_state/" + filename, mode="w", encoding="utf-8") as persistent_file:
-                    json.dump(result[0], persistent_file)
-
-            if len(result) == 2:
-                return result[1]
-
-        return decorated
-
-    return decorator
+def atomic_write_json(filename: str, data, **dump_kwargs):
+    """Writes data as json to a temporary file next to filename, and then renames it over filename.
+    The rename is atomic, so a crash mid-write can never leave a truncated file behind.
+    Every write gets its own temporary file, so writers running at the same time (like two config commands that call write_config back to back) can't publish each other's half-written files."""
 
-
-def sync_uses_persistent_file(filename: str, write: bool = True):
-    """A decorator for sync functions that use some kind of persistent file-backed data.
-    This does not work for function that return more than one value"""
-
-    def decorator(func):
-        def decorated(*args, **kwargs):
-            with open("persistent_state/" + filename, mode="r", encoding="utf-8") as persistent_file:
-                previous_prefix_config = json.load(persistent_file)
-                result = func(previous_prefix_config, *args, **kwargs)
-
-            if result is None:
-                result = (previous_prefix_config,)
-
-            if write:
-                with open("persistent_state/" + filename, mode="w", encoding="utf-8") as persistent_file:
-                    json.dump(result[0], persistent_file)
-
-            if len(result) == 2:
-                return result[1]
-
-        return decorated
-
-    return decorator
+    file_descriptor, temp_filename = tempfile.mkstemp(dir=os.path.dirname(filename) or ".",
+                                                      prefix=os.path.basename(filename) + ".", suffix=".tmp")
+    try:
+        with open(file_descriptor, mode="w", encoding="utf-8") as temp_file:
+            json.dump(data, temp_file, **dump_kwargs)
+
+            # We make sure the data is actually on disk before we replace the old file
+            temp_file.flush()
+            os.fsync(temp_file.fileno())
+
+        # mkstemp creates the file only readable by us, so we keep the permissions of the file we replace
+        if os.path.exists(filename):
+            shutil.copymode(filename, temp_filename)
+
+        os.replace(temp_filename, filename)
+    except BaseException:
+        # We don't leave the temporary file behind if we failed
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
 
 
 def write_config(config_temp: dict):
     """This function writes the passed dict out to the config file as json."""
     # We write the out to the file
-    with open("config.json", mode="w", encoding="utf-8") as config_file_temp:
-        json.dump(config_temp, config_file_temp, indent=2, sort_keys=False)
+    atomic_write_json("config.json", config_temp, indent=2, sort_keys=False)
 
 
 def get_formatted_duration_fromtime(duration_seconds_noformat):
@@ -146,11 +104,9 @@ def get_formatted_duration_fromtime(duration_seconds_noformat):
 
 
 def log_text(text, level):
-    print(text)
+    """Queues the text to be printed and logged, this never waits for the disk or the SMTP server."""
     try:
-        logger.log(level, text)
-    except smtplib.SMTPException as e:
-        print("Got error when trying to send email notification, error message: {0}".format(str(e)))
+        logger.log(level, text, extra={"print_to_console": True})
     except Exception as e:
         print("Got error when trying to log, error message {0}.".format(str(e)))
 
@@ -221,19 +177,41 @@ def check_add_remove_roles(member: discord.Member, channel: discord.Channel) ->
             channel.server.me).manage_roles and member.top_role.position < member.server.me.top_role.position
 
 
-@sync_uses_persistent_file("configured_prefixes.json", write=False)
-def remove_anna_mention(prefix_data: dict, client: discord.Client, message):
+def load_configured_prefixes():
+    """Loads the custom prefixes of all servers from the state store into the in-memory prefix registry. This is done once at startup."""
+    configured_prefixes.clear()
+    configured_prefixes.update(state_store.call(state_store.load_prefixes))
+
+
+def set_server_prefix(server_id: str, prefix):
+    """Sets the custom prefix of a server in the prefix registry and writes the server's row through to the state store (without waiting for it).
+    If prefix is None, the server goes back to using the @mention of anna. The change takes effect immediately."""
+
+    if prefix is None:
+        configured_prefixes.pop(str(server_id), None)
+    else:
+        configured_prefixes[str(server_id)] = prefix
+
+    state_store.submit(state_store.save_prefix, str(server_id), prefix)
+
+
+def get_command_prefix(client: discord.Client, server_id: str) -> str:
+    """Returns the prefix that commands on the passed server start with, this is the custom prefix if the server has one, else the @mention of anna."""
+    return configured_prefixes.get(str(server_id), client.user.mention[:2] + "!" + client.user.mention[2:])
+
+
+def remove_anna_mention(client: discord.Client, message):
     """This function is used to remove the first part of an anna message so that the command code can more easily parse the command"""
 
+    # The weird mention for the bot user (mention code starts with an exclamation mark instead of just the user ID)
+    client_mention = client.user.mention[:2] + "!" + client.user.mention[2:]
+
     # We only use the advanced behaviour for when the given message is a message object
     if isinstance(message, discord.Message):
         # We check if the server uses custom prefix, and if it doesn't use custom, we use the regular parsing.
-        client_mention = prefix_data.get(str(message.server.id), client.user.mention[:2] + "!" + client.user.mention[2:])
-    else:
-        client_mention = client.user.mention[:2] + "!" + client.user.mention[2:]
+        if message.server is not None:
+            client_mention = configured_prefixes.get(str(message.server.id), client_mention)
 
-    # We check if the input is a message or just a string
-    if isinstance(message, discord.Message):
         content = message.content
     else:
         content = message
@@ -246,19 +224,38 @@ def remove_anna_mention(prefix_data: dict, client: discord.Client, message):
         # Removing the anna bot mention in the message so we can parse the arguments more easily
         cleaned_message = content.lstrip()[len(client.user.mention) + 1:]
 
-    return prefix_data, cleaned_message
+    return cleaned_message
 
 
-@sync_uses_persistent_file("configured_prefixes.json", write=False)
-def is_message_command(prefix_data: dict, message: discord.Message, client: discord.Client):
+def is_message_command(message: discord.Message, client: discord.Client):
     """This function is used to check whether a message is trying to issue an anna-bot command"""
 
-    # We check if the server uses custom prefix, and if it doesn't use custom, we use the regular parsing.
-    client_mention = prefix_data.get(str(message.server.id), client.user.mention[:2] + "!" + client.user.mention[2:])
+    stripped_content = message.content.lower().strip()
+
+    # We check if the server uses custom prefix, and if it does, only that prefix is allowed
+    custom_prefix = configured_prefixes.get(str(message.server.id))
+    if custom_prefix is not None:
+        return stripped_content.startswith(custom_prefix)
 
     # We return if the message is a command or not
-    return prefix_data, (message.content.lower().strip().startswith(client_mention) or message.content.lower().strip().startswith(
-            client.user.mention)) if str(message.server.id) not in prefix_data else message.content.lower().strip().startswith(client_mention)
+    return stripped_content.startswith(client.user.mention[:2] + "!" + client.user.mention[2:]) or stripped_content.startswith(
+        client.user.mention)
+
+
+def claim_accepted_messages(check, ignored_message_ids):
+    """Wraps a client.wait_for_message check so every message it accepts is added to ignored_message_ids (an ignored_messages.IgnoredMessageRegistry) right away.
+    discord.py evaluates wait_for_message checks before it dispatches on_message for the same message,
+    so the claim is always in place by the time command dispatch looks at the message."""
+
+    def claiming_check(message: discord.Message):
+        # We run the real check, and claim the message if it accepted it
+        accepted = check(message)
+        if accepted:
+            ignored_message_ids.add(message.id)
+
+        return accepted
+
+    return claiming_check
 
 
 def remove_discord_formatting(*strings):
@@ -0,0 +1,65 @@
+import collections
+import time
+
+"""This file defines the registry of message ids that command dispatch should ignore (answers to questions that commands asked)."""
+
+
+class IgnoredMessageRegistry:
+    """A bounded registry of message ids, where every id expires after ttl_seconds.
+    The ids are kept in an OrderedDict in the order they were added (which is also the order they expire in, as they all have the same ttl),
+    so membership checks are O(1) and expiring old ids only ever looks at the oldest ones.
+    If more than max_size ids are registered, the oldest ones are evicted."""
+
+    def __init__(self, ttl_seconds: float = 300, max_size: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+
+        # The registered message ids, with the time they expire at as values
+        self.expiry_times = collections.OrderedDict()
+
+        # Metrics about how the registry is used
+        self.metrics = {"added": 0, "hits": 0, "expired": 0, "evicted": 0}
+
+    def __len__(self):
+        return len(self.expiry_times)
+
+    def __contains__(self, message_id: str):
+        expiry_time = self.expiry_times.get(message_id)
+        return expiry_time is not None and expiry_time > time.monotonic()
+
+    def add(self, message_id: str):
+        """Registers a message id to be ignored, this is what claiming a message does."""
+        now = time.monotonic()
+        self._expire(now)
+
+        # We re-add ids that are already registered so they end up last in the expiry order
+        self.expiry_times.pop(message_id, None)
+        self.expiry_times[message_id] = now + self.ttl_seconds
+        self.metrics["added"] += 1
+
+        # We evict the oldest ids if we have too many
+        while len(self.expiry_times) > self.max_size:
+            self.expiry_times.popitem(last=False)
+            self.metrics["evicted"] += 1
+
+    def pop(self, message_id: str) -> bool:
+        """Removes a message id from the registry, returns True if it was registered (and hadn't expired), False otherwise."""
+        now = time.monotonic()
+        self._expire(now)
+
+        if self.expiry_times.pop(message_id, None) is None:
+            return False
+
+        self.metrics["hits"] += 1
+        return True
+
+    def _expire(self, now: float):
+        """Removes all the ids that have expired, these are always the oldest ones."""
+        while self.expiry_times:
+            # We peek at the oldest id
+            message_id, expiry_time = next(iter(self.expiry_times.items()))
+            if expiry_time > now:
+                return
+
+            del self.expiry_times[message_id]
+            self.metrics["expired"] += 1
@@ -0,0 +1,116 @@
+import asyncio
+import time
+import traceback
+
+from . import helpers
+
+"""This file handles running the join hooks (the functions that are called when someone joins a server).
+Every hook runs as its own supervised task, so a slow hook (like the referral asker, which waits minutes for an answer) doesn't hold the others up,
+and an error in one hook is logged without affecting the others. The time every hook takes is recorded.
+It also has the batchers that the welcome message and default role hooks use, so a raid or a big invite wave results in one welcome message per
+channel and one pass of permission checks per server per interval, instead of one of each per joining member."""
+
+# The default settings, these can be overridden by the join_pipeline section of the config
+default_settings = {
+    # How long (in seconds) the batchers collect joining members before they handle them, this is also the wait that makes sure the members have actually joined
+    "welcome_interval_seconds": 2, "default_role_interval_seconds": 1
+}
+settings = dict(default_settings)
+
+# The hook tasks that are running
+running_tasks = set()
+
+# The metrics of every hook, with the hook names as keys
+hook_metrics = {}
+
+
+def configure(passed_config: dict):
+    """Loads the join pipeline settings from the config, this is called at startup and when the config is reloaded."""
+    settings.clear()
+    settings.update(default_settings)
+    settings.update(passed_config.get("join_pipeline", {}))
+
+
+def _spawn(coroutine):
+    """Runs the coroutine as a tracked task, so it can be cancelled when we shut down."""
+    task = asyncio.ensure_future(coroutine)
+    running_tasks.add(task)
+    task.add_done_callback(running_tasks.discard)
+
+
+async def _supervise(name: str, coroutine):
+    """Runs the coroutine, records how long it took, and logs (instead of propagating) any error it raises."""
+    metrics = hook_metrics.setdefault(name, {"calls": 0, "failures": 0, "total_seconds": 0., "max_seconds": 0.})
+    metrics["calls"] += 1
+    start = time.monotonic()
+
+    try:
+        await coroutine
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        metrics["failures"] += 1
+        helpers.log_error("Ignoring exception in join hook {0}, more info:\n{1}".format(name, "".join(
+            ["    " + entry for entry in traceback.format_exc().splitlines(True)])))
+    finally:
+        duration = time.monotonic() - start
+        metrics["total_seconds"] += duration
+        metrics["max_seconds"] = max(metrics["max_seconds"], duration)
+
+
+def spawn_supervised(name: str, coroutine):
+    """Runs the coroutine as a supervised task, with its timing and errors recorded under name."""
+    _spawn(_supervise(name, coroutine))
+
+
+def run_hooks(member, hooks: list):
+    """Starts every hook as an independent supervised task, and passes them the member who joined."""
+    for hook in hooks:
+        spawn_supervised(hook.__name__, hook(member))
+
+
+class KeyedBatcher:
+    """Collects items under keys, and interval_seconds after the first item for a key arrived, passes all the items of that key to flush_function
+    (a coroutine function that takes the key and the list of items), which runs as a supervised task."""
+
+    __slots__ = ("name", "flush_function", "pending", "metrics")
+
+    def __init__(self, name: str, flush_function):
+        self.name = name
+        self.flush_function = flush_function
+
+        # The items that are waiting to be flushed, in the format of {key: [item, ...]}
+        self.pending = {}
+
+        self.metrics = {"items": 0, "batches": 0}
+
+    def add(self, key, item, loop: asyncio.AbstractEventLoop):
+        """Adds an item under the key, and schedules a flush of the key if there isn't one yet."""
+        self.metrics["items"] += 1
+
+        items = self.pending.get(key)
+        if items is None:
+            self.pending[key] = [item]
+            loop.call_later(settings[self.name + "_interval_seconds"], self._flush, key)
+        else:
+            items.append(item)
+
+    def _flush(self, key):
+        """Passes the items of the key to the flush function."""
+        items = self.pending.pop(key, None)
+        if items:
+            self.metrics["batches"] += 1
+            spawn_supervised(self.name, self.flush_function(key, items))
+
+
+def cancel_all(loop: asyncio.AbstractEventLoop) -> list:
+    """Cancels all the running hook tasks, this is called when we shut down. Returns the tasks that were cancelled."""
+    # We can't cancel tasks of a loop that has already been closed
+    if loop.is_closed():
+        return []
+
+    cancelled_tasks = list(running_tasks)
+    for task in cancelled_tasks:
+        task.cancel()
+
+    return cancelled_tasks
@@ -0,0 +1,139 @@
+import collections
+import time
+
+"""This file handles the last seen times of users who have gone offline, which are sent to the webserver (anna-falcon-server).
+The records are kept in dicts keyed by server id and user id, so a presence update is a couple of dict operations no matter how many servers and users there are.
+The json view that the webserver expects is only built when the data is exported.
+Every change is also recorded in a journal, so the webserver can be sent only what changed since the last version it acknowledged (see last_seen_sync)."""
+
+
+class LastSeenRecord:
+    """The last seen info about a user on a server. last_seen is the epoch time (in whole seconds) at which the user went offline."""
+
+    __slots__ = ("username", "icon_url", "last_seen")
+
+    def __init__(self, username: str, icon_url: str, last_seen: int):
+        self.username = username
+        self.icon_url = icon_url
+        self.last_seen = last_seen
+
+
+# The records of the users who are offline, in the format of {server id: {user id: LastSeenRecord}}
+servers = {}
+
+# The version of the records, which goes up by one with every change
+version = 0
+
+# The version each server's records were last changed at, with server ids as keys, this is what the pull server's etags are made from
+server_versions = {}
+
+# The changes that the webserver hasn't acknowledged yet, in the order they were made, in the format of {(server id, user id): (version, username)}.
+# A key is moved to the end when it changes again, so a user that flaps between online and offline only appears once
+journal = collections.OrderedDict()
+
+# If the journal gets bigger than this, a full snapshot is cheaper than a delta, so we drop the journal and ask for a snapshot instead
+max_journal_size = 50000
+
+# If the journal has been dropped since the last snapshot was acknowledged, in which case the webserver needs a full snapshot
+journal_overflowed = False
+
+
+def _record_change(server_id: str, user_id: str, username: str):
+    """Bumps the version and records that the user's record on the server changed."""
+    global version, journal_overflowed
+    version += 1
+    server_versions[server_id] = version
+
+    key = (server_id, user_id)
+    journal.pop(key, None)
+    journal[key] = (version, username)
+
+    if len(journal) > max_journal_size:
+        journal.clear()
+        journal_overflowed = True
+
+
+def mark_offline(server_id: str, user_id: str, username: str, icon_url: str, last_seen_time: int = None):
+    """Records that the user went offline on the server at last_seen_time (epoch seconds), or just now if it isn't passed."""
+    servers.setdefault(server_id, {})[user_id] = LastSeenRecord(username, icon_url,
+                                                                int(time.time()) if last_seen_time is None else last_seen_time)
+    _record_change(server_id, user_id, username)
+
+
+def mark_online(server_id: str, user_id: str):
+    """Removes the record of the user on the server, since the user is online again."""
+    server_records = servers.get(server_id)
+    if server_records is None:
+        # We tried to remove from something that doesn't exist
+        return
+
+    record = server_records.pop(user_id, None)
+
+    # We remove the whole server entry if there are no users left in it
+    if not server_records:
+        del servers[server_id]
+
+    # We only journal removals of records that existed, so users who were never seen going offline don't cost anything
+    if record is not None:
+        _record_change(server_id, user_id, record.username)
+
+
+def record_to_json(record: LastSeenRecord) -> dict:
+    """Returns the json view of a record, in the format that the webserver expects."""
+    return {"username": record.username, "icon_url": record.icon_url,
+            "last_seen_time": time.asctime(time.gmtime(record.last_seen))}
+
+
+def export(auth_token: str) -> dict:
+    """Returns the json view of all the records (a full snapshot), in the format that the webserver expects, along with the version it is of."""
+    return {"servers": [{"server_id": server_id,
+                         "users": [dict(record_to_json(record), user_id=user_id) for user_id, record in server_records.items()]}
+                        for server_id, server_records in servers.items()],
+            "version": version,
+            "auth_token": auth_token}
+
+
+def export_changes(auth_token: str, base_version: int):
+    """Returns the json view of the changes since base_version (a delta), with the records that were added or updated as upserts and the removed ones as deletes.
+    Returns None if the journal can't produce the delta (it overflowed), in which case a full snapshot has to be sent instead."""
+    if journal_overflowed:
+        return None
+
+    upserts = []
+    deletes = []
+
+    # The journal only holds unacknowledged changes, so this is proportional to the churn and not to the number of records
+    for (server_id, user_id), (change_version, username) in journal.items():
+        if change_version <= base_version:
+            continue
+
+        record = servers.get(server_id, {}).get(user_id)
+        if record is None:
+            deletes.append({"server_id": server_id, "user_id": user_id, "username": username})
+        else:
+            upserts.append(dict(record_to_json(record), server_id=server_id, user_id=user_id))
+
+    return {"base_version": base_version, "version": version, "upserts": upserts, "deletes": deletes,
+            "auth_token": auth_token}
+
+
+def has_changes_since(base_version: int) -> bool:
+    """Returns True if anything changed after base_version."""
+    return version > base_version
+
+
+def acknowledge(acknowledged_version: int, was_snapshot: bool):
+    """Drops the journal entries that the webserver has acknowledged, they are always the oldest ones.
+    If the acknowledged payload was a full snapshot, the journal can produce deltas again."""
+    global journal_overflowed
+
+    while journal:
+        # We peek at the oldest change
+        key, (change_version, _) = next(iter(journal.items()))
+        if change_version > acknowledged_version:
+            break
+
+        del journal[key]
+
+    if was_snapshot:
+        journal_overflowed = False
@@ -0,0 +1,122 @@
+import json
+
+from aiohttp import web
+
+from . import helpers
+from . import last_seen
+
+"""This file handles the optional pull server, an aiohttp server that runs in the bot's event loop and serves the last seen records of each server,
+as an alternative to pushing them to anna-falcon-server.
+    GET /lastseen/<server id>?page=<page>&per_page=<page size>
+with the auth token of the webserver_config in an "Authorization: Bearer <token>" header, returns the records of the server, the most recently seen first.
+Every response has an etag made from the version the server's records were last changed at, so pollers that send it back in If-None-Match get
+an empty 304 until something changes. The pages are serialized once per version and served from a cache after that.
+Pages past the last one get a 404, and only pages that exist (of servers that have records) are cached, so pollers can't grow the cache without bound."""
+
+# The default and max number of records in a page
+default_page_size = 100
+max_page_size = 1000
+
+# The serialized pages, in the format of {server id: (version, records sorted by last seen time, {(page, page size): body})}
+_page_cache = {}
+
+# The running server, None if the pull server isn't running
+_server = None
+
+# Metrics about the requests
+metrics = {"ok": 0, "not_modified": 0, "unauthorized": 0, "bad_request": 0, "not_found": 0}
+
+
+def _get_sorted_records(server_id: str, server_version: int) -> tuple:
+    """Returns the cache entry of the server, rebuilding it if the server's records have changed since it was built."""
+    cache_entry = _page_cache.get(server_id)
+
+    if cache_entry is None or cache_entry[0] != server_version:
+        server_records = last_seen.servers.get(server_id, {})
+        sorted_records = sorted(server_records.items(), key=lambda item: item[1].last_seen, reverse=True)
+        cache_entry = _page_cache[server_id] = (server_version, sorted_records, {})
+
+    return cache_entry
+
+
+def _serialize_page(server_id: str, server_version: int, sorted_records: list, page: int, page_size: int) -> bytes:
+    """Serializes a page of the server's sorted records, along with the version and the total number of records."""
+    page_records = sorted_records[page * page_size:(page + 1) * page_size]
+    return json.dumps({
+        "server_id": server_id, "version": server_version, "page": page, "per_page": page_size,
+        "total": len(sorted_records),
+        "users": [dict(last_seen.record_to_json(record), user_id=user_id) for user_id, record in page_records]
+    }).encode("utf-8")
+
+
+def _get_page_body(server_id: str, page: int, page_size: int):
+    """Returns the etag of the server's records and the serialized page, or None if the page is past the last one (the first page always exists)."""
+    server_version = last_seen.server_versions.get(server_id, 0)
+
+    if server_id not in last_seen.servers:
+        # The server doesn't have any records (anymore), so we serve its empty first page without caching anything for it
+        _page_cache.pop(server_id, None)
+        return ('"{0}"'.format(server_version), _serialize_page(server_id, server_version, [], page, page_size)) if page == 0 else None
+
+    _, sorted_records, page_bodies = _get_sorted_records(server_id, server_version)
+    if page > 0 and page * page_size >= len(sorted_records):
+        return None
+
+    body = page_bodies.get((page, page_size))
+    if body is None:
+        body = page_bodies[(page, page_size)] = _serialize_page(server_id, server_version, sorted_records, page, page_size)
+
+    return '"{0}"'.format(server_version), body
+
+
+def make_app(auth_token: str, loop) -> web.Application:
+    """Creates the aiohttp application of the pull server."""
+
+    async def handle_last_seen(request: web.Request):
+        if request.headers.get("Authorization") != "Bearer " + auth_token:
+            metrics["unauthorized"] += 1
+            return web.Response(status=401)
+
+        try:
+            page = int(request.rel_url.query.get("page", 0))
+            page_size = int(request.rel_url.query.get("per_page", default_page_size))
+        except ValueError:
+            page = -1
+            page_size = 0
+
+        if page < 0 or not 0 < page_size <= max_page_size:
+            metrics["bad_request"] += 1
+            return web.Response(status=400, text="page has to be 0 or more and per_page between 1 and {0}.".format(max_page_size))
+
+        page_body = _get_page_body(request.match_info["server_id"], page, page_size)
+        if page_body is None:
+            metrics["not_found"] += 1
+            return web.Response(status=404, text="page is past the last page.")
+
+        etag, body = page_body
+
+        # The poller already has this version, so it doesn't need the body again
+        if request.headers.get("If-None-Match") == etag:
+            metrics["not_modified"] += 1
+            return web.Response(status=304, headers={"ETag": etag})
+
+        metrics["ok"] += 1
+        return web.Response(body=body, content_type="application/json", headers={"ETag": etag})
+
+    app = web.Application(loop=loop)
+    app.router.add_get("/lastseen/{server_id}", handle_last_seen)
+    return app
+
+
+async def start(host: str, port: int, auth_token: str, loop):
+    """Starts the pull server in the passed event loop, it shares the loop with discord so requests never block dispatch for longer than a dict lookup
+    (or a page serialization, once per version)."""
+    global _server
+
+    if _server is not None:
+        return
+
+    _server = await loop.create_server(make_app(auth_token, loop).make_handler(), host, port)
+
+    helpers.log_info("Started the last seen pull server on {0}:{1}.".format(host, port))
+
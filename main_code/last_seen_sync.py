@@ -0,0 +1,146 @@
+import asyncio
+import gzip
+import json
+
+import aiohttp
+import async_timeout
+
+from . import helpers
+from . import last_seen
+
+"""This file handles sending the last seen records to the webserver (anna-falcon-server).
+On first contact (and whenever the webserver asks for a resync) we post a full snapshot to /lastseen, after that we only post the changes since the
+last version the webserver acknowledged to /lastseen/delta, so the payload size and the cpu time spent on it follow the churn and not the number of users.
+The webserver acknowledges a payload by answering with 200 and {"version": <the version it now has>}, and asks for a full snapshot by answering with 409.
+If the delta endpoint doesn't exist (404, an older webserver), we fall back to posting full snapshots.
+If the webserver doesn't acknowledge a snapshot with a version (an older webserver, which takes plain json on /lastseen and answers with an empty 200),
+we fall back to what we did before the deltas, posting uncompressed full snapshots, and take a 200 as the snapshot being accepted.
+The payloads are gzipped (unless we've fallen back), and we keep one keep-alive session for as long as the task runs instead of opening a new connection for every post."""
+
+# The version of the records that the webserver has acknowledged, None if it needs a full snapshot
+acknowledged_version = None
+
+# If the webserver supports the delta endpoint
+delta_supported = True
+
+# If the webserver is an older one that doesn't acknowledge versions, in which case we post uncompressed full snapshots
+is_legacy_webserver = False
+
+# Metrics about the posts
+metrics = {"snapshots": 0, "deltas": 0, "skipped": 0, "failed": 0, "resyncs": 0, "bytes_raw": 0, "bytes_sent": 0}
+
+
+def encode_payload(payload: dict, compress: bool) -> tuple:
+    """Serializes and (if compress is True) gzips a payload, this runs in an executor since a full snapshot can be big.
+    Returns the size of the serialized payload and the body."""
+    raw = json.dumps(payload).encode("utf-8")
+    return len(raw), gzip.compress(raw) if compress else raw
+
+
+def get_acknowledged_version(body: str):
+    """Returns the version that the webserver acknowledged in the body of its 200 answer, or None if it didn't answer with one (an older webserver)."""
+    try:
+        acknowledgement = json.loads(body)
+    except ValueError:
+        return None
+
+    return acknowledgement.get("version") if isinstance(acknowledgement, dict) else None
+
+
+async def post_changes(session: aiohttp.ClientSession, base_url: str, auth_token: str, timeout: float,
+                       loop: asyncio.AbstractEventLoop):
+    """Posts a full snapshot or a delta to the webserver, depending on what it has acknowledged, and records what it acknowledges."""
+    global acknowledged_version, delta_supported, is_legacy_webserver
+
+    # We build the payload on the loop, so it's a consistent view of the records
+    payload = None
+    if acknowledged_version is not None:
+        if not last_seen.has_changes_since(acknowledged_version):
+            # There's nothing new, so we don't post anything
+            metrics["skipped"] += 1
+            return
+
+        if delta_supported:
+            payload = last_seen.export_changes(auth_token, acknowledged_version)
+
+    is_snapshot = payload is None
+    if is_snapshot:
+        payload = last_seen.export(auth_token)
+
+    # The records are already converted to json views, so they can be serialized off the loop
+    compress = not is_legacy_webserver
+    raw_size, body = await loop.run_in_executor(None, encode_payload, payload, compress)
+
+    headers = {"Content-Type": "application/json"}
+    if compress:
+        headers["Content-Encoding"] = "gzip"
+
+    with async_timeout.timeout(timeout, loop=loop):
+        async with session.post(base_url + ("/lastseen" if is_snapshot else "/lastseen/delta"), data=body,
+                                headers=headers) as response:
+            if response.status == 200:
+                version = get_acknowledged_version(await response.text())
+                if version is None:
+                    # An older webserver accepts the snapshot without telling us a version, so we take it as having the version we sent
+                    version = payload["version"]
+                    if is_snapshot and not is_legacy_webserver:
+                        helpers.log_info("The webserver doesn't acknowledge last seen versions, falling back to uncompressed full snapshots.")
+                        is_legacy_webserver = True
+                        delta_supported = False
+
+                # We record what the webserver has, and drop the journal entries it doesn't need anymore
+                acknowledged_version = version
+                last_seen.acknowledge(acknowledged_version, is_snapshot)
+            elif response.status == 409:
+                # The webserver lost track of the versions (or restarted), so it needs a full snapshot
+                acknowledged_version = None
+                metrics["resyncs"] += 1
+            elif response.status == 404 and not is_snapshot:
+                # The delta wasn't applied, so the next post is a full snapshot of everything (if anything changed since the acknowledged version)
+                helpers.log_info("The webserver doesn't support last seen deltas, falling back to full snapshots.")
+                delta_supported = False
+                return
+            elif is_snapshot and not is_legacy_webserver:
+                # An older webserver can't read a gzipped snapshot, so the next one is sent uncompressed, like it was before the deltas
+                metrics["failed"] += 1
+                helpers.log_info("Got status {0} when sending a gzipped last seen snapshot to the webserver, "
+                                 "falling back to uncompressed full snapshots.".format(response.status))
+                is_legacy_webserver = True
+                delta_supported = False
+                return
+            else:
+                metrics["failed"] += 1
+                helpers.log_info("Got status {0} when sending last seen data to the webserver.".format(response.status))
+                return
+
+    metrics["snapshots" if is_snapshot else "deltas"] += 1
+    metrics["bytes_raw"] += raw_size
+    metrics["bytes_sent"] += len(body)
+
+    helpers.log_info("Sent last seen {0} ({1} bytes{2}) to the webserver.".format(
+        "snapshot" if is_snapshot else "delta of {0} upserts and {1} deletes".format(len(payload["upserts"]),
+                                                                                    len(payload["deletes"])),
+        len(body), " gzipped" if compress else ""))
+
+
+async def sync_loop(server_address: str, server_port: int, auth_token: str, interval: int,
+                    loop: asyncio.AbstractEventLoop):
+    """Posts the last seen changes to the webserver every interval seconds, over a single keep-alive session."""
+    base_url = "http://" + server_address + ":{0}".format(server_port)
+
+    # The connection is kept alive for longer than the interval, so it's reused by every post
+    async with aiohttp.ClientSession(loop=loop, connector=aiohttp.TCPConnector(verify_ssl=False, limit=1, loop=loop,
+                                                                               keepalive_timeout=interval * 2)) as session:
+        # This runs forever (until the bot exits)
+        while True:
+            try:
+                await post_changes(session, base_url, auth_token, interval / 2, loop)
+            except asyncio.CancelledError:
+                raise
+            except (asyncio.TimeoutError, aiohttp.ClientError, ValueError) as e:
+                # The journal is kept until it's acknowledged, so the changes are just sent with the next post
+                metrics["failed"] += 1
+                helpers.log_info("Got error when trying to send data to webserver, info: \n{0}".format(e))
+
+            # We wait until the next time we're supposed to send the info.
+            await asyncio.sleep(interval)
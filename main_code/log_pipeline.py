@@ -0,0 +1,252 @@
+import email.message
+import email.utils
+import logging.handlers
+import queue
+import smtplib
+import sys
+import threading
+import time
+
+"""This file handles getting log records off the event loop.
+Logging calls only put the record on a queue, and background threads do the slow parts (writing to the log file, printing and sending alert emails),
+so a slow disk or SMTP server never stalls the event loop (and with it the gateway heartbeat)."""
+
+# The max number of records that can wait in the queue, if the writer thread falls this far behind we drop records instead of blocking the caller
+max_queued_records = 10000
+
+# The max number of records that the writer thread writes to the log file before it flushes it
+max_batch_size = 256
+
+# The thread that writes the queued records, and the thread that sends the alert emails
+listener = None
+alert_sink = None
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """A QueueHandler that never blocks. If the queue is full, the record is counted as dropped instead."""
+
+    def __init__(self, record_queue: queue.Queue):
+        super().__init__(record_queue)
+
+        # The number of records we have dropped since the last time the writer thread reported it
+        self.dropped_records = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped_records += 1
+
+
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """A RotatingFileHandler that can write a batch of records and flush the file once, instead of flushing after every record."""
+
+    def emit_batch(self, records: list):
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+
+            for record in records:
+                try:
+                    # We check if the file should be rotated before every record, just like the regular handler does
+                    if self.shouldRollover(record):
+                        self.stream.flush()
+                        self.doRollover()
+
+                    self.stream.write(self.format(record) + self.terminator)
+                except Exception:
+                    self.handleError(record)
+
+            self.stream.flush()
+        finally:
+            self.release()
+
+
+class EmailAlertSink(logging.Handler):
+    """A handler that sends the records it gets as alert emails from its own thread.
+    It sends at most one email every min_interval_seconds, so records that arrive in between are sent together in one digest email.
+    The number of waiting records is bounded, records that don't fit are only counted, and the count is included in the next email."""
+
+    def __init__(self, email_settings: dict, min_interval_seconds: float = 300, max_pending_records: int = 100):
+        super().__init__(logging.WARNING)
+        self.email_settings = email_settings
+        self.min_interval_seconds = min_interval_seconds
+        self.max_pending_records = max_pending_records
+
+        # The formatted records that haven't been sent yet, and the number of records that didn't fit
+        self.pending = []
+        self.dropped = 0
+
+        # The condition the sender thread waits on, and if we're stopping
+        self.condition = threading.Condition()
+        self.stopping = False
+
+        self.thread = threading.Thread(target=self._run, name="email-alert-sink", daemon=True)
+        self.thread.start()
+
+    def emit(self, record: logging.LogRecord):
+        # This is called from the writer thread, so we only have to hand the record over to the sender thread
+        with self.condition:
+            if len(self.pending) < self.max_pending_records:
+                self.pending.append(self.format(record))
+            else:
+                self.dropped += 1
+
+            self.condition.notify()
+
+    def close(self):
+        # We wake up the sender thread so it sends what's left and exits
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+
+        self.thread.join(timeout=30)
+        super().close()
+
+    def _run(self):
+        # The time at which we sent the last email
+        last_sent_time = 0.
+
+        while True:
+            with self.condition:
+                # We wait until there's something to send
+                while not (self.pending or self.dropped or self.stopping):
+                    self.condition.wait()
+
+                # We wait until we're allowed to send again (unless we're stopping), records that arrive while we wait end up in the same email
+                while not self.stopping and time.time() - last_sent_time < self.min_interval_seconds:
+                    self.condition.wait(self.min_interval_seconds - (time.time() - last_sent_time))
+
+                records, dropped = self.pending, self.dropped
+                self.pending, self.dropped = [], 0
+                stopping = self.stopping
+
+            if records or dropped:
+                try:
+                    self._send(records, dropped)
+                except Exception as e:
+                    # We can't log this through the logger, as that would just queue another alert
+                    print("Got error when trying to send email notification, error message: {0}".format(str(e)))
+
+                last_sent_time = time.time()
+
+            if stopping:
+                return
+
+    def _send(self, records: list, dropped: int):
+        """Sends one email with all the passed records. This blocks, so it's only ever called from the sender thread."""
+        body = "\n".join(records)
+        if dropped:
+            body += "\n\n{0} more record(s) were not included because too many were logged at once.".format(dropped)
+
+        mail = email.message.EmailMessage()
+        mail["From"] = self.email_settings["from_address"]
+        mail["To"] = ", ".join(self.email_settings["send_to"])
+        mail["Subject"] = self.email_settings["subject"]
+        mail["Date"] = email.utils.localtime()
+        mail.set_content(body)
+
+        with smtplib.SMTP(self.email_settings["smtp_server"], self.email_settings["smtp_port"], timeout=30) as smtp:
+            smtp.starttls()
+            smtp.login(self.email_settings["username"], self.email_settings["password"])
+            smtp.send_message(mail)
+
+
+class BatchingQueueListener(threading.Thread):
+    """The thread that takes the records off the queue. It writes them in batches to the file handler, prints the ones that should be printed,
+    and hands warnings and errors to the alert sink (if there is one)."""
+
+    def __init__(self, record_queue: queue.Queue, queue_handler: DroppingQueueHandler,
+                 file_handler: BatchedRotatingFileHandler, alert_handler=None):
+        super().__init__(name="log-writer", daemon=True)
+        self.record_queue = record_queue
+        self.queue_handler = queue_handler
+        self.file_handler = file_handler
+        self.alert_handler = alert_handler
+
+    def stop(self):
+        """Tells the thread to write everything that has been queued and exit, and waits for it to do so."""
+        # We block here if we have to, as we want to make sure the sentinel gets in the queue
+        self.record_queue.put(None)
+        self.join(timeout=30)
+
+    def run(self):
+        while True:
+            # We wait for a record, and then take everything else that's already queued (up to the batch size)
+            batch = [self.record_queue.get()]
+            while batch[-1] is not None and len(batch) < max_batch_size:
+                try:
+                    batch.append(self.record_queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is None
+            if stopping:
+                batch.pop()
+
+            # We tell the log about records that didn't fit in the queue
+            if self.queue_handler.dropped_records:
+                dropped_records, self.queue_handler.dropped_records = self.queue_handler.dropped_records, 0
+                batch.append(logging.makeLogRecord(
+                    {"name": "discord", "levelno": logging.WARNING, "levelname": "WARNING",
+                     "msg": "Dropped {0} log record(s) because the log queue was full.".format(dropped_records)}))
+
+            self._handle_batch(batch)
+
+            if stopping:
+                return
+
+    def _handle_batch(self, batch: list):
+        # The records that were logged through helpers.log_text are printed, just like they were before
+        for record in batch:
+            if getattr(record, "print_to_console", False):
+                print(record.getMessage())
+
+        # We write the whole batch to the file and flush it once
+        self.file_handler.emit_batch(batch)
+
+        # We hand the warnings and errors over to the alert sink
+        if self.alert_handler is not None:
+            for record in batch:
+                if record.levelno >= self.alert_handler.level:
+                    self.alert_handler.handle(record)
+
+        sys.stdout.flush()
+
+
+def start(logger: logging.Logger, passed_config: dict):
+    """Sets up the logger to only queue records, and starts the threads that handle the queued records."""
+    global listener
+    global alert_sink
+
+    record_queue = queue.Queue(max_queued_records)
+    queue_handler = DroppingQueueHandler(record_queue)
+
+    # The log file, which is rotated when it gets too big
+    file_handler = BatchedRotatingFileHandler(filename=passed_config["logging"]["log_file_name"], encoding='utf-8',
+                                              mode='a', maxBytes=2 ** 22, backupCount=0)
+    file_handler.setFormatter(logging.Formatter('%(asctime)s: %(levelname)s: %(name)s: %(message)s'))
+
+    # We check if the user wants to use email to report errors
+    if passed_config["log_config"]["use_email_notifications"]:
+        email_settings = passed_config["log_config"]["email_settings"]
+        alert_sink = EmailAlertSink(email_settings, email_settings.get("min_interval_seconds", 300))
+
+        # We use the same formatter as the file handler
+        alert_sink.setFormatter(file_handler.formatter)
+
+    listener = BatchingQueueListener(record_queue, queue_handler, file_handler, alert_sink)
+    listener.start()
+
+    logger.addHandler(queue_handler)
+
+
+def stop():
+    """Writes out all the queued records, sends the pending alerts and stops the threads. This blocks, so it should only be called on exit."""
+    if listener is not None:
+        listener.stop()
+        listener.file_handler.close()
+
+    if alert_sink is not None:
+        alert_sink.close()
@@ -0,0 +1,85 @@
+import asyncio
+import time
+
+from . import last_seen
+
+"""This file coalesces presence transitions before they reach the last seen records.
+A user who shares many servers with anna produces one on_member_update per server for a single status change, so instead of doing the last seen
+bookkeeping for every one of them, the transitions are buffered for window_seconds, collapsed per user (the last transition on each server wins),
+and applied in one batch, where the username and icon of every user are only worked out once."""
+
+# How long (in seconds) transitions are buffered before they're applied
+window_seconds = 1.
+
+# The buffered transitions, in the format of {user id: PendingPresence}
+pending = {}
+
+# The handle of the scheduled flush, None if nothing is buffered
+_flush_handle = None
+
+# Metrics about the coalescing, received counts the transitions that came in and applied the ones that reached the last seen records
+metrics = {"received": 0, "applied": 0, "users": 0, "batches": 0}
+
+
+class PendingPresence:
+    """The buffered transitions of a user, the latest member object of the user and whether the user went offline on each server."""
+
+    __slots__ = ("member", "server_states")
+
+    def __init__(self, member):
+        self.member = member
+
+        # In the format of {server id: True if the user went offline, False if the user came online}
+        self.server_states = {}
+
+
+def add(member, is_offline: bool, loop: asyncio.AbstractEventLoop):
+    """Buffers a transition of the member (on the member's server), and schedules a flush if there isn't one yet."""
+    global _flush_handle
+    metrics["received"] += 1
+
+    pending_presence = pending.get(member.id)
+    if pending_presence is None:
+        pending_presence = pending[member.id] = PendingPresence(member)
+    else:
+        pending_presence.member = member
+
+    pending_presence.server_states[member.server.id] = is_offline
+
+    if _flush_handle is None:
+        _flush_handle = loop.call_later(window_seconds, flush)
+
+
+def flush():
+    """Applies all the buffered transitions to the last seen records in one batch."""
+    global _flush_handle, pending
+    _flush_handle = None
+
+    # We swap the buffer out first, so transitions that come in while we apply go into the next batch
+    batch = pending
+    pending = {}
+
+    # Every user that went offline in this batch gets the same last seen time
+    now = int(time.time())
+
+    for user_id, pending_presence in batch.items():
+        member = pending_presence.member
+        username = None
+        icon_url = None
+
+        for server_id, is_offline in pending_presence.server_states.items():
+            if is_offline:
+                # We work out the username and icon once per user, not once per server
+                if username is None:
+                    username = "#".join((member.name, str(member.discriminator)))
+                    icon_url = member.avatar_url if member.avatar_url != "" else member.default_avatar_url
+
+                last_seen.mark_offline(server_id, user_id, username, icon_url, now)
+            else:
+                last_seen.mark_online(server_id, user_id)
+
+        metrics["applied"] += len(pending_presence.server_states)
+
+    metrics["users"] += len(batch)
+    metrics["batches"] += 1
+
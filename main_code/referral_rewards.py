@@ -0,0 +1,60 @@
+import bisect
+
+"""This file handles the referral reward ladders, the roles that users get when they reach a number of referrals on a server.
+The referral_rewards of a server's referral_config are compiled into a ladder (the thresholds as sorted ints, with the roles resolved once) the first
+time they're needed, and the ladders are dropped when the config is reloaded or a role is created or deleted on the server, so they're never stale."""
+
+
+class RewardLadder:
+    """The reward tiers of a server, thresholds is sorted and roles[i] is the role for reaching thresholds[i] referrals."""
+
+    __slots__ = ("thresholds", "roles")
+
+    def __init__(self, thresholds: list, roles: list):
+        self.thresholds = thresholds
+        self.roles = roles
+
+    def get_tier(self, num_refs: int) -> int:
+        """Returns the index of the highest tier that num_refs referrals reach, -1 if they don't reach any."""
+        return bisect.bisect_right(self.thresholds, num_refs) - 1
+
+
+# The compiled ladders, with server ids as keys, servers without reward roles have None as their ladder
+ladders = {}
+
+
+def compile_ladder(server, server_referral_config: dict):
+    """Compiles the referral rewards of a server's referral config into a ladder, returns None if none of the reward roles exist on the server."""
+    # We look the roles up by id once, instead of scanning the role list for every threshold
+    server_roles = {role.id: role for role in server.roles}
+
+    # Thresholds like "5" and "05" are the same number of referrals, so we merge them, the one that comes last in the config wins like it always did
+    roles_by_threshold = {}
+    for threshold, role_id in server_referral_config.get("referral_rewards", {}).items():
+        if str(threshold).isdigit() and str(role_id) in server_roles:
+            roles_by_threshold[int(threshold)] = server_roles[str(role_id)]
+
+    if not roles_by_threshold:
+        return None
+
+    # We only sort by the threshold, the roles can't be compared
+    tiers = sorted(roles_by_threshold.items(), key=lambda tier: tier[0])
+
+    return RewardLadder([threshold for threshold, _ in tiers], [role for _, role in tiers])
+
+
+def get_ladder(server, config: dict):
+    """Returns the compiled ladder of the server, compiling it if it hasn't been yet. Returns None if the server doesn't have any reward roles."""
+    if server.id not in ladders:
+        server_referral_config = config["referral_config"].get(str(server.id))
+        ladders[server.id] = compile_ladder(server, server_referral_config) if server_referral_config is not None else None
+
+    return ladders[server.id]
+
+
+def invalidate(server_id: str = None):
+    """Drops the compiled ladder of the server, or of all servers if server_id is None, so it's compiled again the next time it's needed."""
+    if server_id is None:
+        ladders.clear()
+    else:
+        ladders.pop(server_id, None)
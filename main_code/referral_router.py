@@ -0,0 +1,152 @@
+import asyncio
+import collections
+import time
+
+from . import helpers
+from . import state_store
+
+"""This file handles the referral questions that are waiting for an answer.
+Instead of one wait_for_message listener per joining member (which discord.py checks against every incoming message), the pending referrals are kept
+in a dict keyed by user id, so routing a PM to its referral is a single lookup and pending referrals cost nothing for other messages.
+The timeouts are kept in a deadline wheel (buckets of one tick each), so expiring them only looks at the buckets that have passed.
+The pending referrals are written to the state store, so they survive restarts."""
+
+# The pending referrals, in the format of {user id: OrderedDict({server id: deadline})}, the deadlines are epoch times so they survive restarts.
+# A user who joined several servers with referrals at once answers them in the order they joined
+pending = {}
+
+# The deadline wheel, in the format of {tick number: set of (user id, server id) tuples}, where the tick number is the deadline divided by tick_seconds
+wheel = {}
+
+# The length (in seconds) of a tick of the wheel, which is also how often we check for timeouts
+tick_seconds = 1
+
+# The last tick that we expired the referrals of
+_last_tick = None
+
+# The referrals that have changed since they were last written to the state store, in the format of {(user id, server id): deadline},
+# where the deadline is None for the referrals that were removed
+changes = {}
+
+# Metrics about the referrals
+metrics = {"registered": 0, "answered": 0, "timed_out": 0}
+
+
+def _tick(deadline: float) -> int:
+    return int(deadline // tick_seconds)
+
+
+def _remove_from_wheel(user_id: str, server_id: str, deadline: float):
+    """Removes a referral from the bucket of its deadline, and the bucket itself if it's empty then."""
+    tick = _tick(deadline)
+    bucket = wheel.get(tick)
+
+    if bucket is not None:
+        bucket.discard((user_id, server_id))
+        if not bucket:
+            del wheel[tick]
+
+
+def load():
+    """Loads the pending referrals from the state store, this is done once at startup. The ones that timed out while we were down are expired by the next tick."""
+    pending.clear()
+    wheel.clear()
+
+    for user_id, server_id, deadline in state_store.call(state_store.load_pending_referrals):
+        register(user_id, server_id, deadline)
+
+    changes.clear()
+
+
+def flush():
+    """Queues the rows of the referrals that have changed to be written to the state store."""
+    if changes:
+        state_store.submit(state_store.save_pending_referrals,
+                           [(user_id, server_id, deadline) for (user_id, server_id), deadline in changes.items() if deadline is not None],
+                           [key for key, deadline in changes.items() if deadline is None])
+        changes.clear()
+
+
+def register(user_id: str, server_id: str, deadline: float):
+    """Registers a referral question to the user for the server, which times out at the deadline (an epoch time)."""
+
+    server_referrals = pending.setdefault(user_id, collections.OrderedDict())
+
+    # If the user was already asked about the server, the new question replaces the old one
+    old_deadline = server_referrals.pop(server_id, None)
+    if old_deadline is not None:
+        _remove_from_wheel(user_id, server_id, old_deadline)
+
+    server_referrals[server_id] = deadline
+    wheel.setdefault(_tick(deadline), set()).add((user_id, server_id))
+
+    metrics["registered"] += 1
+    changes[(user_id, server_id)] = deadline
+
+
+def is_pending(user_id: str) -> bool:
+    """Returns True if the user has a referral question waiting for an answer."""
+    return user_id in pending
+
+
+def take(user_id: str):
+    """Removes the oldest pending referral of the user and returns its server id and deadline, this is what routing an answer to it does.
+    Returns None if the user doesn't have any pending referrals."""
+
+    server_referrals = pending.get(user_id)
+    if not server_referrals:
+        return None
+
+    server_id, deadline = server_referrals.popitem(last=False)
+    if not server_referrals:
+        del pending[user_id]
+
+    _remove_from_wheel(user_id, server_id, deadline)
+
+    metrics["answered"] += 1
+    changes[(user_id, server_id)] = None
+    return server_id, deadline
+
+
+def _expire(now: float) -> list:
+    """Removes the referrals in the ticks that have completely passed, and returns them as (user id, server id) tuples.
+    A referral can time out at most one tick late, but never early."""
+    global _last_tick
+    now_tick = _tick(now)
+
+    # After a restart, we start from the earliest tick that has referrals in it
+    if _last_tick is None:
+        _last_tick = min(wheel, default=now_tick) - 1
+
+    expired = []
+    for tick in range(_last_tick + 1, now_tick):
+        for user_id, server_id in wheel.pop(tick, ()):
+            server_referrals = pending.get(user_id)
+            if server_referrals is not None and server_referrals.pop(server_id, None) is not None:
+                if not server_referrals:
+                    del pending[user_id]
+                expired.append((user_id, server_id))
+                changes[(user_id, server_id)] = None
+
+    _last_tick = max(_last_tick, now_tick - 1)
+
+    metrics["timed_out"] += len(expired)
+
+    return expired
+
+
+async def deadline_loop(on_timeout):
+    """Expires the referrals whose deadlines have passed every tick, and calls on_timeout (a coroutine function) with the user id and server id of each one.
+    It also writes the pending referrals that have changed to the state store."""
+    # This runs forever, but since it is an async task, we just await sleep and then it will continue executing everything else
+    while True:
+        for user_id, server_id in _expire(time.time()):
+            try:
+                await on_timeout(user_id, server_id)
+            except Exception as e:
+                helpers.log_warning("Was not able to handle the referral timeout of user {0} on server {1}, info: {2}".format(
+                    user_id, server_id, e))
+
+        flush()
+
+        await asyncio.sleep(tick_seconds)
@@ -0,0 +1,114 @@
+import bisect
+
+from . import state_store
+
+"""This file handles the referral data (who has referred whom on which server), which is stored in the referral tables of the state store.
+The tables are loaded once at startup into indexes: the users who have been referred are kept in a set, the referral counts in a dict, and every server
+has a ranking (a sorted list of (-count, user id) tuples) that is kept up to date as referrals come in, so the leaderboard and the per-user lookups
+never need to load or sort everything.
+Referrals are recorded as transactions, the indexes are only kept if the new rows were written to the state store, and are rolled back otherwise."""
+
+
+class ServerReferrals:
+    """The referral indexes of a server."""
+
+    __slots__ = ("referral_counts", "have_referred", "ranking")
+
+    def __init__(self, referral_counts: dict, have_referred: list):
+        # The number of times each user has been named as a referrer, with user ids as keys
+        self.referral_counts = dict(referral_counts)
+
+        # The ids of the users who have referred someone (they can only do that once)
+        self.have_referred = set(have_referred)
+
+        # The users sorted by their number of referrals (the most first), ties are sorted by user id
+        self.ranking = sorted((-count, user_id) for user_id, count in self.referral_counts.items())
+
+    def set_count(self, user_id: str, count: int):
+        """Sets the referral count of a user, and moves the user to the right place in the ranking."""
+        old_count = self.referral_counts.get(user_id)
+        if old_count is not None:
+            del self.ranking[bisect.bisect_left(self.ranking, (-old_count, user_id))]
+
+        if count > 0:
+            self.referral_counts[user_id] = count
+            bisect.insort(self.ranking, (-count, user_id))
+        else:
+            self.referral_counts.pop(user_id, None)
+
+    def to_json(self) -> dict:
+        return {"been_referred": self.referral_counts, "have_referred": sorted(self.have_referred)}
+
+
+# The referral indexes of the servers, with server ids as keys
+servers = {}
+
+
+def load():
+    """Loads the referrals from the state store into the indexes, this is done once at startup."""
+    servers.clear()
+    for server_id, (referral_counts, have_referred) in state_store.call(state_store.load_referrals).items():
+        servers[server_id] = ServerReferrals(referral_counts, have_referred)
+
+
+def to_json() -> dict:
+    """Returns all the referrals in the format of the old referrals.json file."""
+    return {"servers": {server_id: server_referrals.to_json() for server_id, server_referrals in servers.items()}}
+
+
+def has_referred(server_id: str, user_id: str) -> bool:
+    """Returns True if the user has already referred someone on the server."""
+    server_referrals = servers.get(server_id)
+    return server_referrals is not None and user_id in server_referrals.have_referred
+
+
+async def record_referral(server_id: str, referred_id: str, referrer_id: str):
+    """Records that the referred user was referred to the server by the referrer, and returns the referrer's new number of referrals.
+    Returns None (and changes nothing) if the referred user has already referred someone on the server.
+    If the referral can't be written to the state store, the indexes are rolled back and the error is raised."""
+    server_referrals = servers.get(server_id)
+    is_new_server = server_referrals is None
+    if is_new_server:
+        server_referrals = servers[server_id] = ServerReferrals({}, [])
+    elif referred_id in server_referrals.have_referred:
+        return None
+
+    old_count = server_referrals.referral_counts.get(referrer_id, 0)
+    server_referrals.have_referred.add(referred_id)
+    server_referrals.set_count(referrer_id, old_count + 1)
+
+    try:
+        await state_store.run(state_store.save_referral, server_id, referred_id, referrer_id, old_count + 1)
+    except Exception:
+        # We roll back, so the indexes always match what's stored. Other referrals might have been recorded while we waited, so we undo ours instead
+        # of restoring the old values
+        server_referrals.have_referred.discard(referred_id)
+        server_referrals.set_count(referrer_id, server_referrals.referral_counts.get(referrer_id, 0) - 1)
+        if is_new_server and not server_referrals.referral_counts and not server_referrals.have_referred:
+            servers.pop(server_id, None)
+        raise
+
+    return old_count + 1
+
+
+def get_user(server_id: str, user_id: str) -> tuple:
+    """Returns the number of referrals of the user on the server and the user's place in the ranking (starting at 1, users with the same number of
+    referrals share their place), the place is None if the user doesn't have any referrals."""
+    server_referrals = servers.get(server_id)
+    count = server_referrals.referral_counts.get(user_id, 0) if server_referrals is not None else 0
+
+    if count == 0:
+        return 0, None
+
+    # A tuple with just the count sorts before every tuple with the same count, so this finds the first user with the count
+    return count, bisect.bisect_left(server_referrals.ranking, (-count,)) + 1
+
+
+def get_page(server_id: str, page: int, page_size: int) -> tuple:
+    """Returns a page (starting at 0) of the server's ranking as a list of (user id, count) tuples, and the total number of ranked users."""
+    server_referrals = servers.get(server_id)
+    if server_referrals is None:
+        return [], 0
+
+    return ([(user_id, -negative_count) for negative_count, user_id in
+             server_referrals.ranking[page * page_size:(page + 1) * page_size]], len(server_referrals.ranking))
@@ -0,0 +1,229 @@
+import asyncio
+import concurrent.futures
+import json
+import logging
+import os
+import sqlite3
+import time
+
+"""This file handles the persistent state of anna-bot (stats, prefixes, referrals, pending referral questions, pokemon state and voice state),
+which is kept in one SQLite database in WAL mode, with a table per domain, so changes are written as rows instead of rewriting whole json files,
+and a crash can never leave a truncated file behind that blocks startup.
+All the database work is done by a single worker thread, so it never blocks the event loop and the writes are applied in the order they were made.
+    run(function, *args) awaits a function of this file (from the event loop),
+    submit(function, *args) queues one without waiting for it (from any thread, like the audio player threads),
+    call(function, *args) waits for one (only when the event loop isn't running, like at startup and exit).
+The first time the database is opened, the old json files are migrated into it (see migrate_from_json)."""
+
+# The file that the database is stored in
+database_filename = os.path.join("persistent_state", "anna_state.db")
+
+# The schema, a table per domain
+schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS prefixes (server_id TEXT PRIMARY KEY, prefix TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS referral_counts (server_id TEXT NOT NULL, user_id TEXT NOT NULL, count INTEGER NOT NULL,
+                                            PRIMARY KEY (server_id, user_id));
+CREATE TABLE IF NOT EXISTS referred_users (server_id TEXT NOT NULL, user_id TEXT NOT NULL, PRIMARY KEY (server_id, user_id));
+CREATE TABLE IF NOT EXISTS pending_referrals (user_id TEXT NOT NULL, server_id TEXT NOT NULL, deadline REAL NOT NULL,
+                                              PRIMARY KEY (user_id, server_id));
+CREATE TABLE IF NOT EXISTS pokemon_state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS voice_state (server_id TEXT PRIMARY KEY, state TEXT NOT NULL);
+"""
+
+# The single worker thread that does all the database work, and the connection that it uses (which is only ever touched from that thread)
+_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+_connection = None
+
+
+def _get_connection() -> sqlite3.Connection:
+    """Returns the connection to the database, opening it (and creating the schema and migrating the json files) the first time."""
+    global _connection
+
+    if _connection is None:
+        _connection = sqlite3.connect(database_filename, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("PRAGMA synchronous=NORMAL")
+        _connection.executescript(schema)
+
+        if _connection.execute("SELECT 1 FROM meta WHERE key = 'migrated_from_json'").fetchone() is None:
+            migrate_from_json(_connection)
+
+    return _connection
+
+
+class _Transaction:
+    """A context manager that runs a block in a transaction on the connection, which is committed if the block succeeds and rolled back otherwise."""
+
+    def __enter__(self) -> sqlite3.Connection:
+        self.connection = _get_connection()
+        self.connection.execute("BEGIN")
+        return self.connection
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.connection.execute("COMMIT" if exc_type is None else "ROLLBACK")
+
+
+def _log_failure(future: concurrent.futures.Future):
+    """Logs the error of a failed function, so the errors of submitted functions that nobody waits for aren't lost."""
+    if not future.cancelled() and future.exception() is not None:
+        logging.getLogger("discord").warning("A state store write failed, info: {0}".format(future.exception()),
+                                             extra={"print_to_console": True})
+
+
+def submit(function, *args) -> concurrent.futures.Future:
+    """Queues the function to run in the worker thread, and returns its future. This can be called from any thread."""
+    future = _executor.submit(function, *args)
+    future.add_done_callback(_log_failure)
+    return future
+
+
+async def run(function, *args):
+    """Runs the function in the worker thread and returns its result, without blocking the event loop."""
+    return await asyncio.wrap_future(submit(function, *args))
+
+
+def call(function, *args):
+    """Runs the function in the worker thread and waits for its result. This blocks, so it's only for when the event loop isn't running."""
+    return submit(function, *args).result()
+
+
+def close():
+    """Waits for the queued work to be done and closes the database, this is called when we shut down."""
+    def close_connection():
+        global _connection
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+    call(close_connection)
+
+
+def _read_json(filename: str):
+    """Returns the parsed contents of a json file, or None if it doesn't exist or can't be parsed."""
+    try:
+        with open(filename, mode="r", encoding="utf-8") as json_file:
+            return json.load(json_file)
+    except (OSError, ValueError):
+        return None
+
+
+def migrate_from_json(connection: sqlite3.Connection):
+    """Copies the state from the old json files into the database, in one transaction. This is only done once, the json files are left as they are."""
+    connection.execute("BEGIN")
+    try:
+        config = _read_json("config.json")
+        if config is not None:
+            connection.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?)",
+                                   [(name, value) for name, value in config.get("stats", {}).items() if isinstance(value, int)])
+
+        prefixes = _read_json(os.path.join("persistent_state", "configured_prefixes.json")) or {}
+        connection.executemany("INSERT OR REPLACE INTO prefixes VALUES (?, ?)", prefixes.items())
+
+        referrals = _read_json("referrals.json") or {"servers": {}}
+        for server_id, server_referrals in referrals["servers"].items():
+            connection.executemany("INSERT OR REPLACE INTO referral_counts VALUES (?, ?, ?)",
+                                   [(server_id, user_id, count) for user_id, count in server_referrals["been_referred"].items()])
+            connection.executemany("INSERT OR REPLACE INTO referred_users VALUES (?, ?)",
+                                   [(server_id, user_id) for user_id in server_referrals["have_referred"]])
+
+        pending_referrals = _read_json(os.path.join("persistent_state", "pending_referrals.json")) or []
+        connection.executemany("INSERT OR REPLACE INTO pending_referrals VALUES (?, ?, ?)", pending_referrals)
+
+        pokemon_state = _read_json(os.path.join("persistent_state", "pokemon_state.json"))
+        if pokemon_state is not None:
+            connection.executemany("INSERT OR REPLACE INTO pokemon_state VALUES (?, ?)",
+                                   [(key, json.dumps(value)) for key, value in pokemon_state.items()])
+
+        voice_state = _read_json(os.path.join("persistent_state", "voice_state.json")) or {}
+        connection.executemany("INSERT OR REPLACE INTO voice_state VALUES (?, ?)",
+                               [(server_id, json.dumps(state)) for server_id, state in voice_state.items()])
+
+        connection.execute("INSERT INTO meta VALUES ('migrated_from_json', ?)", (time.asctime(),))
+    except Exception:
+        connection.execute("ROLLBACK")
+        raise
+
+    connection.execute("COMMIT")
+
+
+# The functions below run in the worker thread, through run, submit or call
+
+def load_stats() -> dict:
+    return dict(_get_connection().execute("SELECT name, value FROM stats"))
+
+
+def save_stats(counters: dict):
+    with _Transaction() as connection:
+        connection.executemany("INSERT OR REPLACE INTO stats VALUES (?, ?)", counters.items())
+
+
+def load_prefixes() -> dict:
+    return dict(_get_connection().execute("SELECT server_id, prefix FROM prefixes"))
+
+
+def save_prefix(server_id: str, prefix):
+    """Sets the prefix of the server, or removes it if prefix is None."""
+    if prefix is None:
+        _get_connection().execute("DELETE FROM prefixes WHERE server_id = ?", (server_id,))
+    else:
+        _get_connection().execute("INSERT OR REPLACE INTO prefixes VALUES (?, ?)", (server_id, prefix))
+
+
+def load_referrals() -> dict:
+    """Returns the referrals in the format of {server id: ({user id: count}, [ids of the users who have referred])}."""
+    referrals = {}
+    connection = _get_connection()
+
+    for server_id, user_id, count in connection.execute("SELECT server_id, user_id, count FROM referral_counts"):
+        referrals.setdefault(server_id, ({}, []))[0][user_id] = count
+    for server_id, user_id in connection.execute("SELECT server_id, user_id FROM referred_users"):
+        referrals.setdefault(server_id, ({}, []))[1].append(user_id)
+
+    return referrals
+
+
+def save_referral(server_id: str, referred_id: str, referrer_id: str, count: int):
+    """Records that the referred user has referred the referrer, who now has count referrals, in one transaction."""
+    with _Transaction() as connection:
+        connection.execute("INSERT INTO referred_users VALUES (?, ?)", (server_id, referred_id))
+        connection.execute("INSERT OR REPLACE INTO referral_counts VALUES (?, ?, ?)", (server_id, referrer_id, count))
+
+
+def load_pending_referrals() -> list:
+    return _get_connection().execute("SELECT user_id, server_id, deadline FROM pending_referrals").fetchall()
+
+
+def save_pending_referrals(added: list, removed: list):
+    """Adds the (user id, server id, deadline) tuples and removes the (user id, server id) tuples, in one transaction."""
+    with _Transaction() as connection:
+        connection.executemany("DELETE FROM pending_referrals WHERE user_id = ? AND server_id = ?", removed)
+        connection.executemany("INSERT OR REPLACE INTO pending_referrals VALUES (?, ?, ?)", added)
+
+
+def load_pokemon_state():
+    """Returns the pokemon state as a dict, or None if there isn't any."""
+    rows = _get_connection().execute("SELECT key, value FROM pokemon_state").fetchall()
+    return {key: json.loads(value) for key, value in rows} if rows else None
+
+
+def save_pokemon_state(state: dict):
+    """Replaces the pokemon state with the passed dict, in one transaction, so keys that aren't in it anymore are removed."""
+    with _Transaction() as connection:
+        connection.execute("DELETE FROM pokemon_state")
+        connection.executemany("INSERT OR REPLACE INTO pokemon_state VALUES (?, ?)",
+                               [(key, json.dumps(value)) for key, value in state.items()])
+
+
+def load_voice_state() -> dict:
+    return {server_id: json.loads(state) for server_id, state in
+            _get_connection().execute("SELECT server_id, state FROM voice_state")}
+
+
+def save_voice_state(changed: dict, removed: list):
+    """Writes the voice state of the changed servers (a dict of server id: state) and removes the removed server ids, in one transaction."""
+    with _Transaction() as connection:
+        connection.executemany("DELETE FROM voice_state WHERE server_id = ?", [(server_id,) for server_id in removed])
+        connection.executemany("INSERT OR REPLACE INTO voice_state VALUES (?, ?)",
+                               [(server_id, json.dumps(state)) for server_id, state in changed.items()])
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+from . import helpers
+from . import state_store
+
+"""This file handles the usage stats of anna-bot (messages sent, commands received, etc.).
+The counters live in memory and are flushed to the stats table of the state store periodically and when the bot exits, instead of being written on every message."""
+
+# The counters, this is the same dict object as the "stats" section of the loaded config, so writing out the config always writes out the current counters
+counters = {"servers_joined": 0, "messages_sent": 0, "commands_received": 0}
+
+# If the counters have changed since they were last flushed to disk
+dirty = False
+
+# The time at which the bot was started, this is volatile and is never written to disk
+start_time = time.time()
+
+def load(passed_config: dict):
+    """Loads the counters from the state store, and makes the passed (freshly loaded) config use the live counters dict.
+    The stats section of the config is only read by the state store's one-shot migration, but it's still written out with the config."""
+    global dirty
+
+    counters.clear()
+    counters.update(passed_config.get("stats", {}))
+    counters.update(state_store.call(state_store.load_stats))
+
+    # The start time is not a counter, it only ever lived in the config because we didn't have anywhere else to put it
+    counters.pop("volatile", None)
+
+    passed_config["stats"] = counters
+    dirty = False
+
+
+def attach(passed_config: dict):
+    """Makes a reloaded config use the live counters instead of the (older) counters that were flushed to disk."""
+    passed_config["stats"] = counters
+
+
+def increment(name: str, amount: int = 1):
+    """Increments the named counter, this never touches the disk."""
+    global dirty
+
+    counters[name] = counters.get(name, 0) + amount
+    dirty = True
+
+
+def get_uptime_seconds() -> int:
+    """Returns the number of whole seconds since the bot was started."""
+    return int(time.time() - start_time)
+
+
+def flush():
+    """Flushes the counters to disk if they have changed. This blocks, so it should only be called directly when the event loop isn't running (like on exit)."""
+    global dirty
+
+    if not dirty:
+        return
+
+    dirty = False
+    try:
+        state_store.call(state_store.save_stats, dict(counters))
+    except Exception as e:
+        # We'll try again on the next flush
+        dirty = True
+        helpers.log_warning("Was not able to flush stats to disk, info: {0}".format(e))
+
+
+async def flush_loop(loop: asyncio.AbstractEventLoop, interval: int = 60):
+    """Flushes the counters to disk every interval seconds (if they have changed). The writing is done by the state store's worker thread so it never blocks the event loop."""
+    global dirty
+
+    # This runs forever, but since it is an async task, we just await sleep and then it will continue executing everything else
+    while True:
+        await asyncio.sleep(interval)
+
+        if not dirty:
+            continue
+
+        # We take the snapshot on the event loop, so the counters are never read while they are being changed
+        snapshot = dict(counters)
+        dirty = False
+
+        try:
+            await state_store.run(state_store.save_stats, snapshot)
+        except Exception as e:
+            # We'll try again on the next flush
+            dirty = True
+            helpers.log_warning("Was not able to flush stats to disk, info: {0}".format(e))
@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+"""This file handles rate limiting commands before they are run.
+Every command has a cost class (declared through command_decorator.command), which decides how many tokens a use of it costs and how important it is.
+A command is only run if the per-user, per-server and global token buckets all have enough tokens for it, and when the event loop is lagging,
+the least important commands are shed first, so voice and moderation commands stay responsive when someone spams the fun commands.
+Admin commands skip the buckets and are never shed."""
+
+# The priorities of the cost classes, commands with lower priorities are shed first when the event loop lags
+PRIORITY_LOW = 0
+PRIORITY_NORMAL = 1
+PRIORITY_HIGH = 2
+
+# The cost classes that commands can declare, with the number of tokens a use costs and the priority of the class
+cost_classes = {
+    "light": {"cost": 0.5, "priority": PRIORITY_NORMAL},
+    "normal": {"cost": 1, "priority": PRIORITY_NORMAL},
+    "voice": {"cost": 1, "priority": PRIORITY_HIGH},
+    "moderation": {"cost": 1, "priority": PRIORITY_HIGH},
+    "external_api": {"cost": 3, "priority": PRIORITY_LOW},
+    "external_api_bulk": {"cost": 8, "priority": PRIORITY_LOW},
+    "cpu_heavy": {"cost": 5, "priority": PRIORITY_LOW}
+}
+
+# The default settings, these can be overridden by the throttle_config section of the config
+default_settings = {
+    # The capacity (burst size) and refill rate (tokens per second) of the buckets
+    "user_capacity": 10, "user_refill_per_second": 0.5,
+    "server_capacity": 40, "server_refill_per_second": 2,
+    "global_capacity": 200, "global_refill_per_second": 20,
+    # When the event loop lag (in seconds) passes these thresholds, we shed low priority and then normal priority commands
+    "shed_low_priority_lag_seconds": 0.25, "shed_normal_priority_lag_seconds": 1.,
+    # How often (in seconds) we tell a user that they're being rate limited, so the notices don't become spam themselves
+    "notice_interval_seconds": 30
+}
+settings = dict(default_settings)
+
+# If we've got this many buckets, we drop the ones that are full (they're in the same state as a new bucket) the next time we create one
+max_idle_buckets = 5000
+
+# The buckets of users and servers, with ids as keys, and the global bucket
+user_buckets = {}
+server_buckets = {}
+global_bucket = None
+
+# The current lag of the event loop, as measured by monitor_loop_lag
+loop_lag = 0.
+
+# The time at which we last told a user that they're rate limited, with user ids as keys
+last_notice_times = {}
+
+# Metrics about how the throttle has decided
+metrics = {"allowed": 0, "rate_limited": 0, "shed": 0, "admin_exempt": 0}
+
+
+class TokenBucket:
+    """A token bucket, which holds at most capacity tokens and gets refill_rate tokens back every second."""
+
+    __slots__ = ("capacity", "refill_rate", "tokens", "last_time")
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.tokens = capacity
+        self.last_time = time.monotonic()
+
+    def refill(self, now: float):
+        """Adds the tokens that have been refilled since the last time."""
+        self.tokens = min(self.capacity, self.tokens + (now - self.last_time) * self.refill_rate)
+        self.last_time = now
+
+    def is_full(self, now: float) -> bool:
+        self.refill(now)
+        return self.tokens >= self.capacity
+
+
+def configure(passed_config: dict):
+    """Loads the throttle settings from the config and resets all the buckets, this is called at startup and when the config is reloaded."""
+    global global_bucket
+
+    settings.clear()
+    settings.update(default_settings)
+    settings.update(passed_config.get("throttle_config", {}))
+
+    user_buckets.clear()
+    server_buckets.clear()
+    global_bucket = TokenBucket(settings["global_capacity"], settings["global_refill_per_second"])
+
+
+def _get_bucket(buckets: dict, key: str, capacity: float, refill_rate: float, now: float) -> TokenBucket:
+    """Gets the bucket for the key, creating it if it doesn't exist yet."""
+    bucket = buckets.get(key)
+
+    if bucket is None:
+        # We drop the full buckets if we have too many, so the dicts can't grow without bound
+        if len(buckets) >= max_idle_buckets:
+            for full_key in [bucket_key for bucket_key, value in buckets.items() if value.is_full(now)]:
+                del buckets[full_key]
+
+        bucket = buckets[key] = TokenBucket(capacity, refill_rate)
+
+    return bucket
+
+
+def check(user_id: str, server_id, cost_class: str, is_admin_command: bool = False):
+    """Checks if a command of the passed cost class may be run for the user on the server (server_id is None for PMs), and takes the tokens if so.
+    Returns None if the command may run, "shed" if it was shed because the event loop is lagging or "rate_limited" if a bucket didn't have enough tokens.
+    Admin commands are never rate limited or shed, they're what the admins use to fix things when the bot is overloaded."""
+    if global_bucket is None:
+        configure({})
+
+    if is_admin_command:
+        metrics["admin_exempt"] += 1
+        return None
+
+    command_class = cost_classes[cost_class]
+
+    # We shed the least important commands first when the event loop is lagging
+    if ((command_class["priority"] <= PRIORITY_LOW and loop_lag > settings["shed_low_priority_lag_seconds"]) or
+            (command_class["priority"] <= PRIORITY_NORMAL and loop_lag > settings["shed_normal_priority_lag_seconds"])):
+        metrics["shed"] += 1
+        return "shed"
+
+    now = time.monotonic()
+
+    # The buckets that need to have enough tokens for the command to run
+    buckets = [_get_bucket(user_buckets, user_id, settings["user_capacity"], settings["user_refill_per_second"], now),
+               global_bucket]
+    if server_id is not None:
+        buckets.append(_get_bucket(server_buckets, server_id, settings["server_capacity"],
+                                   settings["server_refill_per_second"], now))
+
+    # We only take the tokens if all the buckets have enough of them, so a rejected command doesn't cost anything
+    for bucket in buckets:
+        bucket.refill(now)
+        if bucket.tokens < command_class["cost"]:
+            metrics["rate_limited"] += 1
+            return "rate_limited"
+
+    for bucket in buckets:
+        bucket.tokens -= command_class["cost"]
+
+    metrics["allowed"] += 1
+    return None
+
+
+def should_notify(user_id: str) -> bool:
+    """Returns True if we should tell the user that their command was throttled, this is at most once every notice interval."""
+    now = time.monotonic()
+
+    if now - last_notice_times.get(user_id, -settings["notice_interval_seconds"]) < settings["notice_interval_seconds"]:
+        return False
+
+    # We forget the old notice times once in a while, so the dict can't grow without bound
+    if len(last_notice_times) >= max_idle_buckets:
+        last_notice_times.clear()
+
+    last_notice_times[user_id] = now
+    return True
+
+
+async def monitor_loop_lag(interval: float = 0.5):
+    """Measures how late the event loop wakes us up from a sleep, that's the lag that commands are shed by. The lag is smoothed a bit so single spikes don't shed commands."""
+    global loop_lag
+
+    # This runs forever, but since it is an async task, we just await sleep and then it will continue executing everything else
+    while True:
+        start = time.monotonic()
+        await asyncio.sleep(interval)
+        lag = max(0., time.monotonic() - start - interval)
+        loop_lag = 0.7 * loop_lag + 0.3 * lag
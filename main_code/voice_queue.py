@@ -0,0 +1,270 @@
+import asyncio
+import functools
+import time
+
+from . import helpers
+from . import ytdl_extractor
+
+"""This file defines the entries of the voice queues.
+An entry only holds what we know about a track (its url, title, uploader, duration and who requested it), the ffmpeg player for it is only created
+when it gets to the front of the queue, or shortly before that when it is prefetched. This way long queues don't keep idle ffmpeg processes around,
+and the stream urls that youtube_dl resolves don't expire while the track waits in the queue.
+The entries have the same methods as the players that the queue used to hold (start, pause, resume, stop, is_playing and volume), so the queue code treats them the same way."""
+
+# The default settings, these can be overridden by the voice_queue section of the config
+default_settings = {
+    # The near end callback of an entry is called this many seconds before the entry's track ends, that's when the next track is prefetched
+    "prefetch_window_seconds": 10
+}
+settings = dict(default_settings)
+
+# Metrics about the entries and their players
+metrics = {"created": 0, "instantiated": 0, "prefetched": 0, "discarded": 0}
+
+# The times (time.monotonic) at which the last track ended on the servers whose next track hasn't started yet, with server ids as keys
+transition_start_times = {}
+
+# The silent gaps between the tracks of every server, with server ids as keys
+gap_metrics = {}
+
+
+def configure(passed_config: dict):
+    """Loads the voice queue settings from the config, this is called at startup and when the config is reloaded."""
+    settings.clear()
+    settings.update(default_settings)
+    settings.update(passed_config.get("voice_queue", {}))
+
+
+def start_transition(server_id: str, ended_time: float):
+    """Records that a track ended on the server at ended_time and that the next one is going to start, the gap is recorded when it does."""
+    transition_start_times[server_id] = ended_time
+
+
+def cancel_transition(server_id: str):
+    """Forgets the transition of the server, because nothing is going to play next (the queue is empty or it was cleared)."""
+    transition_start_times.pop(server_id, None)
+
+
+def _record_gap(server_id: str):
+    """Records the gap between the end of the server's last track and now, if a track ended on the server, this is called when a player starts."""
+    ended_time = transition_start_times.pop(server_id, None)
+    if ended_time is None:
+        return
+
+    gap_seconds = time.monotonic() - ended_time
+    server_metrics = gap_metrics.setdefault(server_id, {"transitions": 0, "total_seconds": 0., "max_seconds": 0.,
+                                                        "last_seconds": 0.})
+    server_metrics["transitions"] += 1
+    server_metrics["total_seconds"] += gap_seconds
+    server_metrics["max_seconds"] = max(server_metrics["max_seconds"], gap_seconds)
+    server_metrics["last_seconds"] = gap_seconds
+
+
+class QueueEntry:
+    """A track in a server's voice queue. The player is None until the entry is instantiated.
+    after is called with the entry (or its player) when the track is done, like the after callback of a player, and near_end is called with the entry
+    when its track is within the prefetch window of its end."""
+
+    __slots__ = ("server_id", "url", "title", "uploader", "duration", "description", "requester", "after", "near_end",
+                 "player", "player_future", "is_started", "should_play", "is_stopped", "_volume", "played_seconds", "near_end_handle")
+
+    def __init__(self, server_id: str, url: str, info: dict, requester: str, after, near_end):
+        self.server_id = server_id
+        self.url = url
+        self.requester = requester
+        self.after = after
+        self.near_end = near_end
+        self.set_info(info)
+
+        self.player = None
+        # The future of the player while it is being created
+        self.player_future = None
+
+        # If the player has been started, if it should be playing (it may still be loading), and if the entry has been stopped for good
+        self.is_started = False
+        self.should_play = False
+        self.is_stopped = False
+
+        self._volume = 1.
+
+        # The seconds the player played before it was last paused, the players only count the frames they sent since they were last resumed
+        self.played_seconds = 0.
+        self.near_end_handle = None
+
+        metrics["created"] += 1
+
+    def set_info(self, info: dict):
+        """Sets the info we show about the track from the youtube_dl info (or a player that has the same attributes as one)."""
+        get = info.get if isinstance(info, dict) else functools.partial(getattr, info)
+
+        # Twitch streams have their title in the description, create_ytdl_player does the same
+        if "twitch" in self.url:
+            self.title = get("description", None)
+            self.description = None
+        else:
+            self.title = get("title", None)
+            self.description = get("description", None)
+
+        self.uploader = get("uploader", None)
+        self.duration = get("duration", None)
+
+    @property
+    def volume(self) -> float:
+        return self._volume if self.player is None else self.player.volume
+
+    @volume.setter
+    def volume(self, value: float):
+        self._volume = value
+        if self.player is not None:
+            self.player.volume = value
+
+    def is_playing(self) -> bool:
+        """Returns True if the track is playing, or if it is going to as soon as its player is loaded."""
+        if self.is_started:
+            return self.player.is_playing()
+
+        return self.should_play and not self.is_stopped
+
+    async def instantiate(self):
+        """Creates the player of the entry if it doesn't have one yet, and returns it. Calls while the player is being created wait for the same player."""
+        if self.player is None:
+            if self.player_future is None:
+                self.player_future = asyncio.ensure_future(self._create_player())
+
+            try:
+                await asyncio.shield(self.player_future)
+            except Exception:
+                # We try again the next time, the error might have been temporary
+                self.player_future = None
+                raise
+
+        return self.player
+
+    async def _create_player(self):
+        client = helpers.actual_client
+        voice = client.voice_client_in(client.get_server(self.server_id))
+        if voice is None:
+            raise RuntimeError("There is no voice client on server {0}.".format(self.server_id))
+
+        player = await ytdl_extractor.create_player(voice, self.url, after=self.after)
+        metrics["instantiated"] += 1
+
+        # The entry might have been removed from the queue while we created the player, a player that isn't started only has to be stopped to end its ffmpeg process
+        if self.is_stopped:
+            player.stop()
+            metrics["discarded"] += 1
+            return
+
+        player.volume = self._volume
+        self.player = player
+        self.set_info(player)
+
+    def prefetch(self):
+        """Starts creating the player of the entry in the background, so it can start right away when it gets to the front of the queue."""
+        if self.player is None and self.player_future is None and not self.is_stopped:
+            metrics["prefetched"] += 1
+            asyncio.run_coroutine_threadsafe(self._prefetch(), helpers.actual_client.loop)
+
+    async def _prefetch(self):
+        try:
+            await self.instantiate()
+        except Exception as e:
+            # The entry tries again when it's started, and handles the error then
+            helpers.log_info("Was not able to prefetch audio at url {0}: {1}".format(self.url, str(e)))
+
+    def start(self):
+        """Starts playing the entry, creating its player first if it doesn't have one. This can be called from any thread."""
+        self.should_play = True
+
+        if self.player is not None:
+            self._start_player()
+        else:
+            asyncio.run_coroutine_threadsafe(self._start_when_ready(), helpers.actual_client.loop)
+
+    async def _start_when_ready(self):
+        try:
+            await self.instantiate()
+        except Exception as e:
+            # We can't play the entry, so we handle it like a track that ended, which moves the queue on
+            helpers.log_info("Was not able to load audio at url {0}, skipping it: {1}".format(self.url, str(e)))
+            self.stop()
+            return
+
+        # The entry might have been paused or stopped while its player was created
+        if self.should_play and not self.is_stopped:
+            self._start_player()
+
+    def _start_player(self):
+        if self.is_started:
+            self.player.resume()
+        else:
+            self.is_started = True
+            self.player.start()
+            _record_gap(self.server_id)
+
+        helpers.actual_client.loop.call_soon_threadsafe(self._check_near_end)
+
+    def get_elapsed_seconds(self) -> float:
+        """Returns how many seconds of the track have been played, the time the player was paused doesn't count."""
+        if not self.is_started:
+            return 0.
+
+        return self.played_seconds + getattr(self.player, "loops", 0) * self.player.delay
+
+    def pause(self):
+        self.should_play = False
+        if self.is_started and self.player.is_playing():
+            self.played_seconds = self.get_elapsed_seconds()
+            self.player.pause()
+
+    def resume(self):
+        self.start()
+
+    def stop(self):
+        """Stops the entry for good, the after callback is called with it (or its player) once it has stopped. This can be called from any thread."""
+        self.is_stopped = True
+        self.should_play = False
+
+        if self.is_started:
+            # The player's thread calls after when the player has stopped
+            self.player.stop()
+            return
+
+        if self.player is not None:
+            # The player was never started, so stopping it just ends its ffmpeg process
+            self.player.stop()
+            metrics["discarded"] += 1
+
+        # Nothing was playing, so we call after ourselves, on the event loop so it never runs in the middle of the caller's code
+        helpers.actual_client.loop.call_soon_threadsafe(self.after, self)
+
+    def _check_near_end(self):
+        """Calls near_end if the track is within the prefetch window of its end, and checks again later if it isn't. This runs on the event loop."""
+        if self.near_end_handle is not None:
+            self.near_end_handle.cancel()
+            self.near_end_handle = None
+
+        if self.is_stopped or not self.is_started or self.duration is None:
+            return
+
+        remaining_seconds = self.duration - self.get_elapsed_seconds()
+        if remaining_seconds > settings["prefetch_window_seconds"]:
+            self.near_end_handle = helpers.actual_client.loop.call_later(
+                remaining_seconds - settings["prefetch_window_seconds"], self._check_near_end)
+            return
+
+        self.near_end(self)
+
+
+def entry_from_player(player, server_id: str, requester: str, after, near_end) -> QueueEntry:
+    """Makes an entry of a player that has already been created (and possibly started), this is used by the code that needs the player right away."""
+    entry = QueueEntry(server_id, player.url, player, requester, after, near_end)
+    entry.player = player
+    entry._volume = player.volume
+    return entry
+
+
+async def create_entry(server_id: str, url: str, requester: str, after, near_end) -> QueueEntry:
+    """Makes an entry for the url with the info youtube_dl gets for it (or the cached info), without creating a player.
+    Raises the errors of ytdl_extractor.get_info if the url can't be loaded."""
+    return QueueEntry(server_id, url, await ytdl_extractor.get_info(url), requester, after, near_end)
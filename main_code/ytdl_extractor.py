@@ -0,0 +1,237 @@
+import asyncio
+import collections
+import concurrent.futures
+import concurrent.futures.process
+import time
+import urllib.parse
+
+import youtube_dl
+
+"""This file handles getting the info of the urls that the voice commands play from youtube_dl.
+The extraction runs in a pool of worker processes, so a burst of play commands can't starve the event loop (youtube_dl does a lot of pure python work),
+and at most max_pending extractions can be waiting at a time, the ones that don't fit are rejected.
+The results (the info we show and the url of the audio stream) are kept in a ttl and lru bound cache keyed by the normalized url,
+so playing a track again, looping a playlist or restoring the voice state after a restart only costs a cache hit.
+The players are then created from the cached stream url with create_ffmpeg_player, instead of create_ytdl_player doing its own extraction."""
+
+# The youtube_dl options that create_ytdl_player uses, with noplaylist added like all the voice commands do
+ytdl_options = {"format": "webm[abr>0]/bestaudio/best", "prefer_ffmpeg": True, "noplaylist": True}
+
+# The default settings, these can be overridden by the ytdl_extractor section of the config
+default_settings = {
+    # The number of worker processes, this is only read when the pool is started
+    "worker_processes": 2,
+    # The max number of extractions that can be running or waiting at a time
+    "max_pending": 16,
+    # The max number of urls in the cache, and how long (in seconds) their info stays in it
+    "cache_size": 512, "cache_ttl_seconds": 6 * 60 * 60,
+    # How long (in seconds) a stream url is used for if it doesn't say when it expires, and how long before it expires we stop using it
+    "stream_url_ttl_seconds": 30 * 60, "stream_url_margin_seconds": 5 * 60
+}
+settings = dict(default_settings)
+
+# The cache of the extracted infos, with the normalized urls as keys and (the time the info expires at, info) as values, in least recently used order
+cache = collections.OrderedDict()
+
+# The futures of the extractions that are running, with the normalized urls as keys, so concurrent requests for the same url share one extraction
+pending_extractions = {}
+
+# The pool of worker processes, it's started by start, and replaced by _run_extraction if it breaks
+_pool = None
+
+# Metrics about the extractions and the cache
+metrics = {"hits": 0, "misses": 0, "extractions": 0, "failures": 0, "rejected": 0, "evicted": 0}
+
+
+class ExtractionQueueFull(Exception):
+    """Raised when there are already max_pending extractions running or waiting."""
+    pass
+
+
+def configure(passed_config: dict):
+    """Loads the extractor settings from the config, this is called at startup and when the config is reloaded."""
+    settings.clear()
+    settings.update(default_settings)
+    settings.update(passed_config.get("ytdl_extractor", {}))
+
+
+def _noop():
+    """The job that the workers are started with, it has to be a module level function so it can be pickled."""
+    pass
+
+
+def _create_pool() -> list:
+    """Creates the pool of worker processes and submits a no-op job per worker, returns the futures of those jobs.
+    The pool only forks its workers when jobs are submitted, so without these jobs they'd be forked by the first extraction."""
+    global _pool
+    _pool = concurrent.futures.ProcessPoolExecutor(max_workers=settings["worker_processes"])
+    return [_pool.submit(_noop) for _ in range(settings["worker_processes"])]
+
+
+def start():
+    """Starts the pool of worker processes and waits until all its workers are running.
+    This is called at startup before the state store opens its database and before the client connects, so the workers aren't forked with those,
+    but the log pipeline's threads are already running by then."""
+    if _pool is None:
+        concurrent.futures.wait(_create_pool())
+
+
+def shutdown():
+    """Stops the pool of worker processes without waiting for the extractions that are running, this is called when we shut down."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+        _pool = None
+
+
+def normalize_url(url: str) -> str:
+    """Returns the url in the form that it's cached under, so the different forms of a youtube link (youtu.be, m.youtube.com, extra parameters) share a cache entry."""
+    parsed_url = urllib.parse.urlsplit(url.strip())
+    host = parsed_url.netloc.lower()
+
+    if host in ("youtu.be", "www.youtu.be"):
+        return "https://www.youtube.com/watch?v=" + parsed_url.path.lstrip("/")
+
+    if host in ("youtube.com", "www.youtube.com", "m.youtube.com", "music.youtube.com") and parsed_url.path == "/watch":
+        video_ids = urllib.parse.parse_qs(parsed_url.query).get("v")
+        if video_ids:
+            return "https://www.youtube.com/watch?v=" + video_ids[0]
+
+    # We don't know the other sites, so we only drop the fragment and lowercase the parts that aren't case sensitive
+    return urllib.parse.urlunsplit((parsed_url.scheme.lower(), host, parsed_url.path, parsed_url.query, ""))
+
+
+def _extract(url: str) -> dict:
+    """Gets the info of the url from youtube_dl without downloading anything, this runs in a worker process.
+    Only the fields we use are returned, so we don't send the whole info dict (with all the formats) back to the bot's process."""
+    try:
+        info = youtube_dl.YoutubeDL(ytdl_options).extract_info(url, download=False)
+    except youtube_dl.DownloadError as e:
+        # We raise a plain DownloadError, as the exception has to be pickled, and the one youtube_dl raises holds a traceback
+        raise youtube_dl.DownloadError(str(e))
+
+    # If the url is a playlist, the first entry is used, create_ytdl_player does the same
+    if "entries" in info:
+        info = info["entries"][0]
+
+    return {key: info.get(key) for key in ("title", "uploader", "duration", "description", "url", "is_live")}
+
+
+def _get_stream_expiry_time(info: dict, extracted_time: float) -> float:
+    """Returns the epoch time at which the stream url of the info expires, youtube's stream urls have it in their expire parameter."""
+    expire_values = urllib.parse.parse_qs(urllib.parse.urlsplit(info["url"] or "").query).get("expire")
+    if expire_values and expire_values[0].isdigit():
+        return float(expire_values[0])
+
+    return extracted_time + settings["stream_url_ttl_seconds"]
+
+
+def _get_cached(key: str, need_stream_url: bool):
+    """Returns the cached info of the normalized url, or None if it isn't cached, it has expired, or if its stream url has (when need_stream_url is True)."""
+    cached = cache.get(key)
+    if cached is None:
+        return None
+
+    expiry_time, info = cached
+    now = time.time()
+    if now >= expiry_time or (need_stream_url and now >= info["stream_expiry_time"] - settings["stream_url_margin_seconds"]):
+        return None
+
+    # The entry is now the most recently used one
+    cache.move_to_end(key)
+    return info
+
+
+def _add_to_cache(key: str, info: dict):
+    cache.pop(key, None)
+    cache[key] = (time.time() + settings["cache_ttl_seconds"], info)
+
+    # We evict the least recently used infos if we have too many
+    while len(cache) > settings["cache_size"]:
+        cache.popitem(last=False)
+        metrics["evicted"] += 1
+
+
+async def get_info(url: str, need_stream_url: bool = False) -> dict:
+    """Returns the info of the url (title, uploader, duration, description, the stream url and stream_expiry_time), from the cache if it's there.
+    If need_stream_url is True, the info is extracted again if its stream url is about to expire.
+    Raises youtube_dl.DownloadError if the url can't be loaded, and ExtractionQueueFull if there are too many extractions already."""
+    key = normalize_url(url)
+
+    info = _get_cached(key, need_stream_url)
+    if info is not None:
+        metrics["hits"] += 1
+        return info
+
+    metrics["misses"] += 1
+
+    # If the url is already being extracted, we wait for that extraction
+    future = pending_extractions.get(key)
+    if future is None:
+        if len(pending_extractions) >= settings["max_pending"]:
+            metrics["rejected"] += 1
+            raise ExtractionQueueFull()
+
+        future = pending_extractions[key] = asyncio.ensure_future(_run_extraction(key))
+        future.add_done_callback(_on_extraction_done)
+
+    return await asyncio.shield(future)
+
+
+def _on_extraction_done(future: asyncio.Future):
+    """Removes the extraction from the pending ones. We get its exception here, so it isn't logged as never retrieved if everyone waiting for it was cancelled."""
+    for key, pending_future in list(pending_extractions.items()):
+        if pending_future is future:
+            del pending_extractions[key]
+
+    if not future.cancelled():
+        future.exception()
+
+
+async def _run_extraction(key: str) -> dict:
+    # We don't wait for the workers if the pool has to be created here, as that would block the event loop, the extraction just waits behind the no-op jobs
+    if _pool is None:
+        _create_pool()
+    pool = _pool
+
+    metrics["extractions"] += 1
+    extracted_time = time.time()
+    try:
+        info = await asyncio.get_event_loop().run_in_executor(pool, _extract, key)
+    except concurrent.futures.process.BrokenProcessPool:
+        # A worker died, so we replace the pool right away (unless another extraction already did), and start its workers now instead of on the next extraction
+        metrics["failures"] += 1
+        if _pool is pool:
+            shutdown()
+            _create_pool()
+        raise
+    except Exception:
+        metrics["failures"] += 1
+        raise
+
+    info["stream_expiry_time"] = _get_stream_expiry_time(info, extracted_time)
+    _add_to_cache(key, info)
+    return info
+
+
+async def create_player(voice, url: str, after=None):
+    """Creates an ffmpeg player for the url on the voice client from the cached info (extracting it if it isn't cached), this replaces voice.create_ytdl_player.
+    The player gets the same attributes that create_ytdl_player gives it."""
+    info = await get_info(url, need_stream_url=True)
+
+    player = voice.create_ffmpeg_player(info["url"], after=after)
+    player.download_url = info["url"]
+    player.url = url
+    player.is_live = bool(info["is_live"])
+    player.duration = info["duration"]
+    player.uploader = info["uploader"]
+
+    # Twitch streams have their title in the description, create_ytdl_player does the same
+    if "twitch" in url:
+        player.title = info["description"]
+        player.description = None
+    else:
+        player.title = info["title"]
+        player.description = info["description"]
+
+    return player